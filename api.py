@@ -0,0 +1,241 @@
+"""
+Headless HTTP/JSON API for the chatbot workflows, served alongside the Streamlit UI.
+Exposes Q&A, summarization, quiz generation, and grading with optional streaming responses.
+Models and the index are loaded once per process and shared by all requests. Requests carry
+all the state they need (no server-side sessions), so replicas can sit behind a load balancer.
+
+Usage:
+    uvicorn api:app --host 0.0.0.0 --port 8000 --workers 2
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from models import load_embeddings, load_llm
+from document_loader import load_vector_store
+from instrumentation import metrics
+from router import ModelRouter, build_router
+from sharding import ShardedIndex
+from workflows import qa_workflow, summarize_workflow, map_reduce_summarize_workflow, list_sources, quiz_workflow, grade_workflow
+from defaults import DEFAULT_LLM_MODEL, DEFAULT_LLM_TEMPERATURE, DEFAULT_EMBEDDING_MODEL, DEFAULT_FAISS_PATH, DEFAULT_MODEL_ROUTING, \
+    DEFAULT_INDEX_SHARDING
+
+
+
+FAISS_PATH = os.environ.get("SOLOMIND_FAISS_PATH", DEFAULT_FAISS_PATH)
+# Maximum number of workflow calls running at once in this process (the LLM is the bottleneck)
+MAX_CONCURRENCY = int(os.environ.get("SOLOMIND_API_MAX_CONCURRENCY", "4"))
+
+
+
+# ------------------------------
+# Request Schemas
+# ------------------------------
+class QARequest(BaseModel):
+    question: str
+    stream: bool = False
+
+
+class SummarizeRequest(BaseModel):
+    topic: str
+    source: Optional[str] = None  # Summarize every chunk of this source file
+    hierarchical: bool = False  # Map-reduce over a broader set of chunks
+    stream: bool = False
+
+
+class QuizRequest(BaseModel):
+    topic: str
+    num_questions: int = Field(5, ge=1, le=20)
+    previous_questions: List[str] = Field(default_factory=list, description="Questions from previous quizzes to avoid repeating")
+
+
+class GradeRequest(BaseModel):
+    topic: str
+    questions: List[str]
+    user_answers: List[str]
+    correct_answers: List[str]
+    topics_covered: List[str] = Field(default_factory=list)
+    stream: bool = False
+
+
+
+# ------------------------------
+# Shared Process State
+# ------------------------------
+def load_index(embeddings):
+    """
+    Open the sharded index (when sharding is enabled and shards have been built) or the single published index.
+    """
+    if DEFAULT_INDEX_SHARDING:
+        sharded = ShardedIndex.open(FAISS_PATH, embeddings)
+        if sharded is not None:
+            return sharded
+    return load_vector_store(FAISS_PATH, embeddings)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Load the embeddings model, LLM client (or model router), and index once for the whole process.
+    """
+    app.state.embeddings = await run_in_threadpool(load_embeddings, DEFAULT_EMBEDDING_MODEL)
+    if DEFAULT_MODEL_ROUTING:
+        app.state.llm = await run_in_threadpool(build_router, temperature=DEFAULT_LLM_TEMPERATURE)
+    else:
+        app.state.llm = load_llm(DEFAULT_LLM_MODEL, DEFAULT_LLM_TEMPERATURE)
+    app.state.vectorstore = await run_in_threadpool(load_index, app.state.embeddings)
+    app.state.limiter = asyncio.Semaphore(MAX_CONCURRENCY)
+    yield
+
+
+app = FastAPI(title="SoloMind API", lifespan=lifespan)
+
+
+
+def build_session_state(topics_covered=()):
+    """
+    Build the minimal session state object the workflows expect from request data.
+    """
+    return SimpleNamespace(learning_progress={
+        'topics_covered': set(topics_covered),
+        'quiz_scores': {},
+    })
+
+
+
+def require_vectorstore():
+    """
+    Get the shared vectorstore or fail the request if no index has been built yet.
+    """
+    if app.state.vectorstore is None:
+        raise HTTPException(status_code=503, detail=f"No index found at {FAISS_PATH}. Upload or ingest course materials first.")
+    return app.state.vectorstore
+
+
+
+async def run_workflow(func, *args, stream=False, **kwargs):
+    """
+    Run a blocking workflow in the threadpool, bounded by the process-wide concurrency limit.
+    Streaming workflows keep their slot until the response has been fully sent.
+    """
+    limiter = app.state.limiter
+    if not stream:
+        async with limiter:
+            return await run_in_threadpool(func, *args, **kwargs)
+    await limiter.acquire()
+    try:
+        chunks = await run_in_threadpool(func, *args, stream=True, **kwargs)
+    except BaseException:
+        limiter.release()
+        raise
+
+    async def body():
+        try:
+            async for chunk in iterate_in_threadpool(chunks):
+                yield chunk
+        finally:
+            limiter.release()
+    return StreamingResponse(body(), media_type="text/plain; charset=utf-8")
+
+
+
+# ------------------------------
+# Endpoints
+# ------------------------------
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok", "index_loaded": app.state.vectorstore is not None,
+            "index_version": getattr(app.state.vectorstore, "snapshot_version", None)}
+
+
+@app.get("/metrics")
+async def get_metrics(format: str = "prometheus"):
+    """
+    Export per-stage latency, token, and cache metrics as Prometheus text (default) or JSON.
+    """
+    if format == "json":
+        return metrics.to_json()
+    return PlainTextResponse(metrics.to_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/router")
+async def router_stats():
+    """
+    Per-tier model, queue depth, and recent latency of the model router.
+    """
+    if not isinstance(app.state.llm, ModelRouter):
+        raise HTTPException(status_code=404, detail="Model routing is disabled")
+    return app.state.llm.stats()
+
+
+@app.get("/shards")
+async def shards():
+    """
+    Per-worker shards, chunk counts, index size, and peak memory of the sharded index.
+    """
+    if not isinstance(app.state.vectorstore, ShardedIndex):
+        raise HTTPException(status_code=404, detail="Index sharding is disabled or no shards have been built")
+    return await run_in_threadpool(app.state.vectorstore.stats)
+
+
+@app.post("/reload-index")
+async def reload_index():
+    """
+    Reload the published index snapshot, e.g. after a batch ingestion run.
+    Requests already running keep searching the version they started with.
+    """
+    # A previous sharded index stops its workers once the requests still using it finish
+    vectorstore = await run_in_threadpool(load_index, app.state.embeddings)
+    if vectorstore is not None or app.state.vectorstore is None:
+        app.state.vectorstore = vectorstore
+    return {"index_loaded": app.state.vectorstore is not None,
+            "index_version": getattr(app.state.vectorstore, "snapshot_version", None)}
+
+
+@app.post("/qa")
+async def qa(request: QARequest):
+    vectorstore = require_vectorstore()
+    result = await run_workflow(qa_workflow, request.question, vectorstore, app.state.llm,
+                                stream=request.stream)
+    return result if request.stream else {"response": result}
+
+
+@app.post("/summarize")
+async def summarize(request: SummarizeRequest):
+    vectorstore = require_vectorstore()
+    # Scans the whole docstore (or asks every shard worker), so it must not block the event loop
+    if request.source and request.source not in await run_in_threadpool(list_sources, vectorstore):
+        raise HTTPException(status_code=404, detail=f"Source not indexed: {request.source}")
+    if request.source or request.hierarchical:
+        result = await run_workflow(map_reduce_summarize_workflow, request.topic, vectorstore, app.state.llm,
+                                    build_session_state(), source=request.source, stream=request.stream)
+    else:
+        result = await run_workflow(summarize_workflow, request.topic, vectorstore, app.state.llm,
+                                    build_session_state(), stream=request.stream)
+    return result if request.stream else {"response": result}
+
+
+@app.post("/quiz")
+async def quiz(request: QuizRequest):
+    vectorstore = require_vectorstore()
+    return await run_workflow(quiz_workflow, request.topic, vectorstore, app.state.llm, build_session_state(),
+                              request.num_questions, previous_questions=request.previous_questions)
+
+
+@app.post("/grade")
+async def grade(request: GradeRequest):
+    if len(request.user_answers) != len(request.correct_answers):
+        raise HTTPException(status_code=422, detail="user_answers and correct_answers must have the same length")
+    session_state = build_session_state(topics_covered=request.topics_covered)
+    result = await run_workflow(grade_workflow, request.questions, request.user_answers, request.correct_answers,
+                                request.topic, app.state.llm, session_state, stream=request.stream)
+    score = sum(ua == ca for ua, ca in zip(request.user_answers, request.correct_answers)) / max(len(request.correct_answers), 1)
+    if request.stream:
+        result.headers["X-Quiz-Score"] = f"{score:.4f}"
+        return result
+    return {"score": score, "feedback": result}
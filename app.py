@@ -1,16 +1,16 @@
 """
 Main Streamlit app file for the Study Companion Chatbot.
 Handles UI layout, workflow selection, chat interface, and integrates all core modules.
+Heavy dependencies (torch, LangChain, the document parsers) are imported on first use and the embeddings
+model loads on a background thread, so the UI shell renders immediately on a cold start.
 """
 import streamlit as st
 import os
 import tempfile
-from models import init_embeddings, init_llm
-from document_loader import load_document_and_index
-from workflows import get_workflow, summarize_workflow, quiz_workflow, grade_workflow, qa_workflow
+from models import start_embeddings_loading, embeddings_ready, get_embeddings, init_llm, init_router
 from ui_components import render_message, render_footer, stream_response, display_learning_progress, render_file_upload_section
 from session_state import init_session_state, update_quiz_state, update_quiz_score
-from defaults import DEFAULT_LLM_MODEL, DEFAULT_LLM_TEMPERATURE, DEFAULT_EMBEDDING_MODEL
+from defaults import DEFAULT_LLM_MODEL, DEFAULT_LLM_TEMPERATURE, DEFAULT_EMBEDDING_MODEL, DEFAULT_MODEL_ROUTING
 
 
 
@@ -38,10 +38,20 @@ if not os.path.exists(DATA_DIR):
 # ------------------------------
 st.set_page_config(page_title="SoloMind", layout="wide")
 st.title("📘 Chatbot Workspace")
-# Initialize session state and models
+# Initialize session state and start loading the embeddings model in the background
 init_session_state()
-embeddings = init_embeddings(model_name=DEFAULT_EMBEDDING_MODEL)
-llm = init_llm(model_name=DEFAULT_LLM_MODEL, temperature=DEFAULT_LLM_TEMPERATURE)
+start_embeddings_loading(model_name=DEFAULT_EMBEDDING_MODEL)
+
+
+
+def get_llm():
+    """
+    Create the LLM client on first use (defers importing langchain-ollama until a response is needed).
+    With model routing enabled this is the shared router, which picks a model per workflow and load.
+    """
+    if DEFAULT_MODEL_ROUTING:
+        return init_router(temperature=DEFAULT_LLM_TEMPERATURE)
+    return init_llm(model_name=DEFAULT_LLM_MODEL, temperature=DEFAULT_LLM_TEMPERATURE)
 
 
 
@@ -51,7 +61,10 @@ llm = init_llm(model_name=DEFAULT_LLM_MODEL, temperature=DEFAULT_LLM_TEMPERATURE
 with st.sidebar:
     st.image(os.path.join("logo", "SoloMind-Logo.png"), width=130)
     # Render file upload section
-    render_file_upload_section(embeddings, FAISS_PATH, TEXT_STORE_PATH)
+    # Ingestion runs on a worker thread and waits for the background-loaded model there (a failed load is retried)
+    render_file_upload_section(lambda: get_embeddings(model_name=DEFAULT_EMBEDDING_MODEL), FAISS_PATH, TEXT_STORE_PATH)
+    if not embeddings_ready(model_name=DEFAULT_EMBEDDING_MODEL):
+        st.caption("⏳ Loading the embedding model in the background...")
     # --- Workflow Selection Dropdown ---
     st.header("⚙️ Choose Chat Mode")
     chat_modes = ["Default (Q&A)", "Summarize", "Quiz"]
@@ -59,6 +72,9 @@ with st.sidebar:
         st.session_state.selected_workflow = chat_modes[0]
     selected_mode = st.selectbox("Select using the dropdown menu:", chat_modes, index=chat_modes.index(st.session_state.selected_workflow))
     st.session_state.selected_workflow = selected_mode
+    if selected_mode == "Summarize":
+        st.checkbox("Broad summary (covers more material, slower)", key="broad_summary",
+                    help="Summarizes many chunks in parallel groups and merges them. Naming an uploaded file (e.g. \"summarize pos-tagging.pptx\") summarizes the whole file.")
     # Display learning progress
     display_learning_progress(st.session_state.learning_progress)
     # Add footer
@@ -106,7 +122,8 @@ if st.session_state.selected_workflow == "Quiz":
         # Quiz complete, grade and show feedback
         topic = st.session_state.get("last_quiz_topic", "General")
         score = sum(ua == ca for ua, ca in zip(user_answers, correct_answers)) / len(correct_answers)
-        feedback = grade_workflow(quiz_data, user_answers, correct_answers, topic, llm, st.session_state)
+        from workflows import grade_workflow
+        feedback = grade_workflow(quiz_data, user_answers, correct_answers, topic, get_llm(), st.session_state)
         update_quiz_score(topic, score, feedback, user_answers, correct_answers)
         update_quiz_state()  # Reset quiz state
         st.session_state['quiz_current_index'] = 0
@@ -130,8 +147,9 @@ if st.session_state.selected_workflow == "Quiz":
                 st.error("Please upload study materials before starting a quiz!")
             else:
                 with st.spinner("Generating quiz questions..."):
+                    from workflows import quiz_workflow
                     st.session_state["last_quiz_topic"] = quiz_topic
-                    quiz_data = quiz_workflow(quiz_topic, st.session_state.vectorstore, llm, st.session_state, num_questions)
+                    quiz_data = quiz_workflow(quiz_topic, st.session_state.vectorstore, get_llm(), st.session_state, num_questions)
                     update_quiz_state(quiz_data)
                     st.session_state['quiz_current_index'] = 0
                     st.session_state['user_quiz_answers'] = []
@@ -160,12 +178,17 @@ else:
 
 if prompt:
     if not st.session_state.vectorstore:
-        st.error("Please upload some course materials or notes first!")
+        if 'ingestion_manager' in st.session_state and st.session_state.ingestion_manager.has_active_jobs():
+            st.info("Your documents are still being indexed. Please ask again in a moment!")
+        else:
+            st.error("Please upload some course materials or notes first!")
         st.stop()
     # Add user message to chat history
     st.session_state.messages.append({"role": "user", "content": prompt})
     with st.chat_message("user"):
         st.write(prompt)
+    from workflows import get_workflow, summarize_workflow, map_reduce_summarize_workflow, find_source_in_topic, qa_workflow
+    llm = get_llm()
     # Determine workflow from dropdown selection or fallback
     mode_map = {
         "Default (Q&A)": "default",
@@ -179,8 +202,12 @@ if prompt:
         response = None
         if workflow == "summarize":
             topic = prompt.replace("summarize", "").replace("summary", "").strip()
+            source = find_source_in_topic(st.session_state.vectorstore, topic)
             with st.spinner("Generating summary..."):
-                response = summarize_workflow(topic, st.session_state.vectorstore, llm, st.session_state)
+                if source or st.session_state.get("broad_summary"):
+                    response = map_reduce_summarize_workflow(topic, st.session_state.vectorstore, llm, st.session_state, source=source)
+                else:
+                    response = summarize_workflow(topic, st.session_state.vectorstore, llm, st.session_state)
         # elif workflow == "quiz":
         #     # Store the topic for quiz use
         #     topic = prompt.replace("quiz", "").replace("test me", "").replace("quiz me", "").strip()
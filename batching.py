@@ -0,0 +1,183 @@
+"""
+Cross-session micro-batching of query embeddings and vector searches.
+Concurrent callers (Streamlit sessions, API requests) submit queries to a shared batcher; requests that arrive
+within `max_wait_ms` of each other (up to `max_batch_size`) are searched with one batched FAISS call per index,
+and each caller gets back only its own results. Queries are embedded with the model's query-side embedding in
+one model call (see embed_queries), so results match unbatched searches.
+"""
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from defaults import DEFAULT_QUERY_BATCHING, DEFAULT_QUERY_BATCH_MAX_WAIT_MS, DEFAULT_QUERY_BATCH_MAX_SIZE
+
+
+
+SearchRequest = namedtuple("SearchRequest", ["vectorstore", "query", "k", "future"])
+
+
+
+class QueryBatcher:
+    """
+    Collects similarity-search requests from many threads and serves them in batches on one worker thread.
+    With enabled=False, searches run directly in the calling thread. close() stops the worker thread.
+    """
+    def __init__(self, max_wait_ms=DEFAULT_QUERY_BATCH_MAX_WAIT_MS, max_batch_size=DEFAULT_QUERY_BATCH_MAX_SIZE,
+                 enabled=DEFAULT_QUERY_BATCHING):
+        self.max_wait_ms = max_wait_ms
+        self.max_batch_size = max_batch_size
+        self.enabled = enabled
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self.batches = 0
+        self.requests = 0
+
+    def similarity_search(self, vectorstore, query, k=4):
+        """
+        Same results as vectorstore.similarity_search(query, k), served as part of a micro-batch.
+        """
+        if not self.enabled or self.max_batch_size <= 1:
+            return vectorstore.similarity_search(query, k=k)
+        future = Future()
+        self._submit(SearchRequest(vectorstore, query, k, future))
+        return future.result()
+
+    def _submit(self, request):
+        # Queued under the lock, so close() never leaves a request behind a stopped worker
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+                self._worker.start()
+            self._queue.put(request)
+
+    def close(self):
+        """
+        Serve the queued requests, then stop the worker thread (a later search starts a new one).
+        """
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                self._queue.put(None)
+                self._worker.join()
+            self._worker = None
+
+    def _collect(self):
+        """
+        Block for the first request, then gather more until the batch is full or max_wait_ms has passed.
+        Returns the batch and whether close() asked the worker to stop.
+        """
+        batch = []
+        request = self._queue.get()
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while request is not None:
+            batch.append(request)
+            remaining = deadline - time.perf_counter()
+            if len(batch) >= self.max_batch_size or remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+        return batch, request is None
+
+    def _run(self):
+        while True:
+            batch, stopping = self._collect()
+            if batch:
+                self.batches += 1
+                self.requests += len(batch)
+                try:
+                    self._process(batch)
+                except Exception as e:
+                    for request in batch:
+                        if not request.future.done():
+                            request.future.set_exception(e)
+            if stopping:
+                return
+
+    def _process(self, batch):
+        # Queries grouped by embedding model, then one search call per index
+        by_embeddings = {}
+        for request in batch:
+            by_embeddings.setdefault(id(request.vectorstore.embedding_function), []).append(request)
+        for requests in by_embeddings.values():
+            embedding_function = requests[0].vectorstore.embedding_function
+            queries = [request.query for request in requests]
+            vectors = embed_queries(embedding_function, queries)
+            by_store = {}
+            for request, vector in zip(requests, vectors):
+                by_store.setdefault(id(request.vectorstore), []).append((request, vector))
+            for items in by_store.values():
+                store_requests = [request for request, _ in items]
+                try:
+                    results = search_batch(store_requests[0].vectorstore, [vector for _, vector in items],
+                                           [request.k for request in store_requests])
+                except Exception as e:
+                    for request in store_requests:
+                        request.future.set_exception(e)
+                    continue
+                for request, docs in zip(store_requests, results):
+                    request.future.set_result(docs)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": self.requests / max(self.batches, 1),
+        }
+
+
+
+def embed_queries(embedding_function, queries):
+    """
+    Embed several queries exactly as embed_query would, in one model call where the model allows it:
+    models with a batched `embed_queries` (the ONNX backends), and sentence-transformers HuggingFaceEmbeddings,
+    which encode queries with `query_encode_kwargs` (falling back to the document settings when they are empty).
+    Other models embed one query at a time.
+    """
+    if hasattr(embedding_function, "embed_queries"):
+        return embedding_function.embed_queries(queries)
+    client = getattr(embedding_function, "client", None)
+    if hasattr(embedding_function, "query_encode_kwargs") and hasattr(client, "encode") \
+            and not getattr(embedding_function, "multi_process", False):
+        if not embedding_function.query_encode_kwargs:
+            return embedding_function.embed_documents(queries)
+        texts = [query.replace("\n", " ") for query in queries]
+        return client.encode(texts, **embedding_function.query_encode_kwargs).tolist()
+    if hasattr(embedding_function, "embed_query"):
+        return [embedding_function.embed_query(query) for query in queries]
+    return [embedding_function(query) for query in queries]
+
+
+
+def search_batch(vectorstore, vectors, ks):
+    """
+    Search several query vectors against one vectorstore, returning a list of documents per query.
+    Plain L2 FAISS stores are searched with a single index call, and sharded indexes with one scatter-gather
+    round; other stores (quantized with re-scoring, normalized, or non-FAISS) are searched one vector at a time
+    with their own logic.
+    """
+    if hasattr(vectorstore, "similarity_search_batch"):
+        return vectorstore.similarity_search_batch(vectors, ks)
+    if type(vectorstore) is not FAISS or getattr(vectorstore, "_normalize_L2", False):
+        return [vectorstore.similarity_search_by_vector(vector, k=k) for vector, k in zip(vectors, ks)]
+    matrix = np.asarray(vectors, dtype=np.float32)
+    _, indices = vectorstore.index.search(matrix, max(ks))
+    results = []
+    for row, k in zip(indices, ks):
+        docs = []
+        for i in row[:k]:
+            if i == -1:
+                continue
+            doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(i)])
+            if not isinstance(doc, str):  # The docstore returns an error string for missing ids
+                docs.append(doc)
+        results.append(docs)
+    return results
+
+
+
+query_batcher = QueryBatcher()
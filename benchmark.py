@@ -0,0 +1,525 @@
+"""
+Reproducible end-to-end benchmarks for ingestion, retrieval, and workflows.
+Uses the files in course-materials-for-testing/ plus synthetic scaled-up corpora, and a deterministic
+stub LLM so workflow timings measure our own overhead rather than the model.
+Results are written as JSON and can be compared against a previous run to catch regressions.
+
+Usage:
+    python benchmark.py --output bench.json
+    python benchmark.py --output new.json --compare bench.json --threshold 0.15
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import numpy as np
+import faiss
+import fitz
+from pptx import Presentation
+from langchain_community.vectorstores import FAISS
+from document_loader import extract_text_from_pdf, extract_text_from_pptx
+from ingest import find_course_files
+from quantization import storage_report
+from models import load_embeddings
+from stub_llm import StubLLM
+from router import ModelRouter
+from batching import QueryBatcher, search_batch
+from sharding import ShardedIndex, build_shards
+from workflows import qa_workflow, summarize_workflow, map_reduce_summarize_workflow, quiz_workflow, grade_workflow, \
+    partial_summary_cache, merged_summary_cache
+from defaults import DEFAULT_EMBEDDING_MODEL, DEFAULT_EMBEDDING_BATCH_SIZE
+
+
+
+MATERIALS_DIR = "course-materials-for-testing"
+BENCHMARK_QUERIES = [
+    "What is part-of-speech tagging?",
+    "How does Naive Bayes handle unknown words?",
+    "Explain precision, recall and the F measure",
+    "What is named entity recognition used for?",
+    "How do regular expressions use disjunction?",
+    "Why is ambiguity a problem in NLP?",
+    "What is the Porter stemmer?",
+    "How are sequence models used for NER?",
+]
+SEED = 1234
+# Stub generation speed for the routing benchmark when --stub-tokens-per-second is 0, and per-tier speedups
+ROUTING_STUB_TOKENS_PER_SECOND = 200.0
+STUB_TIER_SPEEDUPS = {"small": 4.0, "medium": 2.0, "large": 1.0}
+
+
+
+# ------------------------------
+# Helpers
+# ------------------------------
+def percentiles(samples_ms):
+    """
+    Summarize a list of latencies (in milliseconds).
+    """
+    arr = np.asarray(samples_ms, dtype=float)
+    return {
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p99_ms": float(np.percentile(arr, 99)),
+        "mean_ms": float(arr.mean()),
+        "samples": int(arr.size),
+    }
+
+
+
+def timed(func, *args, **kwargs):
+    """
+    Call func and return (result, elapsed milliseconds).
+    """
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, (time.perf_counter() - started) * 1000
+
+
+
+def count_units(path):
+    """
+    Count pages (PDF) or slides (PPTX) in a file.
+    """
+    if path.lower().endswith('.pdf'):
+        with fitz.open(path) as doc:
+            return doc.page_count
+    return len(Presentation(path).slides)
+
+
+
+def directory_size(path):
+    """
+    Total size in bytes of all files under a directory.
+    """
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+
+# ------------------------------
+# Benchmarks
+# ------------------------------
+def bench_extraction(files, repeat=3):
+    """
+    Measure extraction throughput (pages or slides per second) for each file type.
+    Returns the results and the extracted chunks from the last pass.
+    """
+    results = {}
+    chunks = []
+    for kind, extractor, suffixes in (("pdf", extract_text_from_pdf, ('.pdf',)),
+                                      ("pptx", extract_text_from_pptx, ('.pptx', '.ppt'))):
+        kind_files = [f for f in files if f.lower().endswith(suffixes)]
+        if not kind_files:
+            continue
+        units = sum(count_units(f) for f in kind_files)
+        best_seconds = None
+        for _ in range(repeat):
+            run_chunks = []
+            started = time.perf_counter()
+            for path in kind_files:
+                with open(path, "rb") as f:
+                    run_chunks.extend(extractor(f))
+            elapsed = time.perf_counter() - started
+            best_seconds = elapsed if best_seconds is None else min(best_seconds, elapsed)
+        chunks.extend(run_chunks)
+        results[kind] = {
+            "files": len(kind_files),
+            "pages": units,
+            "chunks": len(run_chunks),
+            "seconds": best_seconds,
+            "pages_per_second": units / max(best_seconds, 1e-9),
+        }
+    return results, chunks
+
+
+
+def make_image_heavy_pdf(pages=20, width=1600, height=1200):
+    """
+    Build an in-memory PDF resembling scanned lecture pages: one large incompressible image and a caption per page.
+    """
+    rng = np.random.default_rng(SEED)
+    doc = fitz.open()
+    for page_num in range(1, pages + 1):
+        page = doc.new_page()
+        samples = rng.integers(0, 256, size=width * height * 3, dtype=np.uint8).tobytes()
+        pix = fitz.Pixmap(fitz.csRGB, width, height, samples, False)
+        page.insert_image(fitz.Rect(36, 72, page.rect.width - 36, page.rect.height - 36), pixmap=pix)
+        page.insert_text((36, 48), f"Scanned lecture page {page_num}: regular expressions and tokenization")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+
+def bench_pdf_modes(pdf_files, scan_pages=20, repeat=3):
+    """
+    Compare the fast (text-only) and full PDF extraction paths on pages/sec and peak Python heap.
+    Peak memory comes from tracemalloc, so it counts Python-side allocations such as image payload bytes.
+    """
+    inputs = {"course_pdfs": []}
+    for path in pdf_files:
+        with open(path, "rb") as f:
+            inputs["course_pdfs"].append((os.path.basename(path), f.read()))
+    inputs["image_heavy_scans"] = [("synthetic-scan.pdf", make_image_heavy_pdf(scan_pages))]
+    results = {}
+    for corpus, docs in inputs.items():
+        pages = 0
+        for _, data in docs:
+            with fitz.open(stream=data, filetype="pdf") as doc:
+                pages += doc.page_count
+        results[corpus] = {}
+        for mode, fast in (("fast", True), ("full", False)):
+            best_seconds, peak_bytes = None, 0
+            for _ in range(repeat):
+                tracemalloc.start()
+                started = time.perf_counter()
+                for name, data in docs:
+                    buffer = io.BytesIO(data)
+                    buffer.name = name
+                    extract_text_from_pdf(buffer, fast=fast)
+                elapsed = time.perf_counter() - started
+                peak_bytes = max(peak_bytes, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+                best_seconds = elapsed if best_seconds is None else min(best_seconds, elapsed)
+            results[corpus][mode] = {
+                "pages": pages,
+                "seconds": best_seconds,
+                "pages_per_second": pages / max(best_seconds, 1e-9),
+                "peak_python_bytes": peak_bytes,
+            }
+    return results
+
+
+
+def bench_embedding(embeddings, texts, batch_size=DEFAULT_EMBEDDING_BATCH_SIZE):
+    """
+    Measure bulk embedding throughput in chunks per second, plus single-query latency.
+    """
+    vectors = []
+    started = time.perf_counter()
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(embeddings.embed_documents(texts[start:start + batch_size]))
+    elapsed = time.perf_counter() - started
+    query_ms = [timed(embeddings.embed_query, q)[1] for q in BENCHMARK_QUERIES * 3]
+    return {
+        "chunks": len(texts),
+        "batch_size": batch_size,
+        "seconds": elapsed,
+        "chunks_per_second": len(texts) / max(elapsed, 1e-9),
+        "query_latency": percentiles(query_ms),
+    }, np.asarray(vectors, dtype=np.float32)
+
+
+
+def synthesize_corpus(texts, metadatas, vectors, scale, noise=0.05):
+    """
+    Scale a real corpus up by `scale` copies. Copies get word-shuffled text and jittered, renormalized
+    vectors so they are distinct but keep the real corpus's distribution (no re-embedding needed).
+    """
+    rng = np.random.default_rng(SEED + scale)
+    shuffler = random.Random(SEED + scale)
+    out_texts, out_metadatas, out_vectors = list(texts), list(metadatas), [vectors]
+    for copy in range(1, scale):
+        for text in texts:
+            words = text.split()
+            shuffler.shuffle(words)
+            out_texts.append(" ".join(words))
+        out_metadatas.extend(dict(m, source=f"synthetic-{copy}-{m.get('source', 'unknown')}") for m in metadatas)
+        jittered = vectors + rng.normal(0, noise, vectors.shape).astype(np.float32)
+        jittered /= np.linalg.norm(jittered, axis=1, keepdims=True)
+        out_vectors.append(jittered)
+    return out_texts, out_metadatas, np.vstack(out_vectors)
+
+
+
+def bench_index_and_search(embeddings, texts, metadatas, vectors, scales, k=10, rounds=5):
+    """
+    For each corpus scale, measure index build time, on-disk size, and search latency.
+    Also returns a float16/int8 quantized storage report for the largest scale.
+    """
+    results = {}
+    query_vectors = [embeddings.embed_query(q) for q in BENCHMARK_QUERIES]
+    for scale in scales:
+        s_texts, s_metadatas, s_vectors = synthesize_corpus(texts, metadatas, vectors, scale)
+        vectorstore, build_ms = timed(
+            FAISS.from_embeddings, list(zip(s_texts, s_vectors.tolist())), embeddings, metadatas=s_metadatas
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            vectorstore.save_local(tmp)
+            size_bytes = directory_size(tmp)
+        search_ms = []
+        for _ in range(rounds):
+            for qv in query_vectors:
+                search_ms.append(timed(vectorstore.similarity_search_by_vector, qv, k=k)[1])
+        end_to_end_ms = [timed(vectorstore.similarity_search, q, k=k)[1] for q in BENCHMARK_QUERIES]
+        if scale == max(scales):
+            quantization = storage_report(s_vectors, np.asarray(query_vectors, dtype=np.float32), k=k)
+        results[str(scale)] = {
+            "chunks": len(s_texts),
+            "build_seconds": build_ms / 1000,
+            "index_bytes": size_bytes,
+            "search_latency": percentiles(search_ms),
+            "embed_and_search_latency": percentiles(end_to_end_ms),
+        }
+    return results, quantization
+
+
+
+def bench_workflows(vectorstore, llm, rounds=3):
+    """
+    Measure end-to-end workflow latency against the stub LLM.
+    """
+    session_state = SimpleNamespace(learning_progress={'topics_covered': set(), 'quiz_scores': {}})
+    timings = {"qa": [], "summarize": [], "summarize_map_reduce": [], "summarize_map_reduce_cached": [], "quiz": [], "grade": []}
+    for _ in range(rounds):
+        for query in BENCHMARK_QUERIES:
+            timings["qa"].append(timed(qa_workflow, query, vectorstore, llm)[1])
+            timings["summarize"].append(timed(summarize_workflow, query, vectorstore, llm, session_state)[1])
+            partial_summary_cache.clear()
+            merged_summary_cache.clear()
+            timings["summarize_map_reduce"].append(timed(map_reduce_summarize_workflow, query, vectorstore, llm, session_state)[1])
+            timings["summarize_map_reduce_cached"].append(timed(map_reduce_summarize_workflow, query, vectorstore, llm, session_state)[1])
+            quiz, quiz_ms = timed(quiz_workflow, query, vectorstore, llm, session_state, 5)
+            timings["quiz"].append(quiz_ms)
+            answers = quiz['answers']
+            timings["grade"].append(timed(
+                grade_workflow, quiz['questions'], answers, answers, query, llm, session_state
+            )[1])
+    return {name: percentiles(samples) for name, samples in timings.items()}
+
+
+
+def bench_query_batching(vectorstore, concurrency=(1, 8, 32), queries_per_client=8, k=10):
+    """
+    Compare similarity-search throughput and latency with and without cross-session micro-batching,
+    at several numbers of concurrent clients.
+    """
+    results = {}
+    batchers = (("direct", QueryBatcher(enabled=False)), ("batched", QueryBatcher()))
+    try:
+        for clients in concurrency:
+            for label, batcher in batchers:
+                def client(offset):
+                    return [timed(batcher.similarity_search, vectorstore, BENCHMARK_QUERIES[(offset + i) % len(BENCHMARK_QUERIES)], k)[1]
+                            for i in range(queries_per_client)]
+                before = batcher.stats()
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=clients) as executor:
+                    latencies = [ms for client_ms in executor.map(client, range(clients)) for ms in client_ms]
+                elapsed = time.perf_counter() - started
+                after = batcher.stats()
+                # Batch sizes of this concurrency level only (the batcher is reused across levels)
+                batches = after["batches"] - before["batches"]
+                results[f"{label}_clients_{clients}"] = dict(
+                    percentiles(latencies), queries_per_second=len(latencies) / elapsed,
+                    mean_batch_size=(after["requests"] - before["requests"]) / max(batches, 1) if batcher.enabled else 1.0,
+                )
+    finally:
+        for _, batcher in batchers:
+            batcher.close()
+    return results
+
+
+
+def bench_routing(vectorstore, tokens_per_second, rounds=3, burst=6):
+    """
+    Compare workflow latency on a single large stub model against the model router over stub tiers whose
+    speed scales with size, then send a burst of concurrent questions to exercise queue-depth fallback.
+    """
+    speed = tokens_per_second or ROUTING_STUB_TOKENS_PER_SECOND
+    backends = {tier: StubLLM(model=f"stub-{tier}", tokens_per_second=speed * factor)
+                for tier, factor in STUB_TIER_SPEEDUPS.items()}
+    results = {
+        "single_model": bench_workflows(vectorstore, backends["large"], rounds=rounds),
+        "routed": bench_workflows(vectorstore, ModelRouter(backends), rounds=rounds),
+    }
+    router = ModelRouter(backends)
+    with ThreadPoolExecutor(max_workers=burst) as executor:
+        burst_ms = list(executor.map(lambda q: timed(qa_workflow, q, vectorstore, router)[1],
+                                     [BENCHMARK_QUERIES[i % len(BENCHMARK_QUERIES)] for i in range(burst)]))
+    stats = router.stats()
+    results["burst"] = dict(percentiles(burst_ms), fallbacks=stats["fallbacks"],
+                            calls={tier: entry["calls"] for tier, entry in stats["tiers"].items()})
+    return results
+
+
+
+def bench_sharding(embeddings, texts, metadatas, vectors, scale, shard_counts=(2, 4), k=10, rounds=5):
+    """
+    Compare search latency and index memory of the single in-process index against sharded indexes served
+    by worker processes, on a synthetic corpus. Also checks that the merged top-k matches the single index.
+    """
+    s_texts, s_metadatas, s_vectors = synthesize_corpus(texts, metadatas, vectors, scale)
+    query_vectors = [embeddings.embed_query(q) for q in BENCHMARK_QUERIES]
+    single = FAISS.from_embeddings(list(zip(s_texts, s_vectors.tolist())), embeddings, metadatas=s_metadatas)
+    expected = [{doc.page_content for doc in single.similarity_search_by_vector(qv, k=k)} for qv in query_vectors]
+
+    def measure(store):
+        latencies = [timed(store.similarity_search_by_vector, qv, k=k)[1] for _ in range(rounds) for qv in query_vectors]
+        batch_ms = [timed(search_batch, store, query_vectors, [k] * len(query_vectors))[1] for _ in range(rounds)]
+        found = [{doc.page_content for doc in store.similarity_search_by_vector(qv, k=k)} for qv in query_vectors]
+        agreement = np.mean([len(f & e) / max(len(e), 1) for f, e in zip(found, expected)])
+        return dict(percentiles(latencies), batch_latency=percentiles(batch_ms), top_k_agreement=float(agreement))
+
+    results = {"chunks": len(s_texts), "single": dict(measure(single), index_bytes=int(faiss.serialize_index(single.index).size))}
+    for count in shard_counts:
+        # Round-robin synthetic courses, so every shard holds a similar share of the corpus
+        tagged = [dict(m, course=f"course-{i % count}") for i, m in enumerate(s_metadatas)]
+        store = FAISS.from_embeddings(list(zip(s_texts, s_vectors.tolist())), embeddings, metadatas=tagged)
+        with tempfile.TemporaryDirectory() as tmp:
+            build_shards(store, tmp, key="course", storage="float32")
+            sharded, start_ms = timed(ShardedIndex.open, tmp, embeddings, workers=count)
+            try:
+                workers = sharded.stats()
+                results[f"shards_{count}"] = dict(
+                    measure(sharded), startup_seconds=start_ms / 1000,
+                    index_bytes=sum(w["index_bytes"] for w in workers),
+                    largest_worker_index_bytes=max(w["index_bytes"] for w in workers),
+                    largest_worker_rss_bytes=max(w["max_rss_bytes"] or 0 for w in workers),
+                )
+            finally:
+                sharded.close()
+    return results
+
+
+
+# ------------------------------
+# Comparison
+# ------------------------------
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+
+def compare_results(current, previous, threshold=0.1):
+    """
+    Compare two result files. Returns a list of (metric, previous, current, relative change, regressed).
+    Throughput (per_second), agreement, and retrieval quality (recall, MRR) metrics regress when they drop; latency,
+    time, and size metrics when they grow.
+    """
+    cur, prev = flatten(current.get("results", {})), flatten(previous.get("results", {}))
+    rows = []
+    for metric in sorted(set(cur) & set(prev)):
+        if metric.endswith(("samples", "chunks", "pages", "files", "batch_size")) or not prev[metric]:
+            continue
+        change = (cur[metric] - prev[metric]) / prev[metric]
+        higher_is_better = "per_second" in metric or metric.endswith("agreement") or \
+            any(name in metric.lower() for name in ("recall", "mrr"))
+        regressed = (-change if higher_is_better else change) > threshold
+        rows.append((metric, prev[metric], cur[metric], change, regressed))
+    return rows
+
+
+
+# ------------------------------
+# Entry Point
+# ------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the SoloMind benchmark suite.")
+    parser.add_argument("--materials", default=MATERIALS_DIR, help="Directory of sample course materials")
+    parser.add_argument("--model", default=DEFAULT_EMBEDDING_MODEL, help="Embedding model name")
+    parser.add_argument("--scales", default="1,10,50", help="Comma-separated synthetic corpus scale factors")
+    parser.add_argument("--shards", default="2,4", help="Comma-separated shard counts for the sharded index benchmark")
+    parser.add_argument("--rounds", type=int, default=3, help="Repetitions per measurement")
+    parser.add_argument("--stub-tokens-per-second", type=float, default=0.0,
+                        help="Simulated LLM generation speed (0 = instant, measures pipeline overhead only)")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Previous results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change counted as a regression")
+    args = parser.parse_args(argv)
+
+    files = find_course_files(args.materials)
+    if not files:
+        parser.error(f"No course materials found under {args.materials}")
+    scales = [int(s) for s in args.scales.split(",") if s.strip()]
+
+    print("Benchmarking extraction...")
+    extraction, chunks = bench_extraction(files, repeat=args.rounds)
+    pdf_files = [f for f in files if f.lower().endswith('.pdf')]
+    pdf_modes = bench_pdf_modes(pdf_files, repeat=args.rounds)
+    texts = [doc.page_content for doc in chunks]
+    metadatas = [doc.metadata for doc in chunks]
+    print("Benchmarking embedding...")
+    embeddings = load_embeddings(args.model)
+    embedding, vectors = bench_embedding(embeddings, texts)
+    print("Benchmarking index build and search...")
+    index, quantization = bench_index_and_search(embeddings, texts, metadatas, vectors, scales, rounds=args.rounds)
+    print("Benchmarking workflows...")
+    vectorstore = FAISS.from_embeddings(list(zip(texts, vectors.tolist())), embeddings, metadatas=metadatas)
+    llm = StubLLM(tokens_per_second=args.stub_tokens_per_second)
+    workflows = bench_workflows(vectorstore, llm, rounds=args.rounds)
+    print("Benchmarking query micro-batching...")
+    query_batching = bench_query_batching(vectorstore)
+    print("Benchmarking model routing...")
+    routing = bench_routing(vectorstore, args.stub_tokens_per_second, rounds=args.rounds)
+    print("Benchmarking sharded index...")
+    shard_counts = [int(c) for c in args.shards.split(",") if c.strip()]
+    sharding = bench_sharding(embeddings, texts, metadatas, vectors, max(scales), shard_counts, rounds=args.rounds)
+
+    output = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "embedding_model": args.model,
+            "scales": scales,
+            "shard_counts": shard_counts,
+            "rounds": args.rounds,
+            "stub_tokens_per_second": args.stub_tokens_per_second,
+        },
+        "results": {
+            "extraction": extraction,
+            "pdf_extraction_modes": pdf_modes,
+            "embedding": embedding,
+            "index": index,
+            "quantization": quantization,
+            "workflows": workflows,
+            "query_batching": query_batching,
+            "routing": routing,
+            "sharding": sharding,
+        },
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(output, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        rows = compare_results(output, previous, args.threshold)
+        regressions = [row for row in rows if row[4]]
+        for metric, prev, cur, change, regressed in rows:
+            flag = "  REGRESSION" if regressed else ""
+            print(f"{metric:<60} {prev:>12.4g} -> {cur:>12.4g} ({change:+.1%}){flag}")
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+        return 1 if regressions else 0
+    return 0
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
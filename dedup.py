@@ -0,0 +1,139 @@
+"""
+Near-duplicate chunk detection for ingestion.
+Chunks are compared by MinHash signatures over word shingles, with locality-sensitive hashing (LSH) so each
+new chunk is only compared against the few earlier chunks that share a band. A near-duplicate is not embedded
+or indexed again; instead its location is appended to the first copy's `duplicate_sources` metadata, so
+citations can still point to every place the content appears.
+"""
+import re
+import zlib
+import numpy as np
+from defaults import DEFAULT_DEDUP_THRESHOLD
+
+
+
+# Modulus for the MinHash permutations: a * crc32 stays below 2^63, so uint64 arithmetic cannot overflow
+MERSENNE_PRIME = (1 << 31) - 1
+# Structural labels added by the PPTX extractor, ignored so slides compare on their content
+MARKUP_WORDS = {"title", "key", "points", "additional", "content"}
+LOCATION_KEYS = ("source", "path", "course", "type", "slide_number", "slide_title", "page_number")
+
+
+
+def shingles(text, size=3):
+    """
+    Set of word n-grams of the normalized text (lowercased, punctuation and extractor markup dropped).
+    """
+    words = [w for w in re.findall(r'[a-z0-9]+', text.lower()) if w not in MARKUP_WORDS]
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+
+def duplicate_location(metadata):
+    """
+    The subset of a chunk's metadata needed to cite it (and, for batch ingestion, the file and course it came from).
+    """
+    return {key: metadata[key] for key in LOCATION_KEYS if key in metadata}
+
+
+
+class NearDuplicateFilter:
+    """
+    Streaming near-duplicate detector that remembers every chunk it has kept.
+    Chunks whose estimated Jaccard similarity to a kept chunk is at least `threshold` are dropped and recorded
+    on the kept chunk. Image placeholders and chunks shorter than `min_words` are always kept as-is.
+    """
+    def __init__(self, threshold=DEFAULT_DEDUP_THRESHOLD, num_perm=128, bands=32, min_words=8, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.min_words = min_words
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = []
+        self._metadatas = []  # Metadata dict of each kept chunk, updated in place when a duplicate is found
+        self._pending = []  # Indices of chunks kept by the last filter() call, until attach()
+
+    def signature(self, text):
+        """
+        MinHash signature of the text, or None if it is too short to compare reliably.
+        """
+        if len(re.findall(r'\w+', text)) < self.min_words:
+            return None
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles(text)), dtype=np.uint64)
+        if hashes.size == 0:
+            return None
+        # One universal hash (a*x + b) mod p per permutation; the signature keeps each permutation's minimum
+        prime = np.uint64(MERSENNE_PRIME)
+        permuted = (np.outer(hashes, self._a) % prime + self._b) % prime
+        return permuted.min(axis=0)
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def _find(self, signature):
+        candidates = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            candidates.update(self._buckets[band].get(key, ()))
+        best, best_similarity = None, self.threshold
+        for candidate in candidates:
+            similarity = float(np.mean(self._signatures[candidate] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        return best
+
+    def _add(self, signature, metadata):
+        position = len(self._signatures)
+        self._signatures.append(signature)
+        self._metadatas.append(metadata)
+        for band, key in enumerate(self._band_keys(signature)):
+            self._buckets[band].setdefault(key, []).append(position)
+        return position
+
+    def add_existing(self, docs):
+        """
+        Remember already-indexed chunks (e.g. the vectorstore's docstore values) so new uploads are checked against them.
+        """
+        for doc in docs:
+            if doc.metadata.get("type") == "image":
+                continue
+            signature = self.signature(doc.page_content)
+            if signature is not None:
+                self._add(signature, doc.metadata)
+
+    def filter(self, docs):
+        """
+        Return the chunks that are not near-duplicates of a kept chunk (earlier in this batch or previously seen).
+        Dropped chunks are recorded in the matching kept chunk's `duplicate_sources` metadata.
+        """
+        kept = []
+        self._pending = []
+        for doc in docs:
+            signature = None if doc.metadata.get("type") == "image" else self.signature(doc.page_content)
+            if signature is None:
+                kept.append(doc)
+                self._pending.append(None)
+                continue
+            match = self._find(signature)
+            if match is None:
+                kept.append(doc)
+                self._pending.append(self._add(signature, doc.metadata))
+                continue
+            self._metadatas[match].setdefault("duplicate_sources", []).append(duplicate_location(doc.metadata))
+        return kept
+
+    def attach(self, stored_docs):
+        """
+        Point the chunks kept by the last filter() call at their stored copies, in the same order, so later
+        duplicates update the metadata that is actually in the docstore.
+        """
+        for position, doc in zip(self._pending, stored_docs):
+            if position is not None and doc is not None:
+                self._metadatas[position] = doc.metadata
+        self._pending = []
@@ -1,6 +1,54 @@
 """
-Holds default values for the LLM model and embedding model used in the chatbot.
+Holds default values for the LLM model, embedding model, index storage (snapshots and sharding), summarization, quiz generation, generation profiles, model routing, and query batching used in the chatbot.
 """
+import os
 DEFAULT_LLM_MODEL = "qwen2.5:14b"
 DEFAULT_LLM_TEMPERATURE = 0.7
-DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2" 
\ No newline at end of file
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+DEFAULT_DATA_DIR = "data"
+DEFAULT_FAISS_PATH = os.path.join(DEFAULT_DATA_DIR, "vector_index.faiss")
+DEFAULT_EMBEDDING_BATCH_SIZE = 64
+DEFAULT_PDF_FAST_EXTRACTION = True
+DEFAULT_VECTOR_STORAGE = "float32"  # "float32", "float16", or "int8"
+DEFAULT_RESCORE_OVERSAMPLE = 4
+DEFAULT_EMBEDDING_BACKEND = "pytorch"  # "pytorch", "onnx", or "onnx-int8"
+DEFAULT_ONNX_MODEL_DIR = os.path.join(DEFAULT_DATA_DIR, "onnx", DEFAULT_EMBEDDING_MODEL)
+DEFAULT_ONNX_PARITY_THRESHOLD = 0.98  # Minimum cosine similarity to the PyTorch output
+DEFAULT_SUMMARY_GROUP_SIZE = 8  # Chunks per partial summary in map-reduce summarization
+DEFAULT_SUMMARY_MAX_CONCURRENCY = 2  # Parallel partial-summary requests (match OLLAMA_NUM_PARALLEL)
+DEFAULT_SUMMARY_RETRIEVE_K = 40  # Chunks retrieved for a broad topic when no source is named
+DEFAULT_SUMMARY_CACHE_SIZE = 512  # Partial summaries kept in memory
+DEFAULT_NEAR_DUPLICATE_DEDUP = True  # Collapse near-duplicate chunks at ingestion time
+DEFAULT_DEDUP_THRESHOLD = 0.8  # Minimum estimated Jaccard similarity of word shingles to count as a duplicate
+DEFAULT_MODEL_ROUTING = True  # Route each workflow to a model tier; False uses DEFAULT_LLM_MODEL for everything
+DEFAULT_MODEL_TIERS = {"small": "qwen2.5:3b", "medium": "qwen2.5:7b", "large": DEFAULT_LLM_MODEL}
+# Per workflow: (max estimated prompt tokens, tier) rules checked in order; None matches any prompt size
+DEFAULT_WORKFLOW_TIERS = {
+    "qa": [(1500, "medium"), (None, "large")],
+    "summarize": [(None, "large")],
+    "summarize_map": [(None, "medium")],
+    "quiz": [(None, "medium")],
+    "grade": [(None, "small")],
+}
+DEFAULT_WORKFLOW_SLO_SECONDS = {"qa": 30, "summarize": 90, "summarize_map": 60, "quiz": 90, "grade": 20}
+DEFAULT_ROUTER_MAX_QUEUE_DEPTH = 2  # Requests already running on a model before new ones fall back to a smaller tier
+DEFAULT_QUERY_BATCHING = True  # Micro-batch query embeddings and searches across concurrent sessions
+DEFAULT_QUERY_BATCH_MAX_WAIT_MS = 5  # How long the first query in a batch waits for others to join
+DEFAULT_QUERY_BATCH_MAX_SIZE = 32
+DEFAULT_INGESTION_PUBLISH_SECONDS = 10  # Minimum time between publishing partial indexes while an upload is ingested
+DEFAULT_INDEX_KEEP_VERSIONS = 3  # Published index snapshots kept on disk (older ones are removed once no reader holds them)
+DEFAULT_INDEX_SHARDING = False  # Serve the API's index from per-course shards in worker processes (build them with ingest.py --shards)
+DEFAULT_SHARD_KEY = "course"  # "course" (top-level folder under the ingested directory, else the file) or "source"
+DEFAULT_SHARD_WORKERS = 0  # Shard worker processes; 0 uses one per shard, up to one per CPU core
+DEFAULT_STRUCTURED_QUIZ = True  # Generate quizzes as schema-validated JSON (Ollama JSON mode) instead of parsing free text
+DEFAULT_QUIZ_MAX_RETRIES = 2  # Follow-up requests for questions that were invalid or missing
+DEFAULT_QUIZ_TOKENS_PER_QUESTION = 160  # Output tokens budgeted per quiz question (the quiz profile's num_predict is the minimum)
+# Per workflow: output token cap and stop sequences (num_ctx is sized from each prompt, see generation.py)
+DEFAULT_GENERATION_PROFILES = {
+    "qa": {"num_predict": 1024, "stop": ["\n# Student's Question:", "\n# Context:"]},
+    "summarize": {"num_predict": 1536, "stop": ["\n# Context:", "\n# Notes:"]},
+    "summarize_map": {"num_predict": 512, "stop": ["\n# Excerpts:"]},
+    "quiz": {"num_predict": 1536, "stop": ["\n# EXAMPLE QUIZ:", "\n# Context"]},
+    "grade": {"num_predict": 512, "stop": ["\n# Quiz Results:"]},
+}
+DEFAULT_NUM_CTX_BUCKETS = (2048, 4096, 8192, 16384, 32768)  # Allowed context window sizes (fewer sizes, fewer model reloads)
\ No newline at end of file
@@ -1,24 +1,62 @@
 """
 Handles loading, extracting, and indexing content from PDF and PPTX files.
 Provides functions for document chunking, metadata creation, and vectorstore management.
+Messages are routed through a reporter (anything with error/warning/info methods, e.g. the
+streamlit module) so the loader also runs headless from the CLI, cron jobs, and worker processes.
 """
 import fitz
 from pptx import Presentation
 import re
 import os
-import streamlit as st
+import shutil
+import tempfile
+import time
+import logging
+from itertools import islice
+import faiss
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
 from langchain.schema import Document
+from instrumentation import span, metrics
+from quantization import QuantizedFAISS, quantize_vectorstore, RESCORE_FILE, SNAPSHOT_ATTRIBUTES
+from index_store import commit_snapshot, open_snapshot, clear_snapshots
+from dedup import NearDuplicateFilter, LOCATION_KEYS
+from defaults import DEFAULT_PDF_FAST_EXTRACTION, DEFAULT_EMBEDDING_BATCH_SIZE, DEFAULT_VECTOR_STORAGE, \
+    DEFAULT_NEAR_DUPLICATE_DEDUP
 
 
 
-def extract_text_from_pptx(pptx_file):
+logger = logging.getLogger(__name__)
+
+
+
+class LogReporter:
     """
-    Extract text from PowerPoint files with structure and content preservation.
+    Default reporter used outside of Streamlit. Sends loader messages to the standard logging module.
+    """
+    def error(self, message):
+        logger.error(message)
+
+    def warning(self, message):
+        logger.warning(message)
+
+    def info(self, message):
+        logger.info(message)
+
+
+
+def get_source_name(file):
+    """
+    Get the display name of a file object (uploaded file or file opened from disk).
+    """
+    return os.path.basename(getattr(file, 'name', '')) or 'Unknown Source'
+
+
+
+def iter_pptx_chunks(prs, source):
+    """
+    Lazily yield one chunk per slide from a loaded presentation, preserving structure and content.
     """
-    # Load the PowerPoint file
-    prs = Presentation(pptx_file)
-    text_chunks = []
     # Loop through each slide in the presentation
     for slide_num, slide in enumerate(prs.slides, 1):
         # Initialize slide components
@@ -72,7 +110,7 @@ def extract_text_from_pptx(pptx_file):
             full_content = "\n".join(content_parts)
             # Create metadata for source tracking
             metadata = {
-                "source": getattr(pptx_file, 'name', 'Unknown Source'),
+                "source": source,
                 "slide_number": slide_num,
                 "slide_title": slide_title or "Untitled",
                 "type": "slide",
@@ -81,92 +119,295 @@ def extract_text_from_pptx(pptx_file):
                 "content_sections": len(content_parts)
             }
             # Create Document object with metadata
-            doc = Document(
+            yield Document(
                 page_content=full_content,
                 metadata=metadata
             )
-            text_chunks.append(doc)
-    return text_chunks
 
 
 
-def extract_text_from_pdf(pdf_file):
+def extract_text_from_pptx(pptx_file):
     """
-    Extract text and preserve structure from PDF files, including tables, lists, and code blocks where possible.
+    Extract text from PowerPoint files with structure and content preservation.
     """
-    doc = fitz.open(stream=pdf_file.read(), filetype="pdf")
-    text_chunks = []
-    for page_num, page in enumerate(doc, 1):
-        blocks = page.get_text("dict")["blocks"]
-        for block in blocks:
+    # Load the PowerPoint file
+    prs = Presentation(pptx_file)
+    return list(iter_pptx_chunks(prs, get_source_name(pptx_file)))
+
+
+
+# Text-only flags for the fast PDF path: same as the "dict" defaults minus TEXT_PRESERVE_IMAGES,
+# so MuPDF never decodes or copies image payloads into the result
+FAST_PDF_TEXT_FLAGS = fitz.TEXT_PRESERVE_LIGATURES | fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP
+LIST_MARKERS = ("-", "•", "*", "·", "○", "1.", "a.", "i.")
+
+
+
+def _pdf_chunk(content, source, page_num, chunk_type):
+    """
+    Create a Document for a piece of PDF content with source tracking metadata.
+    """
+    metadata = {
+        "source": source,
+        "page_number": page_num,
+        "type": chunk_type,
+        "content_type": "pdf"
+    }
+    return Document(page_content=content, metadata=metadata)
+
+
+
+def _text_block_to_paragraph(block, fast=False):
+    """
+    Join the spans of a text block into a paragraph, marking monospace spans as code and keeping list line breaks.
+    The fast path checks the monospace bit in the span flags instead of matching on the font name.
+    """
+    chunk_lines = []
+    for line in block["lines"]:
+        for text_span in line["spans"]:
+            text = text_span["text"].strip()
+            if not text:
+                continue
+            # Try to detect code blocks (monospace font)
+            if fast:
+                is_mono = text_span["flags"] & fitz.TEXT_FONT_MONOSPACED or "Mono" in text_span["font"]
+            else:
+                is_mono = "Mono" in text_span.get("font", "")
+            if is_mono:
+                text = f"```\n{text}\n```"
+            chunk_lines.append(text)
+    if not chunk_lines:
+        return None
+    # Try to detect lists (lines starting with bullets or numbers)
+    if any(l.startswith(LIST_MARKERS) for l in chunk_lines):
+        return "\n".join(chunk_lines)
+    return " ".join(chunk_lines)
+
+
+
+def iter_pdf_chunks(doc, source, page_numbers=None, fast=True):
+    """
+    Lazily yield chunks page by page from an open PyMuPDF document.
+    page_numbers is an optional iterable of 1-based page numbers (e.g. range(1, 11)); pages are loaded on demand.
+    The fast path extracts text only and emits image placeholders from the page's image list,
+    so image payloads are never materialized.
+    """
+    if page_numbers is None:
+        page_numbers = range(1, doc.page_count + 1)
+    for page_num in page_numbers:
+        page = doc.load_page(page_num - 1)
+        if fast:
+            for block in page.get_text("dict", flags=FAST_PDF_TEXT_FLAGS)["blocks"]:
+                if block["type"] == 0:
+                    para = _text_block_to_paragraph(block, fast=True)
+                    if para:
+                        yield _pdf_chunk(para, source, page_num, "page")
+            # Insert a placeholder for images (listed from page resources, not decoded)
+            for _ in page.get_images(full=False):
+                yield _pdf_chunk("[Image omitted]", source, page_num, "image")
+            continue
+        for block in page.get_text("dict")["blocks"]:
             if block["type"] == 0:  # text block
-                lines = block["lines"]
-                chunk_lines = []
-                for line in lines:
-                    spans = line["spans"]
-                    for span in spans:
-                        text = span["text"].strip()
-                        if not text:
-                            continue
-                        # Try to detect code blocks (monospace font)
-                        if "Mono" in span.get("font", ""):
-                            text = f"```\n{text}\n```"
-                        chunk_lines.append(text)
-                if chunk_lines:
-                    para = " ".join(chunk_lines)
-                    # Try to detect lists (lines starting with bullets or numbers)
-                    if any(l.strip().startswith(("-", "•", "*", "·", "○", "1.", "a.", "i.")) for l in chunk_lines):
-                        para = "\n".join(chunk_lines)
-                    metadata = {
-                        "source": getattr(pdf_file, 'name', 'Unknown Source'),
-                        "page_number": page_num,
-                        "type": "page",
-                        "content_type": "pdf"
-                    }
-                    doc_obj = Document(
-                        page_content=para,
-                        metadata=metadata
-                    )
-                    text_chunks.append(doc_obj)
+                para = _text_block_to_paragraph(block)
+                if para:
+                    yield _pdf_chunk(para, source, page_num, "page")
             elif block["type"] == 1:  # image block
                 # Insert a placeholder for images
-                metadata = {
-                    "source": getattr(pdf_file, 'name', 'Unknown Source'),
-                    "page_number": page_num,
-                    "type": "image",
-                    "content_type": "pdf"
-                }
-                doc_obj = Document(
-                    page_content="[Image omitted]",
-                    metadata=metadata
-                )
-                text_chunks.append(doc_obj)
+                yield _pdf_chunk("[Image omitted]", source, page_num, "image")
             elif block["type"] == 2:  # table block (if detected)
                 # PyMuPDF does not natively extract tables, but we can try to preserve structure
                 table_text = block.get("text", "").strip()
                 if table_text:
-                    metadata = {
-                        "source": getattr(pdf_file, 'name', 'Unknown Source'),
-                        "page_number": page_num,
-                        "type": "table",
-                        "content_type": "pdf"
-                    }
-                    doc_obj = Document(
-                        page_content=f"[Table]\n{table_text}",
-                        metadata=metadata
-                    )
-                    text_chunks.append(doc_obj)
-    return text_chunks
+                    yield _pdf_chunk(f"[Table]\n{table_text}", source, page_num, "table")
+
+
+
+def extract_text_from_pdf(pdf_file, fast=DEFAULT_PDF_FAST_EXTRACTION, page_numbers=None):
+    """
+    Extract text and preserve structure from PDF files, including tables, lists, and code blocks where possible.
+    """
+    doc = fitz.open(stream=pdf_file.read(), filetype="pdf")
+    try:
+        return list(iter_pdf_chunks(doc, get_source_name(pdf_file), page_numbers, fast))
+    finally:
+        doc.close()
+
+
+
+def extract_chunks(file, reporter=None):
+    """
+    Extract chunks from a PDF or PPTX file based on its extension.
+    Returns None if the file type is not supported.
+    """
+    reporter = reporter or LogReporter()
+    if file.name.endswith('.pdf'):
+        with span("extract"):
+            return extract_text_from_pdf(file)
+    elif file.name.endswith(('.pptx', '.ppt')):
+        with span("extract"):
+            return extract_text_from_pptx(file)
+    reporter.error(f"Unsupported File Type: {file.name}")
+    return None
+
+
+
+def spool_upload(file, chunk_size=1 << 20):
+    """
+    Copy an uploaded file to a temporary file on disk in fixed-size pieces and return its path.
+    The caller is responsible for deleting the file.
+    """
+    suffix = os.path.splitext(get_source_name(file))[1]
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        shutil.copyfileobj(file, tmp, chunk_size)
+    return tmp.name
+
+
+
+def iter_document_chunks(path, source=None):
+    """
+    Lazily yield chunks page by page (PDF) or slide by slide (PPTX) from a file on disk.
+    PDFs are opened by path so MuPDF reads pages from the file on demand instead of holding the whole file in memory.
+    Raises ValueError for unsupported file types.
+    """
+    source = source or os.path.basename(path)
+    lower = source.lower()
+    if lower.endswith('.pdf'):
+        doc = fitz.open(path)
+        try:
+            yield from iter_pdf_chunks(doc, source)
+        finally:
+            doc.close()
+    elif lower.endswith(('.pptx', '.ppt')):
+        yield from iter_pptx_chunks(Presentation(path), source)
+    else:
+        raise ValueError(f"Unsupported File Type: {source}")
+
+
+
+def index_chunks(chunks, embeddings, vectorstore=None, batch_size=DEFAULT_EMBEDDING_BATCH_SIZE, on_batch=None, dedup=None):
+    """
+    Embed chunks from any iterable in fixed-size batches and append them to the vectorstore (created on first use).
+    Only one batch of chunks is held in memory at a time, so memory stays flat regardless of document size.
+    dedup, if given, is a NearDuplicateFilter: near-duplicate chunks are skipped and recorded on the kept copy.
+    on_batch, if given, is called with the vectorstore and the running stats dict after every batch.
+    Returns the vectorstore and stats (chunks, duplicates, pages, extract_seconds, embed_seconds).
+    """
+    stats = {"chunks": 0, "duplicates": 0, "pages": 0, "extract_seconds": 0.0, "embed_seconds": 0.0}
+    seen_pages = set()
+    iterator = iter(chunks)
+    while True:
+        started = time.perf_counter()
+        batch = list(islice(iterator, batch_size))
+        extract_seconds = time.perf_counter() - started
+        if not batch:
+            break
+        metrics.observe("extract", extract_seconds)
+        with span("chunk"):
+            texts = [doc.page_content for doc in batch]
+            metadatas = [doc.metadata for doc in batch]
+            # Verify metadata structure
+            for metadata in metadatas:
+                if not isinstance(metadata, dict):
+                    raise ValueError("Invalid Metadata Structure Detected")
+                if "type" not in metadata:
+                    metadata["type"] = "unknown"
+                seen_pages.add((metadata.get("source"), metadata.get("page_number", metadata.get("slide_number"))))
+            if dedup is not None:
+                with span("dedup"):
+                    kept = dedup.filter(batch)
+                stats["duplicates"] += len(batch) - len(kept)
+                batch = kept
+                texts = [doc.page_content for doc in batch]
+                metadatas = [doc.metadata for doc in batch]
+        embed_seconds = 0.0
+        if batch:
+            started = time.perf_counter()
+            with span("embed"):
+                vectors = embeddings.embed_documents(texts)
+            embed_seconds = time.perf_counter() - started
+            text_embeddings = list(zip(texts, vectors))
+            if vectorstore is None:
+                vectorstore = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas)
+                ids = list(vectorstore.index_to_docstore_id.values())
+            else:
+                ids = vectorstore.add_embeddings(text_embeddings, metadatas=metadatas)
+            if dedup is not None:
+                # Later duplicates must update the docstore's copies of the metadata
+                dedup.attach([vectorstore.docstore.search(doc_id) for doc_id in ids])
+        stats["chunks"] += len(batch)
+        stats["pages"] = len(seen_pages)
+        stats["extract_seconds"] += extract_seconds
+        stats["embed_seconds"] += embed_seconds
+        if on_batch:
+            on_batch(vectorstore, stats)
+    return vectorstore, stats
 
 
 
-def load_document_and_index(file, embeddings, faiss_path="vector_index.faiss"):
+def new_duplicate_filter(vectorstore=None):
+    """
+    Create a near-duplicate filter that already knows the chunks in vectorstore (if any).
+    """
+    duplicate_filter = NearDuplicateFilter()
+    if vectorstore is not None:
+        duplicate_filter.add_existing(vectorstore.docstore._dict.values())
+    return duplicate_filter
+
+
+
+def _from_file(location, path, source):
+    # Chunks indexed before batch ingestion recorded file paths only know their file name
+    return location.get("path") == path if "path" in location else location.get("source") == source
+
+
+
+def remove_file(vectorstore, path, source=None):
+    """
+    Delete the chunks indexed from one file (matched on their "path" metadata, or on the file name for chunks
+    indexed without one), e.g. before indexing a changed version of it. A chunk that also stands for
+    near-duplicates from other files is kept instead, with the first of those promoted to be the stored copy,
+    so their content is not lost. Locations of the file recorded on other chunks are dropped.
+    Returns the number of chunks deleted.
+    """
+    source = source or os.path.basename(path)
+    ids = []
+    for doc_id, doc in vectorstore.docstore._dict.items():
+        metadata = doc.metadata
+        others = [d for d in metadata.get("duplicate_sources", []) if not _from_file(d, path, source)]
+        if _from_file(metadata, path, source):
+            if not others:
+                ids.append(doc_id)
+                continue
+            for key in LOCATION_KEYS:
+                metadata.pop(key, None)
+            metadata.update(others.pop(0))
+        if "duplicate_sources" in metadata:
+            metadata["duplicate_sources"] = others
+    if ids:
+        vectorstore.delete(ids)
+    return len(ids)
+
+
+
+def load_document_and_index(file, embeddings, faiss_path="vector_index.faiss", reporter=None, vectorstore=None,
+                            storage=DEFAULT_VECTOR_STORAGE, dedup=DEFAULT_NEAR_DUPLICATE_DEDUP):
     """
     Load and index a document with better error handling and file operations.
+    The upload is spooled to a temporary file and streamed through extraction and embedding in batches.
+    Pass an existing vectorstore to append to it instead of starting a new one.
+    storage selects float32 vectors or a quantized ("float16"/"int8") index with exact re-scoring.
+    dedup collapses near-duplicate chunks (within the file and against the existing vectorstore) into one entry.
+    Pass reporter=st to surface messages in the Streamlit UI; defaults to logging.
     """
+    reporter = reporter or LogReporter()
     try:
         if not hasattr(file, 'name'):
-            st.error("Invalid File Object: Missing Filename")
+            reporter.error("Invalid File Object: Missing Filename")
+            return None
+        if not file.name.lower().endswith(('.pdf', '.pptx', '.ppt')):
+            reporter.error(f"Unsupported File Type: {file.name}")
             return None
         # Get directory path
         faiss_dir = os.path.dirname(faiss_path)
@@ -174,97 +415,110 @@ def load_document_and_index(file, embeddings, faiss_path="vector_index.faiss"):
             try:
                 os.makedirs(faiss_dir, mode=0o755, exist_ok=True)
             except Exception as e:
-                st.error(f"Error Creating Directory {faiss_dir}: {str(e)}")
+                reporter.error(f"Error Creating Directory {faiss_dir}: {str(e)}")
                 # Fall back to temp directory
-                import tempfile
                 faiss_path = os.path.join(tempfile.gettempdir(), os.path.basename(faiss_path))
-        # Extract text based on file type
-        if file.name.endswith('.pdf'):
-            chunks = extract_text_from_pdf(file)
-        elif file.name.endswith(('.pptx', '.ppt')):
-            chunks = extract_text_from_pptx(file)
-        else:
-            st.error(f"Unsupported File Type: {file.name}")
-            return None
-        if not chunks:
-            st.warning(f"No Content Extracted from {file.name}")
-            return None
-        # Extract text content and metadata
-        texts = [doc.page_content for doc in chunks]
-        metadatas = [doc.metadata for doc in chunks]
-        # Verify metadata structure
-        for metadata in metadatas:
-            if not isinstance(metadata, dict):
-                st.error("Invalid Metadata Structure Detected")
-                return None
-            if "type" not in metadata:
-                metadata["type"] = "unknown"
-
+        spooled_path = spool_upload(file)
         try:
-            # If the vector store already exists, overwrite it
-            if os.path.exists(faiss_path):
-                try:
-                    os.remove(faiss_path)
-                except OSError:
-                    pass  # Ignore and overwrite
-                if os.path.exists(faiss_path + ".pkl"):
-                    try:
-                        os.remove(faiss_path + ".pkl")
-                    except OSError:
-                        pass  # Ignore and overwrite
-            # Do NOT generate a new unique filename; always use the same faiss_path
-            vectorstore = FAISS.from_texts(texts, embeddings, metadatas=metadatas)
-            # Try to save the vectorstore
-            try:
-                vectorstore.save_local(faiss_path)
-            except OSError as e:
-                st.warning(f"Could not save vector store to disk: {str(e)}")
-                st.info("Continuing with in-memory vector store")
-            return vectorstore
+            chunks = iter_document_chunks(spooled_path, get_source_name(file))
+            duplicate_filter = new_duplicate_filter(vectorstore) if dedup else None
+            vectorstore, stats = index_chunks(chunks, embeddings, vectorstore, dedup=duplicate_filter)
         except Exception as e:
-            st.error(f"Error creating vector store: {str(e)}")
+            reporter.error(f"Error creating vector store: {str(e)}")
             return None
+        finally:
+            try:
+                os.remove(spooled_path)
+            except OSError:
+                pass
+        if not stats["chunks"] and not stats["duplicates"]:
+            reporter.warning(f"No Content Extracted from {file.name}")
+            return None
+        if storage != "float32" and not isinstance(vectorstore, QuantizedFAISS):
+            vectorstore = quantize_vectorstore(vectorstore, storage)
+
+        return save_vector_store(vectorstore, faiss_path, reporter)
     except Exception as e:
-        st.error(f"Error processing document: {str(e)}")
+        reporter.error(f"Error processing document: {str(e)}")
         return None
 
 
 
-def clear_vector_store(faiss_path="vector_index.faiss"):
+def save_vector_store(vectorstore, faiss_path, reporter=None):
+    """
+    Publish the vectorstore's changes as a new snapshot version under faiss_path, merged with anything other
+    writers published since it was loaded (see index_store.commit_snapshot).
+    Returns the published store to keep working on, or the vectorstore itself if it could not be saved.
+    Readers that already opened an older version keep using it.
+    """
+    reporter = reporter or LogReporter()
+    try:
+        return commit_snapshot(vectorstore, faiss_path)
+    except (OSError, RuntimeError) as e:
+        reporter.warning(f"Could not save vector store to disk: {str(e)}")
+        reporter.info("Continuing with in-memory vector store")
+        return vectorstore
+
+
+
+def copy_vector_store(vectorstore):
+    """
+    Copy a vectorstore's index, docstore, and id map, so the copy can be searched while the original keeps growing.
+    Documents are shared, not copied. Quantized copies share the float32 re-scoring file; a store that would
+    append past rows another copy already added writes its own file instead (see QuantizedFAISS.add_embeddings).
+    """
+    index = faiss.clone_index(vectorstore.index)
+    docstore = InMemoryDocstore(dict(vectorstore.docstore._dict))
+    index_to_docstore_id = dict(vectorstore.index_to_docstore_id)
+    options = {"normalize_L2": getattr(vectorstore, "_normalize_L2", False), "distance_strategy": vectorstore.distance_strategy}
+    if isinstance(vectorstore, QuantizedFAISS):
+        copy = QuantizedFAISS(vectorstore.embedding_function, index, docstore, index_to_docstore_id,
+                              rescore_path=vectorstore.rescore_path, oversample=vectorstore.oversample,
+                              rescore_owner=vectorstore.rescore_owner, **options)
+    else:
+        copy = FAISS(vectorstore.embedding_function, index, docstore, index_to_docstore_id, **options)
+    for name in SNAPSHOT_ATTRIBUTES:
+        if hasattr(vectorstore, name):
+            setattr(copy, name, getattr(vectorstore, name))
+    return copy
+
+
+
+def load_vector_store(faiss_path, embeddings, reporter=None):
+    """
+    Load the published snapshot of the vector store from disk. Returns None if there is no saved index.
+    """
+    reporter = reporter or LogReporter()
+    try:
+        return open_snapshot(faiss_path, embeddings)
+    except Exception as e:
+        reporter.error(f"Error loading vector store: {str(e)}")
+        return None
+
+
+
+def clear_vector_store(faiss_path="vector_index.faiss", reporter=None):
     """
     Safely clear the vector store files with error handling.
+    Snapshots still held by a reader are left in place and removed by a later save.
     """
+    reporter = reporter or LogReporter()
     success = True
     try:
-        # Get the directory path
-        faiss_dir = os.path.dirname(faiss_path)
-        # Try to remove the main index file
-        if os.path.exists(faiss_path):
-            try:
-                os.remove(faiss_path)
-            except OSError as e:
-                st.warning(f"Could Not Remove Index File: {str(e)}")
-                success = False
-        # Try to remove the pickle file
-        pkl_path = faiss_path + ".pkl"
-        if os.path.exists(pkl_path):
-            try:
-                os.remove(pkl_path)
-            except OSError as e:
-                st.warning(f"Could Not Remove Pickle File: {str(e)}")
-                success = False
-        # Try to clean up any temporary files
-        if faiss_dir and os.path.exists(faiss_dir):
-            try:
-                for f in os.listdir(faiss_dir):
-                    if f.startswith("vector_index_") and (f.endswith(".faiss") or f.endswith(".pkl")):
-                        try:
-                            os.remove(os.path.join(faiss_dir, f))
-                        except OSError:
-                            success = False
-            except OSError:
+        if os.path.isdir(faiss_path):
+            if not clear_snapshots(faiss_path):
+                reporter.warning("Some index snapshots are still in use and will be removed later")
                 success = False
+            # Remove an index saved in the older single-directory layout
+            for name in ("index.faiss", "index.pkl", RESCORE_FILE):
+                path = os.path.join(faiss_path, name)
+                if os.path.exists(path):
+                    try:
+                        os.remove(path)
+                    except OSError as e:
+                        reporter.warning(f"Could Not Remove Index File: {str(e)}")
+                        success = False
         return success
     except Exception as e:
-        st.error(f"Error during Cleanup: {str(e)}")
-        return False 
\ No newline at end of file
+        reporter.error(f"Error during Cleanup: {str(e)}")
+        return False
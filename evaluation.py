@@ -0,0 +1,297 @@
+"""
+Retrieval quality and speed evaluation over a labeled question set.
+Each labeled question lists the source pages/slides that answer it. For every retrieval configuration
+(dense, hybrid, reranked, ANN) this computes recall@k, MRR, and search latency, then reports which
+configurations are on the quality-vs-latency Pareto front.
+
+Usage:
+    python evaluation.py
+    python evaluation.py --k 5 --configs dense,hybrid --output eval.json
+"""
+import argparse
+import json
+import logging
+import math
+import re
+import sys
+import time
+from collections import Counter
+import numpy as np
+import faiss
+from langchain_community.vectorstores import FAISS
+from document_loader import LogReporter, extract_chunks
+from dedup import NearDuplicateFilter
+from ingest import find_course_files
+from models import load_embeddings
+from defaults import DEFAULT_EMBEDDING_MODEL
+
+
+
+MATERIALS_DIR = "course-materials-for-testing"
+LABELS_PATH = "course-materials-for-testing/labeled_questions.json"
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+CANDIDATE_POOL = 30  # Candidates fetched before fusion or reranking
+
+
+
+def location_key(metadata):
+    """
+    Identify the page or slide a chunk (or a label) points to.
+    """
+    number = metadata.get("slide_number", metadata.get("page_number"))
+    return (metadata.get("source"), number)
+
+
+
+def doc_locations(metadata):
+    """
+    Every page or slide a chunk stands for, including near-duplicate copies collapsed at ingestion time.
+    """
+    return [location_key(metadata)] + [location_key(d) for d in metadata.get("duplicate_sources", [])]
+
+
+
+def load_labels(path=LABELS_PATH):
+    """
+    Load labeled questions as (question, set of relevant locations) pairs.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        labels = json.load(f)
+    return [(item["question"], {location_key(r) for r in item["relevant"]}) for item in labels]
+
+
+
+# ------------------------------
+# Retrieval Configurations
+# ------------------------------
+class DenseRetriever:
+    """
+    Plain vector search, as used by the workflows.
+    """
+    def __init__(self, vectorstore):
+        self.vectorstore = vectorstore
+
+    def search(self, query, k):
+        return self.vectorstore.similarity_search(query, k=k)
+
+
+
+class BM25:
+    """
+    Minimal Okapi BM25 keyword index over the documents in a vectorstore.
+    """
+    def __init__(self, docs, k1=1.5, b=0.75):
+        self.docs = docs
+        self.k1, self.b = k1, b
+        self.term_freqs = [Counter(self.tokenize(doc.page_content)) for doc in docs]
+        self.lengths = [sum(tf.values()) for tf in self.term_freqs]
+        self.avg_length = sum(self.lengths) / max(len(self.lengths), 1)
+        doc_freqs = Counter(term for tf in self.term_freqs for term in tf)
+        n = len(docs)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freqs.items()}
+
+    @staticmethod
+    def tokenize(text):
+        return re.findall(r'\w+', text.lower())
+
+    def search(self, query, k):
+        terms = [t for t in self.tokenize(query) if t in self.idf]
+        scores = []
+        for i, tf in enumerate(self.term_freqs):
+            score = 0.0
+            for term in terms:
+                freq = tf.get(term)
+                if freq:
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / self.avg_length)
+                    score += self.idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            if score > 0:
+                scores.append((score, i))
+        scores.sort(reverse=True)
+        return [self.docs[i] for _, i in scores[:k]]
+
+
+
+class HybridRetriever:
+    """
+    Dense + BM25 results merged with reciprocal rank fusion.
+    """
+    def __init__(self, vectorstore, rrf_k=60):
+        self.vectorstore = vectorstore
+        self.bm25 = BM25(list(vectorstore.docstore._dict.values()))
+        self.rrf_k = rrf_k
+
+    def search(self, query, k):
+        fused = {}
+        for ranking in (self.vectorstore.similarity_search(query, k=CANDIDATE_POOL), self.bm25.search(query, CANDIDATE_POOL)):
+            for rank, doc in enumerate(ranking, 1):
+                # Both rankings return the docstore's own Document objects, so identity is a stable key
+                key = id(doc)
+                score, _ = fused.get(key, (0.0, doc))
+                fused[key] = (score + 1.0 / (self.rrf_k + rank), doc)
+        ranked = sorted(fused.values(), key=lambda item: item[0], reverse=True)
+        return [doc for _, doc in ranked[:k]]
+
+
+
+class RerankedRetriever:
+    """
+    Dense candidates reordered by a cross-encoder.
+    """
+    def __init__(self, vectorstore, model_name=RERANK_MODEL):
+        from sentence_transformers import CrossEncoder
+        self.vectorstore = vectorstore
+        self.model = CrossEncoder(model_name)
+
+    def search(self, query, k):
+        candidates = self.vectorstore.similarity_search(query, k=CANDIDATE_POOL)
+        scores = self.model.predict([(query, doc.page_content) for doc in candidates])
+        order = np.argsort(-np.asarray(scores))
+        return [candidates[i] for i in order[:k]]
+
+
+
+class ANNRetriever:
+    """
+    Approximate search over an HNSW graph built from the same vectors and docstore.
+    """
+    def __init__(self, vectorstore, m=32, ef_search=64):
+        vectors = vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)
+        index = faiss.IndexHNSWFlat(vectors.shape[1], m)
+        index.hnsw.efSearch = ef_search
+        index.add(vectors)
+        self.vectorstore = FAISS(vectorstore.embedding_function, index, vectorstore.docstore,
+                                 dict(vectorstore.index_to_docstore_id))
+
+    def search(self, query, k):
+        return self.vectorstore.similarity_search(query, k=k)
+
+
+
+RETRIEVERS = {
+    "dense": DenseRetriever,
+    "hybrid": HybridRetriever,
+    "reranked": RerankedRetriever,
+    "ann": ANNRetriever,
+}
+
+
+
+# ------------------------------
+# Evaluation
+# ------------------------------
+def evaluate_retriever(retriever, labels, k):
+    """
+    Compute recall@k, MRR, and search latency for one retriever over the labeled questions.
+    Retrieved chunks are collapsed to page/slide locations (first occurrence wins) before scoring.
+    """
+    recalls, reciprocal_ranks, latencies_ms = [], [], []
+    for question, relevant in labels:
+        started = time.perf_counter()
+        docs = retriever.search(question, k)
+        latencies_ms.append((time.perf_counter() - started) * 1000)
+        locations = list(dict.fromkeys(loc for doc in docs for loc in doc_locations(doc.metadata)))
+        recalls.append(len(relevant.intersection(locations)) / len(relevant))
+        first_hit = next((rank for rank, loc in enumerate(locations, 1) if loc in relevant), None)
+        reciprocal_ranks.append(1.0 / first_hit if first_hit else 0.0)
+    return {
+        f"recall@{k}": float(np.mean(recalls)),
+        "mrr": float(np.mean(reciprocal_ranks)),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+
+
+def pareto_front(results, quality_key):
+    """
+    Names of configurations not dominated on (higher quality, lower p50 latency).
+    """
+    front = []
+    for name, r in results.items():
+        dominated = any(
+            other[quality_key] >= r[quality_key] and other["p50_ms"] <= r["p50_ms"]
+            and (other[quality_key] > r[quality_key] or other["p50_ms"] < r["p50_ms"])
+            for other_name, other in results.items() if other_name != name
+        )
+        if not dominated:
+            front.append(name)
+    return front
+
+
+
+def build_vectorstore(materials_dir, embeddings, dedup=False):
+    """
+    Build an in-memory index from the sample course materials, optionally collapsing near-duplicate chunks.
+    """
+    reporter = LogReporter()
+    docs = []
+    for path in find_course_files(materials_dir):
+        with open(path, "rb") as f:
+            docs.extend(extract_chunks(f, reporter) or [])
+    if dedup:
+        docs = NearDuplicateFilter().filter(docs)
+    return FAISS.from_documents(docs, embeddings)
+
+
+
+def run_evaluation(vectorstore, labels, configs, k=10):
+    """
+    Evaluate each named configuration and mark the Pareto-optimal ones.
+    Configurations whose dependencies are unavailable are reported as skipped.
+    """
+    results, skipped = {}, {}
+    for name in configs:
+        try:
+            retriever = RETRIEVERS[name](vectorstore)
+        except Exception as e:
+            skipped[name] = str(e)
+            continue
+        results[name] = evaluate_retriever(retriever, labels, k)
+    front = pareto_front(results, f"recall@{k}")
+    for name in results:
+        results[name]["pareto"] = name in front
+    return {"k": k, "questions": len(labels), "results": results, "skipped": skipped}
+
+
+
+def format_report(report):
+    k = report["k"]
+    lines = [f"{'config':<10} {f'recall@{k}':>10} {'mrr':>7} {'p50 ms':>9} {'p99 ms':>9}  pareto"]
+    for name, r in sorted(report["results"].items(), key=lambda item: item[1]["p50_ms"]):
+        lines.append(f"{name:<10} {r[f'recall@{k}']:>10.3f} {r['mrr']:>7.3f} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f}  {'*' if r['pareto'] else ''}")
+    for name, reason in report["skipped"].items():
+        lines.append(f"{name:<10} skipped: {reason}")
+    return "\n".join(lines)
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate retrieval quality and latency on the labeled question set.")
+    parser.add_argument("--materials", default=MATERIALS_DIR, help="Directory of course materials to index")
+    parser.add_argument("--labels", default=LABELS_PATH, help="Labeled question set (JSON)")
+    parser.add_argument("--model", default=DEFAULT_EMBEDDING_MODEL, help="Embedding model name")
+    parser.add_argument("--configs", default=",".join(RETRIEVERS), help="Comma-separated retrieval configurations")
+    parser.add_argument("--k", type=int, default=10, help="Number of results retrieved per question")
+    parser.add_argument("--dedup", action="store_true", help="Collapse near-duplicate chunks when building the index")
+    parser.add_argument("--output", help="Optional path to write the JSON report")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s: %(message)s")
+
+    configs = [c.strip() for c in args.configs.split(",") if c.strip()]
+    unknown = [c for c in configs if c not in RETRIEVERS]
+    if unknown:
+        parser.error(f"Unknown configuration(s): {', '.join(unknown)}")
+    embeddings = load_embeddings(args.model)
+    vectorstore = build_vectorstore(args.materials, embeddings, args.dedup)
+    report = run_evaluation(vectorstore, load_labels(args.labels), configs, args.k)
+    report["chunks"] = vectorstore.index.ntotal
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
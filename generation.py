@@ -0,0 +1,53 @@
+"""
+Per-workflow generation profiles for the Ollama models.
+Each workflow gets an output token cap (num_predict), stop sequences, and a context window (num_ctx) sized to
+its actual prompt: the estimated prompt tokens plus the output cap, rounded up to a fixed bucket so that
+requests of similar size reuse the same context allocation instead of making Ollama reload the model.
+"""
+import logging
+from defaults import DEFAULT_GENERATION_PROFILES, DEFAULT_NUM_CTX_BUCKETS
+
+
+
+logger = logging.getLogger(__name__)
+
+# Headroom for the four-characters-per-token estimate undercounting (e.g. code, formulas, non-English text)
+PROMPT_TOKEN_MARGIN = 1.2
+
+
+
+def context_bucket(tokens, buckets=DEFAULT_NUM_CTX_BUCKETS):
+    """
+    Smallest bucket that holds `tokens`, or the largest bucket if none does.
+    """
+    for bucket in sorted(buckets):
+        if tokens <= bucket:
+            return bucket
+    return max(buckets)
+
+
+
+def generation_options(workflow, prompt_tokens, overrides=None, profiles=DEFAULT_GENERATION_PROFILES,
+                       buckets=DEFAULT_NUM_CTX_BUCKETS):
+    """
+    Ollama options (num_ctx, num_predict, stop) for one call of a workflow with the given prompt size.
+    overrides replace profile values, except stop sequences, which are added to the profile's.
+    Workflows without a profile get no options (Ollama's defaults).
+    """
+    overrides = dict(overrides or {})
+    profile = profiles.get(workflow)
+    if profile is None:
+        return overrides
+    num_predict = overrides.pop("num_predict", profile.get("num_predict"))
+    stop = list(profile.get("stop", [])) + [s for s in overrides.pop("stop", []) if s not in profile.get("stop", [])]
+    needed = int(prompt_tokens * PROMPT_TOKEN_MARGIN) + (num_predict or 0)
+    options = {"num_ctx": context_bucket(needed, buckets)}
+    if needed > options["num_ctx"]:
+        logger.warning(f"{workflow}: prompt of ~{prompt_tokens} tokens plus {num_predict} output tokens exceeds the "
+                       f"largest context bucket ({options['num_ctx']}); the prompt may be truncated")
+    if num_predict:
+        options["num_predict"] = num_predict
+    if stop:
+        options["stop"] = stop
+    options.update(overrides)
+    return options
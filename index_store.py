@@ -0,0 +1,387 @@
+"""
+Versioned, immutable snapshots of the persisted vector index.
+Every save writes a complete snapshot into a staging directory, renames it into place, and then publishes it by
+atomically replacing the CURRENT pointer file, so readers never see a partially written index. Writers are
+serialized by a file lock, readers hold a shared lease on the version they opened, and old snapshots are
+garbage-collected once they are neither among the newest versions nor leased by a reader.
+Writers that loaded the index and changed it (uploads, batch ingestion) publish with commit_snapshot: if another
+writer published in the meantime, their changes are merged into the newer version under the writer lock instead
+of replacing it, so concurrent writers never silently overwrite each other's documents.
+
+Layout under the index path:
+    CURRENT              name of the published version
+    versions/v000042/    one complete save_local() snapshot per version
+    .write.lock          writer lock
+An index saved in the older single-directory layout is still read until the first snapshot is published.
+Leases use POSIX advisory locks; on Windows, files in use cannot be deleted, so garbage collection simply
+skips them and retries on the next publish.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import weakref
+from contextlib import contextmanager
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from quantization import QuantizedFAISS, RESCORE_FILE
+from dedup import LOCATION_KEYS
+from defaults import DEFAULT_INDEX_KEEP_VERSIONS
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+
+logger = logging.getLogger(__name__)
+
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = ".write.lock"
+LEASE_FILE = ".lease"
+STAGING_PREFIX = ".staging-"
+INDEX_FILES = ("index.faiss", "index.pkl", RESCORE_FILE, LEASE_FILE)
+
+
+
+def version_name(number):
+    return f"v{number:06d}"
+
+
+
+def list_versions(root):
+    """
+    Published snapshot versions under root, oldest first.
+    """
+    versions_dir = os.path.join(root, VERSIONS_DIR)
+    if not os.path.isdir(versions_dir):
+        return []
+    return sorted(name for name in os.listdir(versions_dir) if name.startswith("v") and name[1:].isdigit())
+
+
+
+def current_version(root):
+    """
+    Name of the published version, or None if no snapshot has been published yet.
+    """
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+
+def snapshot_path(root):
+    """
+    (version, directory) of the index readers should open: the published snapshot, else an index saved in the
+    older single-directory layout (version None), else (None, None).
+    """
+    version = current_version(root)
+    if version is not None:
+        return version, os.path.join(root, VERSIONS_DIR, version)
+    if os.path.exists(os.path.join(root, "index.faiss")):
+        return None, root
+    return None, None
+
+
+
+@contextmanager
+def writer_lock(root):
+    """
+    Exclusive lock serializing snapshot writers across threads and processes (blocks until acquired).
+    """
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, LOCK_FILE), "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+
+class SnapshotLease:
+    """
+    Shared lock on one snapshot version, released when the lease is garbage collected.
+    Stores that read files from their snapshot (the memory-mapped re-scoring vectors of a quantized index) keep
+    the lease as their rescore_owner, so the snapshot stays on disk while the store or any copy of it is in use.
+    The snapshot is never written to: a store holding a lease copies its re-scoring file before appending.
+    """
+    read_only = True
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        # Raises FileNotFoundError if the snapshot was collected before the lease was taken
+        fd = os.open(os.path.join(path, LEASE_FILE), os.O_RDONLY)
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+        weakref.finalize(self, os.close, fd)
+
+
+
+def is_leased(path):
+    """
+    Whether any reader (in any process) holds a lease on the snapshot at path.
+    """
+    if fcntl is None:
+        return False
+    try:
+        fd = os.open(os.path.join(path, LEASE_FILE), os.O_RDONLY)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+
+def publish_snapshot(vectorstore, root, extra_files=None, keep=DEFAULT_INDEX_KEEP_VERSIONS):
+    """
+    Write the vectorstore as a new immutable version and make it the published one. Returns the version name.
+    extra_files maps file names to text written into the snapshot alongside the index (e.g. an ingestion
+    manifest), so they are published atomically with it.
+    """
+    with writer_lock(root):
+        version = _write_version(vectorstore, root, extra_files, keep)
+    logger.info(f"Published index snapshot {version} at {root}")
+    return version
+
+
+
+def _write_version(vectorstore, root, extra_files, keep):
+    # Must be called with the writer lock held
+    versions_dir = os.path.join(root, VERSIONS_DIR)
+    os.makedirs(versions_dir, exist_ok=True)
+    existing = list_versions(root)
+    version = version_name(int(existing[-1][1:]) + 1 if existing else 1)
+    staging = tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=versions_dir)
+    try:
+        vectorstore.save_local(staging)
+        for name, text in (extra_files or {}).items():
+            with open(os.path.join(staging, name), "w", encoding="utf-8") as f:
+                f.write(text)
+        open(os.path.join(staging, LEASE_FILE), "w").close()
+        os.rename(staging, os.path.join(versions_dir, version))
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    pointer = os.path.join(root, CURRENT_FILE + ".tmp")
+    with open(pointer, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer, os.path.join(root, CURRENT_FILE))
+    collect_garbage(root, keep)
+    return version
+
+
+
+def read_extra_files(path):
+    """
+    The files published alongside the index in a snapshot directory (e.g. an ingestion manifest), by name.
+    """
+    files = {}
+    for name in os.listdir(path):
+        if name not in INDEX_FILES and os.path.isfile(os.path.join(path, name)):
+            with open(os.path.join(path, name), "r", encoding="utf-8") as f:
+                files[name] = f.read()
+    return files
+
+
+
+def commit_snapshot(vectorstore, root, extra_files=None, merge_files=None, replace=False, keep=DEFAULT_INDEX_KEEP_VERSIONS):
+    """
+    Publish the changes made to a vectorstore since it was loaded (from its `snapshot_version`) without losing
+    anything other writers published meanwhile. Under the writer lock, if the published version is still the one
+    the store was loaded from (or nothing is published), the store itself is published; otherwise its changes are
+    merged into the published version (see merge_changes), which is published instead.
+    Files of the published version that are not in extra_files are carried over; merge_files maps file names to
+    functions (base text, published text, new text) -> merged text, used for extra files when merging.
+    With replace, the store replaces the published version outright (e.g. a deliberate rebuild).
+    Returns the published store, which the caller should keep working on.
+    """
+    extra_files = dict(extra_files or {})
+    base = getattr(vectorstore, "snapshot_version", None)
+    with writer_lock(root):
+        current = current_version(root)
+        published = vectorstore
+        if current is not None and not replace:
+            current_path = os.path.join(root, VERSIONS_DIR, current)
+            current_files = read_extra_files(current_path)
+            if current != base:
+                base_path = os.path.join(root, VERSIONS_DIR, base) if base else None
+                if base_path is not None and not os.path.isdir(base_path):
+                    raise RuntimeError(f"Snapshot {base} of {root} was removed while a writer still held changes to it")
+                base_store = FAISS.load_local(base_path, vectorstore.embedding_function,
+                                              allow_dangerous_deserialization=True) if base_path else None
+                base_files = read_extra_files(base_path) if base_path else {}
+                published = open_snapshot(root, vectorstore.embedding_function)
+                merge_changes(published, vectorstore, base_store)
+                for name, merge in (merge_files or {}).items():
+                    if name in extra_files and name in current_files:
+                        extra_files[name] = merge(base_files.get(name), current_files[name], extra_files[name])
+                logger.info(f"Merged changes made on {base or 'a new index'} into {current} of {root}")
+            extra_files = dict(current_files, **extra_files)
+        version = _write_version(published, root, extra_files, keep)
+        # Keep the new version on disk while the store is in use, so its next changes can be merged against it
+        published.snapshot_lease = SnapshotLease(os.path.join(root, VERSIONS_DIR, version), version)
+    published.snapshot_version = version
+    logger.info(f"Published index snapshot {version} at {root}")
+    return published
+
+
+
+def _location(metadata):
+    return {key: metadata[key] for key in LOCATION_KEYS if key in metadata}
+
+
+
+def merge_metadata(base, current, mine):
+    """
+    Three-way merge of one chunk's metadata: the cited location changed in mine (a promoted near-duplicate)
+    replaces current's, and near-duplicate locations added or removed in mine are added to or removed from current's.
+    """
+    merged = dict(current)
+    if _location(mine) != _location(base):
+        for key in LOCATION_KEYS:
+            merged.pop(key, None)
+        merged.update(_location(mine))
+    base_duplicates, mine_duplicates = base.get("duplicate_sources", []), mine.get("duplicate_sources", [])
+    duplicates = [d for d in current.get("duplicate_sources", [])
+                  if (d in mine_duplicates or d not in base_duplicates) and d != _location(merged)]
+    duplicates.extend(d for d in mine_duplicates if d not in base_duplicates and d not in duplicates)
+    if duplicates or "duplicate_sources" in merged:
+        merged["duplicate_sources"] = duplicates
+    return merged
+
+
+
+def _stored_vectors(vectorstore, ids):
+    rows = {doc_id: row for row, doc_id in vectorstore.index_to_docstore_id.items()}
+    full_vectors = getattr(vectorstore, "full_vectors", None)
+    if full_vectors is not None:
+        return [np.asarray(full_vectors[rows[doc_id]], dtype=np.float32).tolist() for doc_id in ids]
+    return [vectorstore.index.reconstruct(rows[doc_id]).tolist() for doc_id in ids]
+
+
+
+def merge_changes(target, mine, base=None):
+    """
+    Apply the changes made in `mine` since `base` (the version it was loaded from, or None for a store built from
+    scratch) to `target`, a newer published version. Chunks added in mine are added with their vectors, chunks
+    deleted from base are deleted, and metadata changed in mine is merged into target's chunk (merge_metadata).
+    A chunk another writer deleted is kept if mine recorded other files' locations on it, citing those instead.
+    """
+    base_docs = base.docstore._dict if base is not None else {}
+    target_docs = target.docstore._dict
+    deleted = [doc_id for doc_id in base_docs if doc_id not in mine.docstore._dict and doc_id in target_docs]
+    if deleted:
+        target.delete(deleted)
+    added = {}
+    for doc_id, doc in mine.docstore._dict.items():
+        previous = base_docs.get(doc_id)
+        if previous is None:
+            if doc_id not in target_docs:
+                added[doc_id] = doc.metadata
+        elif doc.metadata != previous.metadata:
+            if doc_id in target_docs:
+                target_docs[doc_id].metadata = merge_metadata(previous.metadata, target_docs[doc_id].metadata, doc.metadata)
+                continue
+            locations = [d for d in doc.metadata.get("duplicate_sources", [])
+                         if d not in previous.metadata.get("duplicate_sources", [])]
+            if _location(doc.metadata) != _location(previous.metadata):
+                locations.insert(0, _location(doc.metadata))
+            if locations:
+                metadata = {key: value for key, value in doc.metadata.items() if key not in LOCATION_KEYS}
+                metadata.update(locations[0], duplicate_sources=locations[1:])
+                added[doc_id] = metadata
+    if added:
+        ids = list(added)
+        texts = [mine.docstore._dict[doc_id].page_content for doc_id in ids]
+        target.add_embeddings(list(zip(texts, _stored_vectors(mine, ids))), metadatas=[added[i] for i in ids], ids=ids)
+
+
+
+def collect_garbage(root, keep=DEFAULT_INDEX_KEEP_VERSIONS):
+    """
+    Delete snapshots older than the newest `keep` versions that no reader holds, plus abandoned staging
+    directories. Must be called with the writer lock held. Returns the removed version names.
+    """
+    versions_dir = os.path.join(root, VERSIONS_DIR)
+    if not os.path.isdir(versions_dir):
+        return []
+    for name in os.listdir(versions_dir):
+        if name.startswith(STAGING_PREFIX):
+            shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+    current = current_version(root)
+    versions = list_versions(root)
+    removed = []
+    for version in versions[:max(len(versions) - keep, 0)]:
+        path = os.path.join(versions_dir, version)
+        if version == current or is_leased(path):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        if not os.path.exists(path):
+            removed.append(version)
+    return removed
+
+
+
+def open_snapshot(root, embeddings, retries=3):
+    """
+    Load the published index under root, or None if there is none.
+    The loaded store records its `snapshot_version` and keeps serving that version even after newer ones are
+    published; its `snapshot_lease` keeps that version on disk, so its changes can later be merged (commit_snapshot). Retries if the version is collected between reading CURRENT and taking the lease.
+    """
+    for attempt in range(retries):
+        version, path = snapshot_path(root)
+        if path is None:
+            return None
+        try:
+            lease = SnapshotLease(path, version) if version is not None else None
+            # Quantized indexes are saved with their float32 re-scoring vectors alongside
+            if os.path.exists(os.path.join(path, RESCORE_FILE)):
+                store = QuantizedFAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+                store.rescore_owner = lease
+            else:
+                store = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+        except (FileNotFoundError, RuntimeError):
+            if version is None or attempt == retries - 1 or current_version(root) == version:
+                raise
+            continue
+        store.snapshot_version = version
+        store.snapshot_lease = lease
+        return store
+    return None
+
+
+
+def clear_snapshots(root):
+    """
+    Unpublish the index and delete every snapshot no reader holds (readers keep serving theirs).
+    Returns False if some snapshots are still in use.
+    """
+    with writer_lock(root):
+        try:
+            os.remove(os.path.join(root, CURRENT_FILE))
+        except FileNotFoundError:
+            pass
+        collect_garbage(root, keep=0)
+        return not list_versions(root)
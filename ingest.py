@@ -0,0 +1,282 @@
+"""
+Headless batch ingestion for course libraries.
+Walks a directory of PDFs and PPTX files, streams their content page by page through embedding in fixed-size batches,
+and writes the persisted FAISS index without needing the Streamlit UI.
+Progress is checkpointed after every file so an interrupted run can be resumed.
+
+Usage:
+    python ingest.py course-materials-for-testing/
+    python ingest.py course-materials-for-testing/ --faiss-path data/vector_index.faiss --restart
+    python ingest.py courses/ --shards --shard-key course
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from document_loader import LogReporter, iter_document_chunks, index_chunks, load_vector_store, new_duplicate_filter, \
+    remove_file
+from quantization import QuantizedFAISS, quantize_vectorstore
+from index_store import VERSIONS_DIR, snapshot_path, commit_snapshot
+from sharding import build_shards
+from models import load_embeddings
+from defaults import DEFAULT_EMBEDDING_MODEL, DEFAULT_FAISS_PATH, DEFAULT_EMBEDDING_BATCH_SIZE, DEFAULT_VECTOR_STORAGE, \
+    DEFAULT_NEAR_DUPLICATE_DEDUP, DEFAULT_SHARD_KEY
+
+
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.pptx', '.ppt')
+MANIFEST_NAME = "ingest_manifest.json"
+
+
+
+def find_course_files(root):
+    """
+    Find all supported course files under a directory, skipping hidden files and Office lock files.
+    """
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for filename in sorted(filenames):
+            if filename.startswith(('.', '~$')):
+                continue
+            if filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                found.append(os.path.join(dirpath, filename))
+    return found
+
+
+
+def file_fingerprint(path):
+    """
+    Fingerprint a file by size and modification time so changed files are re-ingested on resume.
+    """
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+
+def course_name(root, path):
+    """
+    The course a file belongs to: its top-level folder under the ingested directory, or None for files at the top.
+    """
+    parts = os.path.relpath(path, root).split(os.sep)
+    return parts[0] if len(parts) > 1 else None
+
+
+
+def tag_file(chunks, key, course):
+    """
+    Record the file's path under the ingested directory (its manifest key) on each chunk, so a changed file's
+    chunks can be told apart from those of other files with the same name, and its course, so the index can be
+    sharded by course.
+    """
+    for doc in chunks:
+        doc.metadata["path"] = key
+        if course:
+            doc.metadata["course"] = course
+        yield doc
+
+
+
+def is_unchanged(previous, fingerprint):
+    return bool(previous) and previous.get("size") == fingerprint["size"] and previous.get("mtime") == fingerprint["mtime"]
+
+
+
+def remove_changed_files(vectorstore, manifest, fingerprints):
+    """
+    Delete the chunks of files that changed since they were ingested and drop them from the manifest, so they are
+    indexed again. In an index built before chunks recorded their path, a file's chunks can only be matched by
+    name, so other files with the same name lose theirs too and are re-ingested as well.
+    Returns {manifest key: chunks deleted}.
+    """
+    removed = {}
+    pending = [key for key, fingerprint in fingerprints.items()
+               if key in manifest["files"] and not is_unchanged(manifest["files"][key], fingerprint)]
+    while pending:
+        key = pending.pop(0)
+        if key in removed:
+            continue
+        source = os.path.basename(key)
+        by_name = any(doc.metadata.get("source") == source and "path" not in doc.metadata
+                      for doc in vectorstore.docstore._dict.values())
+        removed[key] = remove_file(vectorstore, key, source)
+        manifest["files"].pop(key, None)
+        if by_name:
+            pending.extend(other for other in manifest["files"] if os.path.basename(other) == source)
+    return removed
+
+
+
+def load_manifest(faiss_path, version=None):
+    """
+    Load the ingestion manifest published with the index (or with a given snapshot version), or an empty one if there is none.
+    """
+    path = os.path.join(faiss_path, VERSIONS_DIR, version) if version else snapshot_path(faiss_path)[1]
+    manifest_path = os.path.join(path, MANIFEST_NAME) if path else None
+    if manifest_path is None or not os.path.exists(manifest_path):
+        return {"files": {}}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+
+def merge_manifests(base, current, mine):
+    """
+    Three-way merge of manifest texts: the files this run added, changed, or removed since base are applied to current.
+    """
+    base_files = json.loads(base)["files"] if base else {}
+    merged, mine = json.loads(current), json.loads(mine)
+    for key in set(base_files) | set(mine["files"]):
+        if key not in mine["files"]:
+            merged["files"].pop(key, None)
+        elif mine["files"][key] != base_files.get(key):
+            merged["files"][key] = mine["files"][key]
+    return json.dumps(merged, indent=2)
+
+
+
+def save_checkpoint(vectorstore, manifest, faiss_path, replace=False):
+    """
+    Publish the index and manifest together as one snapshot, so the manifest never lists files missing from the index.
+    Documents and files other writers (app uploads, other ingestion runs) published meanwhile are merged in, unless
+    replace is set. Returns the published store and its manifest, to continue from.
+    """
+    vectorstore = commit_snapshot(vectorstore, faiss_path, extra_files={MANIFEST_NAME: json.dumps(manifest, indent=2)},
+                                  merge_files={MANIFEST_NAME: merge_manifests}, replace=replace)
+    return vectorstore, load_manifest(faiss_path, vectorstore.snapshot_version)
+
+
+
+def ingest_directory(root, faiss_path=DEFAULT_FAISS_PATH, model_name=DEFAULT_EMBEDDING_MODEL,
+                     batch_size=DEFAULT_EMBEDDING_BATCH_SIZE, restart=False, storage=DEFAULT_VECTOR_STORAGE,
+                     dedup=DEFAULT_NEAR_DUPLICATE_DEDUP, shards=False, shard_key=DEFAULT_SHARD_KEY, out=sys.stdout):
+    """
+    Ingest every supported file under root into the index at faiss_path.
+    Files already recorded in the manifest (with an unchanged fingerprint) are skipped unless restart is set.
+    With dedup, near-duplicate chunks across all files are stored once and cite every location.
+    With a quantized storage type, the finished index is converted once at the end of the run.
+    With shards, the finished index is also published as one shard per course (or source) for sharded serving.
+    Returns a dict of throughput statistics for the run.
+    """
+    reporter = LogReporter()
+    files = find_course_files(root)
+    if not files:
+        reporter.warning(f"No PDF or PPTX files found under {root}")
+        return None
+    embeddings = load_embeddings(model_name)
+    vectorstore = None
+    manifest = {"files": {}}
+    if not restart:
+        vectorstore = load_vector_store(faiss_path, embeddings, reporter)
+    if vectorstore is not None:
+        # Read the manifest published with the loaded version, even if a newer one appeared meanwhile
+        manifest = load_manifest(faiss_path, vectorstore.snapshot_version)
+    if not manifest["files"]:
+        if vectorstore is not None:
+            reporter.warning(f"The index at {faiss_path} has no ingestion manifest (e.g. it was built from app uploads); "
+                             f"every file under {root} is ingested into it, keeping its existing documents")
+    else:
+        out.write(f"Resuming: {len(manifest['files'])} file(s) already ingested into {faiss_path}\n")
+    os.makedirs(faiss_path, exist_ok=True)
+    fingerprints = {os.path.relpath(path, root): file_fingerprint(path) for path in files}
+    checkpointed = vectorstore is not None
+    if vectorstore is not None:
+        for key, removed in remove_changed_files(vectorstore, manifest, fingerprints).items():
+            out.write(f"{key}: changed (or shares a name with a changed file), replacing {removed} indexed chunks\n")
+    duplicate_filter = new_duplicate_filter(vectorstore) if dedup else None
+
+    stats = {"files": 0, "skipped": 0, "failed": 0, "chunks": 0, "duplicates": 0, "extract_seconds": 0.0, "embed_seconds": 0.0}
+    run_started = time.perf_counter()
+    for index, path in enumerate(files, 1):
+        key = os.path.relpath(path, root)
+        fingerprint = fingerprints[key]
+        if is_unchanged(manifest["files"].get(key), fingerprint):
+            stats["skipped"] += 1
+            out.write(f"[{index}/{len(files)}] {key}: already ingested, skipping\n")
+            continue
+        try:
+            chunks = tag_file(iter_document_chunks(path), key, course_name(root, path))
+            vectorstore, file_stats = index_chunks(chunks, embeddings, vectorstore, batch_size,
+                                                   dedup=duplicate_filter)
+        except Exception as e:
+            reporter.error(f"Error processing document {key}: {str(e)}")
+            file_stats = None
+            # Drop any batches of the failed file that were already appended by rolling back to the last checkpoint
+            vectorstore = load_vector_store(faiss_path, embeddings, reporter) if checkpointed else None
+            if vectorstore is not None:
+                # The checkpoint may still hold changed files that have not been re-ingested yet
+                manifest = load_manifest(faiss_path, vectorstore.snapshot_version)
+                remove_changed_files(vectorstore, manifest, fingerprints)
+            duplicate_filter = new_duplicate_filter(vectorstore) if dedup else None
+        if not file_stats or not (file_stats["chunks"] or file_stats["duplicates"]):
+            stats["failed"] += 1
+            out.write(f"[{index}/{len(files)}] {key}: no content extracted\n")
+            continue
+        manifest["files"][key] = dict(fingerprint, chunks=file_stats["chunks"], duplicates=file_stats["duplicates"])
+        vectorstore, manifest = save_checkpoint(vectorstore, manifest, faiss_path, replace=restart and not checkpointed)
+        checkpointed = True
+        if dedup:
+            # Merging may have brought in documents other writers published
+            duplicate_filter = new_duplicate_filter(vectorstore)
+
+        units, chunk_count = file_stats["pages"], file_stats["chunks"]
+        extract_seconds, embed_seconds = file_stats["extract_seconds"], file_stats["embed_seconds"]
+        stats["files"] += 1
+        stats["chunks"] += chunk_count
+        stats["duplicates"] += file_stats["duplicates"]
+        stats["extract_seconds"] += extract_seconds
+        stats["embed_seconds"] += embed_seconds
+        out.write(
+            f"[{index}/{len(files)}] {key}: {units} pages/slides, {chunk_count} chunks, {file_stats['duplicates']} duplicates | "
+            f"extract {extract_seconds:.2f}s ({units / max(extract_seconds, 1e-9):.1f} pages/s), "
+            f"embed {embed_seconds:.2f}s ({chunk_count / max(embed_seconds, 1e-9):.1f} chunks/s)\n"
+        )
+    if storage != "float32" and vectorstore is not None and not isinstance(vectorstore, QuantizedFAISS):
+        vectorstore = quantize_vectorstore(vectorstore, storage)
+        vectorstore, manifest = save_checkpoint(vectorstore, manifest, faiss_path)
+        out.write(f"Converted index to {storage} storage\n")
+    if shards and vectorstore is not None:
+        shard_sizes = build_shards(vectorstore, faiss_path, shard_key, storage)
+        out.write(f"Published {len(shard_sizes)} shard(s) by {shard_key}: "
+                  + ", ".join(f"{value} ({count} chunks)" for value, count in sorted(shard_sizes.items())) + "\n")
+    stats["total_seconds"] = time.perf_counter() - run_started
+    stats["chunks_per_second"] = stats["chunks"] / max(stats["total_seconds"], 1e-9)
+    out.write(
+        f"Done: {stats['files']} ingested, {stats['skipped']} skipped, {stats['failed']} failed, "
+        f"{stats['chunks']} chunks ({stats['duplicates']} near-duplicates collapsed) in {stats['total_seconds']:.2f}s ({stats['chunks_per_second']:.1f} chunks/s)\n"
+    )
+    return stats
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch-ingest a directory of course materials into the FAISS index.")
+    parser.add_argument("directory", help="Directory containing PDF/PPTX course materials")
+    parser.add_argument("--faiss-path", default=DEFAULT_FAISS_PATH, help="Where to write the persisted index")
+    parser.add_argument("--model", default=DEFAULT_EMBEDDING_MODEL, help="Embedding model name")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_EMBEDDING_BATCH_SIZE, help="Chunks per embedding batch")
+    parser.add_argument("--restart", action="store_true", help="Ignore any previous progress and rebuild the index")
+    parser.add_argument("--no-dedup", action="store_true", help="Index near-duplicate chunks separately")
+    parser.add_argument("--storage", default=DEFAULT_VECTOR_STORAGE, choices=["float32", "float16", "int8"],
+                        help="Vector storage type for the saved index")
+    parser.add_argument("--shards", action="store_true", help="Also publish the index as shards for sharded serving")
+    parser.add_argument("--shard-key", default=DEFAULT_SHARD_KEY, choices=["course", "source"],
+                        help="Partition shards by course (top-level folder) or by source file")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    if not os.path.isdir(args.directory):
+        parser.error(f"{args.directory} is not a directory")
+    try:
+        stats = ingest_directory(args.directory, args.faiss_path, args.model, args.batch_size, args.restart, args.storage,
+                                 not args.no_dedup, args.shards, args.shard_key)
+    except KeyboardInterrupt:
+        print("\nInterrupted. Progress up to the last completed file was saved; rerun the same command to resume.")
+        return 130
+    return 0 if stats and not stats["failed"] else 1
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+Lightweight per-stage latency instrumentation for ingestion and the chatbot workflows.
+Records timing spans (extract, chunk, embed, retrieve, context_build, llm_prefill, llm_generation,
+parse, render), token counts, and cache hit rates in a process-wide registry, and exports them as
+Prometheus text or JSON. Also provides a sampled debug logger for final prompts.
+"""
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+
+
+# Histogram bucket upper bounds in seconds (covers fast searches through slow CPU generations)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Fraction of final prompts to print for debugging (0 disables, 1 prints every prompt)
+PROMPT_LOG_SAMPLE_RATE = float(os.environ.get("SOLOMIND_PROMPT_LOG_SAMPLE_RATE", "0"))
+
+
+
+def estimate_tokens(text):
+    """
+    Cheap token estimate (about four characters per token) for when the backend does not report counts.
+    """
+    return max(1, len(text) // 4) if text else 0
+
+
+
+class Metrics:
+    """
+    Thread-safe registry of stage latencies, token counts, and cache hits.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.tokens = {}
+            self.caches = {}
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(LATENCY_BUCKETS)}
+            entry["count"] += 1
+            entry["sum"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    entry["buckets"][i] += 1
+
+    def add_tokens(self, kind, count):
+        with self._lock:
+            self.tokens[kind] = self.tokens.get(kind, 0) + count
+
+    def record_cache(self, name, hit):
+        with self._lock:
+            entry = self.caches.setdefault(name, {"hits": 0, "misses": 0})
+            entry["hits" if hit else "misses"] += 1
+
+    def to_json(self):
+        """
+        Export a JSON-serializable snapshot of all metrics.
+        """
+        with self._lock:
+            stages = {
+                stage: {
+                    "count": e["count"],
+                    "total_seconds": e["sum"],
+                    "mean_seconds": e["sum"] / e["count"],
+                    "max_seconds": e["max"],
+                }
+                for stage, e in self.stages.items()
+            }
+            caches = {
+                name: dict(e, hit_rate=e["hits"] / max(e["hits"] + e["misses"], 1))
+                for name, e in self.caches.items()
+            }
+            return {"stages": stages, "tokens": dict(self.tokens), "caches": caches}
+
+    def to_prometheus(self):
+        """
+        Export all metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            "# HELP solomind_stage_seconds Time spent in each pipeline stage.",
+            "# TYPE solomind_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, e in sorted(self.stages.items()):
+                for bound, count in zip(LATENCY_BUCKETS, e["buckets"]):
+                    lines.append(f'solomind_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'solomind_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {e["count"]}')
+                lines.append(f'solomind_stage_seconds_sum{{stage="{stage}"}} {e["sum"]}')
+                lines.append(f'solomind_stage_seconds_count{{stage="{stage}"}} {e["count"]}')
+            lines.append("# HELP solomind_tokens_total Tokens processed, by kind.")
+            lines.append("# TYPE solomind_tokens_total counter")
+            for kind, count in sorted(self.tokens.items()):
+                lines.append(f'solomind_tokens_total{{kind="{kind}"}} {count}')
+            lines.append("# HELP solomind_cache_requests_total Cache lookups, by cache and result.")
+            lines.append("# TYPE solomind_cache_requests_total counter")
+            for name, e in sorted(self.caches.items()):
+                lines.append(f'solomind_cache_requests_total{{cache="{name}",result="hit"}} {e["hits"]}')
+                lines.append(f'solomind_cache_requests_total{{cache="{name}",result="miss"}} {e["misses"]}')
+        return "\n".join(lines) + "\n"
+
+
+
+# Process-wide registry shared by the UI, API server, and CLI tools
+metrics = Metrics()
+
+
+
+@contextmanager
+def span(stage):
+    """
+    Time a block of code and record it under the given stage name.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe(stage, time.perf_counter() - started)
+
+
+
+def record_llm_timing(started, first_token, ended, generation_info=None, prompt_text="", completion_text=""):
+    """
+    Split one LLM call into prefill and generation time and record its token counts.
+    Uses Ollama's reported durations and counts when available, and falls back to
+    time-to-first-token and character-based estimates otherwise.
+    """
+    info = generation_info or {}
+    if "prompt_eval_duration" in info and "eval_duration" in info:
+        metrics.observe("llm_prefill", info["prompt_eval_duration"] / 1e9)
+        metrics.observe("llm_generation", info["eval_duration"] / 1e9)
+    elif started is not None:
+        first = first_token or ended
+        metrics.observe("llm_prefill", first - started)
+        metrics.observe("llm_generation", ended - first)
+    metrics.add_tokens("prompt", info.get("prompt_eval_count") or estimate_tokens(prompt_text))
+    metrics.add_tokens("completion", info.get("eval_count") or estimate_tokens(completion_text))
+
+
+
+class PromptLogger:
+    """
+    Sampled debug logger for final prompts. Printing every prompt is itself a hot-path cost,
+    so only a configurable fraction of prompts is formatted and printed.
+    """
+    def __init__(self, sample_rate=PROMPT_LOG_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self._console = None
+
+    def should_log(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def log(self, final_prompt):
+        # Import rich lazily so it costs nothing when prompt logging is disabled
+        from rich.console import Console
+        from rich.panel import Panel
+        from rich.text import Text
+        if self._console is None:
+            self._console = Console()
+        text = Text()
+        text.append("🤖 Final Prompt to Model\n", style="bold green")
+        text.append(final_prompt, style="yellow")
+        self._console.print(Panel(text, border_style="red"))
+
+
+
+prompt_logger = PromptLogger()
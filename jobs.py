@@ -0,0 +1,203 @@
+"""
+Background ingestion jobs for the Streamlit app.
+Uploaded files are queued and indexed one at a time on a worker thread, with per-file progress (pages parsed,
+chunks embedded) and cancellation. While a file is being embedded, a copy of the growing index is published every
+few seconds, so questions can be answered from the documents indexed so far while the rest are still being processed.
+"""
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from document_loader import LogReporter, get_source_name, spool_upload, iter_document_chunks, index_chunks, \
+    copy_vector_store, save_vector_store, new_duplicate_filter
+from quantization import QuantizedFAISS, quantize_vectorstore
+from defaults import DEFAULT_VECTOR_STORAGE, DEFAULT_NEAR_DUPLICATE_DEDUP, DEFAULT_INGESTION_PUBLISH_SECONDS
+
+
+
+class JobCancelled(Exception):
+    """Raised inside a job's chunk stream when the job has been cancelled."""
+
+
+
+def count_document_pages(path, source):
+    """
+    Number of pages (PDF) or slides (PPTX) in a file, used as the progress total.
+    """
+    if source.lower().endswith('.pdf'):
+        import fitz
+        with fitz.open(path) as doc:
+            return doc.page_count
+    from pptx import Presentation
+    return len(Presentation(path).slides)
+
+
+
+class IngestionJob:
+    """
+    State of one uploaded file's ingestion. Fields are written by the worker thread and read by the UI.
+    """
+    def __init__(self, job_id, source, path):
+        self.id = job_id
+        self.source = source
+        self.path = path
+        self.status = "queued"  # queued, running, done, failed, or cancelled
+        self.total_pages = None
+        self.pages_parsed = 0
+        self.chunks_embedded = 0
+        self.duplicates = 0
+        self.error = None
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    @property
+    def progress(self):
+        if self.status == "done":
+            return 1.0
+        if not self.total_pages:
+            return 0.0
+        return min(self.pages_parsed / self.total_pages, 1.0)
+
+
+
+class IngestionManager:
+    """
+    Per-session queue of ingestion jobs that all append to one index.
+    `vectorstore` always holds the latest published copy, safe to search while jobs are running.
+    embeddings_loader is a thread-safe callable returning the embeddings model (e.g. models.get_embeddings).
+    Partial indexes are published at most every publish_seconds, since each publish copies the whole index.
+    """
+    def __init__(self, embeddings_loader, faiss_path, vectorstore=None, storage=DEFAULT_VECTOR_STORAGE,
+                 dedup=DEFAULT_NEAR_DUPLICATE_DEDUP, publish_seconds=DEFAULT_INGESTION_PUBLISH_SECONDS):
+        self.embeddings_loader = embeddings_loader
+        self.faiss_path = faiss_path
+        self.storage = storage
+        self.dedup = dedup
+        self.publish_seconds = publish_seconds
+        self.vectorstore = vectorstore
+        self._working = vectorstore  # Last committed index (only completed files)
+        self._jobs = {}
+        self._submitted = set()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingestion")
+        self.reporter = LogReporter()
+
+    @staticmethod
+    def upload_key(file):
+        """
+        Identify an upload across reruns (Streamlit returns the same files from the uploader on every rerun).
+        """
+        return getattr(file, "file_id", None) or (get_source_name(file), getattr(file, "size", None))
+
+    def submit(self, file):
+        """
+        Queue an uploaded file for ingestion, unless it was already submitted. Returns the job or None.
+        The upload is spooled to disk here so the job does not depend on the upload object after this rerun.
+        """
+        key = self.upload_key(file)
+        with self._lock:
+            if key in self._submitted:
+                return None
+            self._submitted.add(key)
+        job = IngestionJob(next(self._ids), get_source_name(file), spool_upload(file))
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        return job
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is not None and job.active:
+            job.cancel_event.set()
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def has_active_jobs(self):
+        return any(job.active for job in self.jobs())
+
+    def clear_finished(self):
+        with self._lock:
+            self._jobs = {job_id: job for job_id, job in self._jobs.items() if job.active}
+
+    def _tracked_chunks(self, job, chunks):
+        for doc in chunks:
+            if job.cancel_event.is_set():
+                raise JobCancelled()
+            number = doc.metadata.get("page_number", doc.metadata.get("slide_number"))
+            if isinstance(number, int):
+                job.pages_parsed = max(job.pages_parsed, number)
+            yield doc
+
+    def _run(self, job):
+        if job.cancel_event.is_set():
+            job.status = "cancelled"
+            self._cleanup(job)
+            return
+        job.status = "running"
+        job.started = time.time()
+        # The job appends to its own copy, so a cancelled or failed file never reaches the committed index
+        store = copy_vector_store(self._working) if self._working is not None else None
+        try:
+            job.total_pages = count_document_pages(job.path, job.source)
+            embeddings = self.embeddings_loader()
+            duplicate_filter = new_duplicate_filter(store) if self.dedup else None
+            last_publish = time.monotonic()
+
+            def on_batch(partial_store, stats):
+                nonlocal last_publish
+                job.chunks_embedded = stats["chunks"]
+                job.duplicates = stats["duplicates"]
+                # Publish what has been indexed so far for querying (throttled; the finished index is published below)
+                if partial_store is not None and time.monotonic() - last_publish >= self.publish_seconds:
+                    self.vectorstore = copy_vector_store(partial_store)
+                    last_publish = time.monotonic()
+
+            chunks = self._tracked_chunks(job, iter_document_chunks(job.path, job.source))
+            store, stats = index_chunks(chunks, embeddings, store, dedup=duplicate_filter, on_batch=on_batch)
+        except JobCancelled:
+            status = "cancelled"
+        except Exception as e:
+            status, job.error = "failed", str(e)
+        else:
+            if not stats["chunks"] and not stats["duplicates"]:
+                status, job.error = "failed", "No content extracted"
+            else:
+                if self.storage != "float32" and not isinstance(store, QuantizedFAISS):
+                    store = quantize_vectorstore(store, self.storage)
+                # Merged with documents other sessions (or batch ingestion) published meanwhile
+                self._working = save_vector_store(store, self.faiss_path, self.reporter)
+                status = "done"
+        if status != "done":
+            self._discard_duplicates_of(job.source)
+        # Publish the committed index (without the partial file if the job did not finish) before reporting the status
+        self.vectorstore = copy_vector_store(self._working) if self._working is not None else None
+        job.finished = time.time()
+        job.status = status
+        self._cleanup(job)
+
+    def _discard_duplicates_of(self, source):
+        """
+        Drop near-duplicate locations recorded for a file whose job did not finish (documents are shared by copies).
+        """
+        if self._working is None:
+            return
+        for doc in self._working.docstore._dict.values():
+            duplicates = doc.metadata.get("duplicate_sources")
+            if duplicates:
+                doc.metadata["duplicate_sources"] = [d for d in duplicates if d.get("source") != source]
+
+    @staticmethod
+    def _cleanup(job):
+        try:
+            os.remove(job.path)
+        except OSError:
+            pass
@@ -1,30 +1,94 @@
 """
 Initializes and configures language models and embedding models for the chatbot.
 Handles model loading and error reporting.
+Model libraries (sentence-transformers/torch, langchain-ollama) are imported on first use to keep startup fast.
 """
-from langchain_ollama import OllamaLLM
-from langchain_huggingface import HuggingFaceEmbeddings
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
+from defaults import DEFAULT_EMBEDDING_BACKEND
 
 
 
-def init_embeddings(model_name='all-MiniLM-L6-v2'):
-    """Initialize embeddings model with error handling"""
+def load_embeddings(model_name='all-MiniLM-L6-v2', backend=DEFAULT_EMBEDDING_BACKEND):
+    """
+    Load the embeddings model without any UI handling (used by the CLI and worker processes).
+    The ONNX backends are only used if their parity check against PyTorch passes; otherwise falls back to PyTorch.
+    """
+    from langchain_huggingface import HuggingFaceEmbeddings
+    if backend in ("onnx", "onnx-int8"):
+        from onnx_embeddings import load_onnx_embeddings
+        embeddings = load_onnx_embeddings(model_name, backend,
+                                          reference_factory=lambda: HuggingFaceEmbeddings(model_name=model_name))
+        if embeddings is not None:
+            return embeddings
+    return HuggingFaceEmbeddings(model_name=model_name)
+
+
+
+@st.cache_resource(show_spinner=False)
+def start_embeddings_loading(model_name='all-MiniLM-L6-v2', backend=DEFAULT_EMBEDDING_BACKEND):
+    """
+    Start loading the embeddings model on a background thread, once per server process.
+    Returns a future, so the UI can render while torch and the model weights are still loading.
+    """
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embeddings-loader")
+    future = executor.submit(load_embeddings, model_name, backend)
+    executor.shutdown(wait=False)
+    return future
+
+
+
+def embeddings_ready(model_name='all-MiniLM-L6-v2', backend=DEFAULT_EMBEDDING_BACKEND):
+    """Whether the background-loaded embeddings model has finished loading (successfully or not)"""
+    return start_embeddings_loading(model_name, backend).done()
+
+
+
+def get_embeddings(model_name='all-MiniLM-L6-v2', backend=DEFAULT_EMBEDDING_BACKEND):
+    """
+    Wait for the background-loaded embeddings model. Safe to call from worker threads (no UI handling).
+    A failed load is forgotten before the error is raised, so the next call retries instead of failing forever.
+    """
     try:
-        return HuggingFaceEmbeddings(model_name=model_name)
-    except Exception as e:
-        st.error(f"Failed to initialize embeddings model. Error details: {str(e)}")
-        st.info("Please make sure you have an internet connection and the model is accessible.")
-        st.stop()
+        return start_embeddings_loading(model_name, backend).result()
+    except Exception:
+        start_embeddings_loading.clear()
+        raise
+
+
+
+def load_llm(model_name="llama3", temperature=0.7):
+    """Create the Ollama LLM client without any UI handling (used by the API server and worker processes)"""
+    from langchain_ollama import OllamaLLM
+    return OllamaLLM(model=model_name, temperature=temperature)
 
 
 
 def init_llm(model_name="llama3", temperature=0.7):
     """Initialize LLM with error handling and configurable parameters"""
     try:
-        return OllamaLLM(model=model_name, temperature=temperature)
+        return load_llm(model_name, temperature)
     except Exception as e:
         st.error(f"Failed to initialize Ollama. Please make sure Ollama is running and the model is pulled.")
         st.error(f"Error details: {str(e)}")
         st.info(f"Try running 'ollama pull {model_name}' in your terminal if you haven't already.")
+        st.stop()
+
+
+
+@st.cache_resource(show_spinner=False)
+def load_router(temperature=0.7):
+    """Create the model router once per server process, so all sessions share its queue depth and latency stats"""
+    from router import build_router
+    return build_router(temperature=temperature)
+
+
+
+def init_router(temperature=0.7):
+    """Initialize the workload-aware model router with error handling"""
+    try:
+        return load_router(temperature)
+    except Exception as e:
+        st.error("Failed to initialize the model router. Please make sure Ollama is running and the models are pulled.")
+        st.error(f"Error details: {str(e)}")
         st.stop()
\ No newline at end of file
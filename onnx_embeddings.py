@@ -0,0 +1,225 @@
+"""
+ONNX Runtime backend for the sentence-transformers embedding model.
+Runs the same model (e.g. all-MiniLM-L6-v2) from locally exported ONNX files, optionally int8-quantized,
+instead of PyTorch eager mode. A parity check against the PyTorch output is required before the ONNX
+model is used; the result is cached next to the model files so later startups skip loading PyTorch.
+
+Usage:
+    python onnx_embeddings.py export                 # export + int8-quantize to data/onnx/<model>
+    python onnx_embeddings.py bench --texts 512      # throughput: pytorch vs onnx vs onnx-int8
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from defaults import DEFAULT_EMBEDDING_MODEL, DEFAULT_ONNX_MODEL_DIR, DEFAULT_ONNX_PARITY_THRESHOLD
+
+
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILES = {"onnx": "model.onnx", "onnx-int8": "model_int8.onnx"}
+PARITY_FILE = "parity.json"
+MAX_SEQ_LENGTH = 256  # all-MiniLM-L6-v2's sentence-transformers max_seq_length
+PARITY_TEXTS = [
+    "What is part-of-speech tagging?",
+    "Naive Bayes assumes features are conditionally independent given the class.",
+    "**Title:** Regular Expressions\n**Key Points:**\n• Disjunctions\n• Negation in disjunction",
+    "Precision is the percentage of selected items that are correct.",
+    "[Image omitted]",
+    "Named entity recognition finds and classifies names in text such as people, places, and organizations.",
+]
+
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    LangChain embeddings that run an exported sentence-transformers model with ONNX Runtime on CPU.
+    Applies the same mean pooling and L2 normalization as the sentence-transformers pipeline.
+    """
+    def __init__(self, model_dir, backend="onnx-int8", batch_size=32, num_threads=0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        self.model_path = os.path.join(model_dir, MODEL_FILES[backend])
+        self.batch_size = batch_size
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+
+    def _embed(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + self.batch_size])
+            input_ids = np.asarray([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.asarray([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+            token_embeddings = self.session.run(None, feeds)[0]
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            vectors.append(pooled)
+        return np.vstack(vectors).tolist() if vectors else []
+
+    def embed_documents(self, texts):
+        return self._embed(list(texts))
+
+    def embed_query(self, text):
+        return self._embed([text])[0]
+
+    def embed_queries(self, texts):
+        """Embed several queries in one batch (queries and documents are embedded alike)"""
+        return self._embed(list(texts))
+
+
+
+def export_onnx_model(model_name=DEFAULT_EMBEDDING_MODEL, output_dir=DEFAULT_ONNX_MODEL_DIR, quantize=True):
+    """
+    Export the sentence-transformers transformer to ONNX (plus its tokenizer), and optionally an int8
+    dynamically-quantized copy. Pooling and normalization are done in OnnxEmbeddings.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    os.makedirs(output_dir, exist_ok=True)
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0].auto_model.eval()
+    st_model.tokenizer.save_pretrained(output_dir)
+    sample = st_model.tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    model_path = os.path.join(output_dir, MODEL_FILES["onnx"])
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer, tuple(sample[name] for name in input_names), model_path,
+            input_names=input_names, output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes, opset_version=14,
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(model_path, os.path.join(output_dir, MODEL_FILES["onnx-int8"]), weight_type=QuantType.QInt8)
+    # Any previous parity result is for the old files
+    parity_path = os.path.join(output_dir, PARITY_FILE)
+    if os.path.exists(parity_path):
+        os.remove(parity_path)
+    return output_dir
+
+
+
+def parity_check(candidate, reference, texts=PARITY_TEXTS):
+    """
+    Minimum cosine similarity between candidate and reference embeddings over the sample texts.
+    """
+    a = np.asarray(candidate.embed_documents(texts), dtype=np.float32)
+    b = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    cosine = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return float(cosine.min())
+
+
+
+def _model_fingerprint(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+
+def load_onnx_embeddings(model_name, backend, model_dir=DEFAULT_ONNX_MODEL_DIR, threshold=DEFAULT_ONNX_PARITY_THRESHOLD,
+                         reference_factory=None):
+    """
+    Load the ONNX backend if its parity check passes, otherwise return None so the caller can fall back.
+    The parity result is cached per model file; reference_factory builds the PyTorch embeddings when a check is needed.
+    """
+    model_path = os.path.join(model_dir, MODEL_FILES[backend])
+    if not os.path.exists(model_path):
+        logger.warning(f"ONNX model not found at {model_path}; run 'python onnx_embeddings.py export' first")
+        return None
+    try:
+        candidate = OnnxEmbeddings(model_dir, backend)
+    except Exception as e:
+        logger.warning(f"Could not load ONNX embeddings from {model_path}: {str(e)}")
+        return None
+    parity_path = os.path.join(model_dir, PARITY_FILE)
+    cache = {}
+    if os.path.exists(parity_path):
+        with open(parity_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    fingerprint = _model_fingerprint(model_path)
+    entry = cache.get(backend)
+    if not entry or entry.get("fingerprint") != fingerprint or entry.get("model_name") != model_name:
+        reference = reference_factory()
+        entry = {"model_name": model_name, "fingerprint": fingerprint, "min_cosine": parity_check(candidate, reference)}
+        cache[backend] = entry
+        with open(parity_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=2)
+    if entry["min_cosine"] < threshold:
+        logger.warning(f"ONNX backend {backend} failed parity check (min cosine {entry['min_cosine']:.4f} < {threshold}); "
+                       f"falling back to PyTorch")
+        return None
+    return candidate
+
+
+
+def benchmark_backends(model_name=DEFAULT_EMBEDDING_MODEL, model_dir=DEFAULT_ONNX_MODEL_DIR, num_texts=512, rounds=20):
+    """
+    Compare bulk throughput (chunks/sec) and single-query latency across the available backends.
+    """
+    from langchain_huggingface import HuggingFaceEmbeddings
+    texts = [PARITY_TEXTS[i % len(PARITY_TEXTS)] + f" ({i})" for i in range(num_texts)]
+    backends = {"pytorch": HuggingFaceEmbeddings(model_name=model_name)}
+    for backend, filename in MODEL_FILES.items():
+        if os.path.exists(os.path.join(model_dir, filename)):
+            backends[backend] = OnnxEmbeddings(model_dir, backend)
+    results = {}
+    for name, embeddings in backends.items():
+        embeddings.embed_documents(texts[:8])  # warm up
+        started = time.perf_counter()
+        embeddings.embed_documents(texts)
+        bulk_seconds = time.perf_counter() - started
+        query_ms = []
+        for i in range(rounds):
+            started = time.perf_counter()
+            embeddings.embed_query(PARITY_TEXTS[i % len(PARITY_TEXTS)])
+            query_ms.append((time.perf_counter() - started) * 1000)
+        results[name] = {
+            "chunks_per_second": num_texts / bulk_seconds,
+            "query_p50_ms": float(np.percentile(query_ms, 50)),
+        }
+        if name != "pytorch":
+            results[name]["min_cosine_vs_pytorch"] = parity_check(embeddings, backends["pytorch"])
+    return results
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export and benchmark the ONNX Runtime embedding backend.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser("export", help="Export the embedding model to ONNX (and int8)")
+    export.add_argument("--model", default=DEFAULT_EMBEDDING_MODEL)
+    export.add_argument("--output", default=DEFAULT_ONNX_MODEL_DIR)
+    export.add_argument("--no-quantize", action="store_true", help="Skip the int8 quantized copy")
+    bench = subparsers.add_parser("bench", help="Compare PyTorch and ONNX Runtime throughput")
+    bench.add_argument("--model", default=DEFAULT_EMBEDDING_MODEL)
+    bench.add_argument("--model-dir", default=DEFAULT_ONNX_MODEL_DIR)
+    bench.add_argument("--texts", type=int, default=512, help="Number of texts in the bulk embedding run")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    if args.command == "export":
+        print(f"Exported to {export_onnx_model(args.model, args.output, not args.no_quantize)}")
+    else:
+        print(json.dumps(benchmark_backends(args.model, args.model_dir, args.texts), indent=2))
+    return 0
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -119,6 +119,53 @@ summarize_prompt = PromptTemplate(
 
 
 
+partial_summary_prompt = PromptTemplate(
+    input_variables=["context"],
+    template="""You are an extremely knowledgeable and precise teaching assistant. 
+    Condense the course material excerpts below into concise study notes that will later be merged with notes from other parts of the same material.
+    Keep every definition, key term, formula, and example.
+    After each note, copy the bracketed source reference of the excerpt it came from exactly as written (for example [From Slide 3 in Example.pptx]).
+    Do not add an introduction, conclusion, or references section.
+
+    ---
+
+    # Excerpts:
+    {context}
+
+    ---
+
+    # Now write the notes as a plain bulleted list.
+    """
+)
+
+
+
+reduce_summary_prompt = PromptTemplate(
+    input_variables=["summaries", "topic"],
+    template=f"""You are an extremely knowledgeable and precise teaching assistant. 
+    Your task is to summarize course materials and student uploaded notes to help a student understand the material better.
+    Below are study notes covering consecutive parts of the material on "{{topic}}". Each note ends with the bracketed source reference it came from.
+    Merge them into one well-organized summary, removing repetition but keeping all important concepts.
+    Cite the bracketed source references of the notes you use; do not invent new ones.
+
+    ---
+
+    # Notes:
+    {{summaries}}
+
+    ---
+
+    # Formatting Rules:
+    {HTML_FORMATTING_RULES}
+
+    ---
+
+    # Now it's time for you to write the summary.
+    """
+)
+
+
+
 quiz_prompt = PromptTemplate(
     input_variables=["context", "topic", "num_questions", "previous_questions"],
     template=f"""You are an extremely knowledgeable teaching assistant. 
@@ -196,6 +243,43 @@ quiz_prompt = PromptTemplate(
 
 
 
+structured_quiz_prompt = PromptTemplate(
+    input_variables=["context", "topic", "num_questions", "previous_questions", "retry_note"],
+    template="""You are an extremely knowledgeable teaching assistant. 
+    Generate {num_questions} multiple choice questions that test understanding of key concepts about {topic} from the provided context.
+    Use the context below from the course materials and student uploaded notes to generate the quiz.
+    If any of the context is not relevant to {topic}, ignore it.
+    If any of the context is wrong, you may respond with the correct information based on your knowledge.
+
+
+
+    # Context (Course Materials and Student Uploaded Notes):
+    {context}
+
+    # Previous questions (AVOID REPEATING THESE):
+    {previous_questions}
+
+    {retry_note}
+
+    ---
+
+    # Output Rules:
+    1. Respond with a single JSON object and nothing else
+    2. Each question has exactly 4 options with the keys "A", "B", "C", "D"
+    3. Only one option is correct; "answer" is its letter
+    4. Make questions challenging but fair, and do not repeat questions
+
+    # JSON Format (Follow this Structure):
+    {{"questions": [{{"question": "What is the capital of France?", "options": {{"A": "Berlin", "B": "Madrid", "C": "Paris", "D": "Rome"}}, "answer": "C"}}]}}
+
+    ---
+
+    # Now it's time for you to generate the quiz as JSON.
+    """
+)
+
+
+
 grade_prompt = PromptTemplate(
     input_variables=["results", "topic", "student_progress", "formatted_quiz"],
     template=f"""You are an extremely knowledgeable teaching assistant providing feedback on a multiple choice quiz about {{topic}} from course materials and student uploaded notes.
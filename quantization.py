@@ -0,0 +1,242 @@
+"""
+Quantized vector storage for the document index.
+Keeps chunk vectors in a FAISS scalar-quantized index (float16 or int8 per dimension) instead of full float32,
+and re-scores a small candidate set exactly against float32 vectors kept in a memory-mapped file on disk,
+so only the candidate rows are ever paged in. Also provides a memory/recall/latency report against the
+float32 baseline.
+"""
+import os
+import tempfile
+import time
+import weakref
+import numpy as np
+import faiss
+from langchain_community.vectorstores import FAISS
+from defaults import DEFAULT_RESCORE_OVERSAMPLE
+
+
+
+STORAGE_TYPES = {
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+RESCORE_FILE = "vectors.f32"
+SNAPSHOT_ATTRIBUTES = ("snapshot_version", "snapshot_lease")  # Set by index_store on stores loaded from a snapshot
+
+
+
+def _open_rescore_vectors(path, index):
+    """
+    Memory-map a raw float32 vector file as an (ntotal, dim) array matching the index.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) < index.ntotal * index.d * 4 or index.ntotal == 0:
+        return None
+    return np.memmap(path, dtype=np.float32, mode="r", shape=(index.ntotal, index.d))
+
+
+
+class TemporaryRescoreFile:
+    """
+    Owner of a temporary float32 re-scoring file; the file is removed once no store references its owner.
+    """
+    def __init__(self, path):
+        self.path = path
+        weakref.finalize(self, os.remove, path)
+
+
+
+class QuantizedFAISS(FAISS):
+    """
+    FAISS vectorstore backed by a scalar-quantized index, with optional exact re-scoring.
+    Searches fetch `oversample * k` candidates from the compressed index, then re-rank them by exact
+    L2 distance using the float32 vectors in `rescore_path` (if present).
+    rescore_owner keeps a temporary re-scoring file alive for as long as any store (or copy) uses it.
+    """
+    def __init__(self, *args, rescore_path=None, oversample=DEFAULT_RESCORE_OVERSAMPLE, rescore_owner=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rescore_path = rescore_path
+        self.oversample = oversample
+        self.rescore_owner = rescore_owner
+        self.full_vectors = _open_rescore_vectors(rescore_path, self.index) if rescore_path else None
+
+    def _detach_rescore_file(self):
+        """
+        Copy this store's rows of the re-scoring vectors to a private temporary file before appending (snapshots
+        on disk are immutable, and rows past this store's end belong to another store sharing the file).
+        """
+        fd, path = tempfile.mkstemp(suffix=".f32")
+        os.close(fd)
+        self._copy_rescore_rows(path)
+        self.rescore_path = path
+        self.rescore_owner = TemporaryRescoreFile(path)
+
+    def delete(self, ids=None, **kwargs):
+        if not self.rescore_path or self.full_vectors is None or not ids:
+            return super().delete(ids, **kwargs)
+        removed = set(ids)
+        kept_rows = [row for row, doc_id in sorted(self.index_to_docstore_id.items()) if doc_id not in removed]
+        kept_vectors = np.asarray(self.full_vectors[kept_rows], dtype=np.float32)
+        result = super().delete(ids, **kwargs)
+        # Rows stay aligned with index ids: write the remaining vectors to a new private file (the old one may be
+        # a snapshot or shared with copies of this store)
+        fd, path = tempfile.mkstemp(suffix=".f32")
+        os.close(fd)
+        kept_vectors.tofile(path)
+        self.rescore_path = path
+        self.rescore_owner = TemporaryRescoreFile(path)
+        self.full_vectors = _open_rescore_vectors(path, self.index)
+        return result
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None, **kwargs):
+        text_embeddings = list(text_embeddings)
+        # Copies of a store share its file, so it is only appended to in place while it ends at this store's last
+        # row; otherwise another store (e.g. a cancelled upload's published copy) may still map the rows past it,
+        # which must never be truncated
+        if self.rescore_path and (getattr(self.rescore_owner, "read_only", False)
+                                  or os.path.getsize(self.rescore_path) != self.index.ntotal * self.index.d * 4):
+            self._detach_rescore_file()
+        if self.rescore_path:
+            vectors = np.asarray([vector for _, vector in text_embeddings], dtype=np.float32)
+            with open(self.rescore_path, "ab") as f:
+                f.write(vectors.tobytes())
+        ids = super().add_embeddings(text_embeddings, metadatas=metadatas, ids=ids, **kwargs)
+        if self.rescore_path:
+            self.full_vectors = _open_rescore_vectors(self.rescore_path, self.index)
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        vectors = self.embedding_function.embed_documents(texts) if hasattr(self.embedding_function, "embed_documents") \
+            else [self.embedding_function(text) for text in texts]
+        return self.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids, **kwargs)
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, fetch_k=20, **kwargs):
+        # Metadata filters and missing float32 vectors fall back to plain (approximate) search
+        if filter is not None or self.full_vectors is None:
+            return super().similarity_search_with_score_by_vector(embedding, k=k, filter=filter, fetch_k=fetch_k, **kwargs)
+        query = np.asarray([embedding], dtype=np.float32)
+        _, indices = self.index.search(query, k * self.oversample)
+        candidates = indices[0][indices[0] >= 0]
+        if candidates.size == 0:
+            return []
+        # Sorted row order makes the memmap reads sequential
+        rows = np.sort(candidates)
+        exact = ((np.asarray(self.full_vectors[rows]) - query) ** 2).sum(axis=1)
+        order = np.argsort(exact)[:k]
+        results = []
+        for position in order:
+            doc = self.docstore.search(self.index_to_docstore_id[int(rows[position])])
+            results.append((doc, float(exact[position])))
+        return results
+
+    def _copy_rescore_rows(self, path):
+        # Only this store's rows: a shared file may extend past them
+        with open(self.rescore_path, "rb") as source, open(path, "wb") as target:
+            remaining = self.index.ntotal * self.index.d * 4
+            while remaining > 0:
+                block = source.read(min(remaining, 1 << 20))
+                if not block:
+                    break
+                target.write(block)
+                remaining -= len(block)
+
+    def save_local(self, folder_path, index_name="index"):
+        super().save_local(folder_path, index_name)
+        if self.rescore_path and os.path.abspath(self.rescore_path) != os.path.abspath(os.path.join(folder_path, RESCORE_FILE)):
+            self._copy_rescore_rows(os.path.join(folder_path, RESCORE_FILE))
+
+    @classmethod
+    def load_local(cls, folder_path, embeddings, index_name="index", allow_dangerous_deserialization=False, **kwargs):
+        store = FAISS.load_local(folder_path, embeddings, index_name=index_name,
+                                 allow_dangerous_deserialization=allow_dangerous_deserialization, **kwargs)
+        return cls(store.embedding_function, store.index, store.docstore, store.index_to_docstore_id,
+                   rescore_path=os.path.join(folder_path, RESCORE_FILE))
+
+
+
+def build_quantized_index(vectors, storage):
+    """
+    Train and fill a scalar-quantized L2 index for the given float32 vectors.
+    """
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"Unknown vector storage type: {storage} (expected one of {', '.join(STORAGE_TYPES)})")
+    index = faiss.IndexScalarQuantizer(vectors.shape[1], STORAGE_TYPES[storage], faiss.METRIC_L2)
+    index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+
+def quantize_vectorstore(vectorstore, storage="int8", rescore=True, rescore_path=None, oversample=DEFAULT_RESCORE_OVERSAMPLE):
+    """
+    Convert a float32 FAISS vectorstore into a QuantizedFAISS sharing the same docstore.
+    When rescore is set, the float32 vectors are moved to a memory-mapped file (a temporary file unless
+    rescore_path is given) and used only to re-rank candidates.
+    """
+    vectors = vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)
+    index = build_quantized_index(vectors, storage)
+    owner = None
+    if rescore:
+        if rescore_path is None:
+            fd, rescore_path = tempfile.mkstemp(suffix=".f32")
+            os.close(fd)
+            # Remove the temporary float32 file once the store (and any copies) are garbage collected
+            owner = TemporaryRescoreFile(rescore_path)
+        vectors.tofile(rescore_path)
+    quantized = QuantizedFAISS(vectorstore.embedding_function, index, vectorstore.docstore,
+                               dict(vectorstore.index_to_docstore_id),
+                               rescore_path=rescore_path if rescore else None, oversample=oversample, rescore_owner=owner)
+    # Keep the snapshot the store was loaded from, so its changes can still be merged into newer versions
+    for name in SNAPSHOT_ATTRIBUTES:
+        if hasattr(vectorstore, name):
+            setattr(quantized, name, getattr(vectorstore, name))
+    return quantized
+
+
+
+def storage_report(vectors, query_vectors, k=10, oversample=DEFAULT_RESCORE_OVERSAMPLE):
+    """
+    Compare float16 and int8 storage (with and without exact re-scoring) against the float32 baseline.
+    Reports index memory, recall@k of the baseline's exact top-k, and per-query search latency.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(query_vectors, dtype=np.float32)
+    baseline = faiss.IndexFlatL2(vectors.shape[1])
+    baseline.add(vectors)
+
+    def run(search):
+        latencies, results = [], []
+        for query in queries:
+            started = time.perf_counter()
+            results.append(search(query[None, :]))
+            latencies.append((time.perf_counter() - started) * 1000)
+        return results, latencies
+
+    truth, base_ms = run(lambda q: baseline.search(q, k)[1][0])
+    report = {"float32": {
+        "index_bytes": int(faiss.serialize_index(baseline).nbytes),
+        f"recall@{k}": 1.0,
+        "p50_ms": float(np.percentile(base_ms, 50)),
+    }}
+    for storage in STORAGE_TYPES:
+        index = build_quantized_index(vectors, storage)
+        index_bytes = int(faiss.serialize_index(index).nbytes)
+
+        def rescored(q, index=index):
+            candidates = index.search(q, k * oversample)[1][0]
+            candidates = candidates[candidates >= 0]
+            exact = ((vectors[candidates] - q) ** 2).sum(axis=1)
+            return candidates[np.argsort(exact)[:k]]
+
+        for label, search in ((storage, lambda q, index=index: index.search(q, k)[1][0]),
+                              (f"{storage}+rescore", rescored)):
+            found, latencies = run(search)
+            recall = np.mean([len(set(f.tolist()) & set(t.tolist())) / k for f, t in zip(found, truth)])
+            report[label] = {
+                "index_bytes": index_bytes,
+                f"recall@{k}": float(recall),
+                "p50_ms": float(np.percentile(latencies, 50)),
+            }
+    for entry in report.values():
+        entry["memory_ratio"] = entry["index_bytes"] / report["float32"]["index_bytes"]
+    return report
@@ -0,0 +1,110 @@
+"""
+Schema validation and incremental parsing for structured (JSON) quiz generation.
+The model is asked for {"questions": [{"question": ..., "options": {"A": ..., "B": ..., "C": ..., "D": ...},
+"answer": "A"}, ...]}. QuestionStreamParser pulls each question object out of the response as soon as its
+closing brace arrives, so questions can be validated (and generation stopped) while the response is streaming.
+"""
+import json
+import re
+
+
+
+OPTION_LETTERS = ("A", "B", "C", "D")
+
+
+
+def normalize_text(text):
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+
+def validate_question(item, seen=()):
+    """
+    Check one generated question against the quiz schema.
+    Returns (question, None) with the question normalized, or (None, reason) if it is invalid.
+    seen holds normalized texts of questions already accepted (or asked before), which count as invalid repeats.
+    """
+    if not isinstance(item, dict):
+        return None, "not an object"
+    question = item.get("question")
+    if not isinstance(question, str) or not question.strip():
+        return None, "missing question text"
+    options = item.get("options")
+    if isinstance(options, list) and len(options) == len(OPTION_LETTERS):
+        options = dict(zip(OPTION_LETTERS, options))
+    if not isinstance(options, dict) or sorted(options) != list(OPTION_LETTERS):
+        return None, "options must be exactly A, B, C, and D"
+    if not all(isinstance(text, str) and text.strip() for text in options.values()):
+        return None, "empty option"
+    if len({normalize_text(text) for text in options.values()}) < len(OPTION_LETTERS):
+        return None, "duplicate options"
+    answer = item.get("answer")
+    match = re.match(r"^\s*\(?([A-Da-d])\b", answer) if isinstance(answer, str) else None
+    if match is None:
+        return None, "answer must be one of A, B, C, or D"
+    if normalize_text(question) in seen:
+        return None, "repeated question"
+    return {
+        "question": question.strip(),
+        "options": {letter: options[letter].strip() for letter in OPTION_LETTERS},
+        "answer": match.group(1).upper(),
+    }, None
+
+
+
+def format_question(number, question):
+    """
+    Render a validated question in the text format the quiz UI and grading prompt expect.
+    """
+    lines = [f"Question {number}: {question['question']}"]
+    lines.extend(f"{letter}) {question['options'][letter]}" for letter in OPTION_LETTERS)
+    return "\n".join(lines)
+
+
+
+class QuestionStreamParser:
+    """
+    Incremental JSON scanner that yields each element of the "questions" array (or of a bare top-level array)
+    once it is complete. Elements that are not valid JSON are yielded as None.
+    """
+    def __init__(self):
+        self._buffer = []
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._collecting = False  # Whether a question object is being read into the buffer
+
+    def _at_question_level(self):
+        return self._stack in (["{", "["], ["["])
+
+    def feed(self, text):
+        """
+        Consume a chunk of the response and return the question objects it completed.
+        """
+        completed = []
+        for char in text:
+            if self._collecting:
+                self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if char == "{" and self._at_question_level():
+                    self._buffer, self._collecting = ["{"], True
+                self._stack.append(char)
+            elif char in "}]" and self._stack:
+                self._stack.pop()
+                if char == "}" and self._collecting and self._at_question_level():
+                    raw, self._buffer, self._collecting = "".join(self._buffer), [], False
+                    try:
+                        completed.append(json.loads(raw))
+                    except ValueError:
+                        completed.append(None)
+        return completed
@@ -0,0 +1,193 @@
+"""
+Workload-aware routing across several local LLMs.
+Each workflow (qa, summarize, quiz, grade) and prompt size maps to a model tier (small, medium, large). When the
+chosen tier's queue is deep or its recent latency would miss the workflow's latency SLO, the request falls back
+to the next smaller tier. Per-model latency is recorded in the metrics registry and drives the SLO estimate.
+Backends are any LangChain LLMs, so the router can be exercised with local stub models.
+"""
+import json
+import logging
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from instrumentation import metrics
+from defaults import DEFAULT_MODEL_TIERS, DEFAULT_WORKFLOW_TIERS, DEFAULT_WORKFLOW_SLO_SECONDS, DEFAULT_ROUTER_MAX_QUEUE_DEPTH, \
+    DEFAULT_LLM_MODEL, DEFAULT_LLM_TEMPERATURE
+
+
+
+logger = logging.getLogger(__name__)
+
+TIER_ORDER = ("small", "medium", "large")
+OLLAMA_TAGS_URL = "http://localhost:11434/api/tags"
+
+
+
+class ModelRouter:
+    """
+    Chooses a backend LLM per request and tracks each tier's queue depth and latency.
+    backends maps tier name to LLM; workflow_tiers maps workflow name to a list of (max_prompt_tokens, tier)
+    rules, checked in order, where a max of None matches any size.
+    """
+    def __init__(self, backends, workflow_tiers=DEFAULT_WORKFLOW_TIERS, slo_seconds=DEFAULT_WORKFLOW_SLO_SECONDS,
+                 max_queue_depth=DEFAULT_ROUTER_MAX_QUEUE_DEPTH, default_tier="large", ewma_alpha=0.3):
+        if not backends:
+            raise ValueError("ModelRouter needs at least one backend")
+        unknown = [tier for tier in backends if tier not in TIER_ORDER]
+        if unknown:
+            raise ValueError(f"Unknown model tier(s): {', '.join(unknown)} (expected {', '.join(TIER_ORDER)})")
+        self.backends = dict(backends)
+        self.workflow_tiers = workflow_tiers
+        self.slo_seconds = slo_seconds
+        self.max_queue_depth = max_queue_depth
+        self.default_tier = default_tier
+        self.ewma_alpha = ewma_alpha
+        self._lock = threading.Lock()
+        self._in_flight = {tier: 0 for tier in self.backends}
+        self._latency = {tier: None for tier in self.backends}  # EWMA seconds per call
+        self._calls = {tier: 0 for tier in self.backends}
+        self._fallbacks = 0
+
+    def model_name(self, tier):
+        llm = self.backends[tier]
+        return getattr(llm, "model", type(llm).__name__)
+
+    def base_tier(self, workflow, prompt_tokens):
+        """
+        The configured tier for a workflow and prompt size, before load-based fallback.
+        """
+        for max_tokens, tier in self.workflow_tiers.get(workflow, ()):
+            if max_tokens is None or prompt_tokens <= max_tokens:
+                return tier
+        return self.default_tier
+
+    def _candidates(self, tier):
+        """
+        Tiers a request for `tier` may run on, largest first: the requested tier or, if it is not configured, the
+        next larger configured tier (the largest one if there is none), followed by the smaller configured tiers.
+        """
+        configured = [t for t in TIER_ORDER if t in self.backends]
+        larger = [t for t in configured if TIER_ORDER.index(t) >= TIER_ORDER.index(tier)]
+        start = TIER_ORDER.index(larger[0] if larger else configured[-1])
+        return [t for t in configured if TIER_ORDER.index(t) <= start][::-1]
+
+    def estimated_seconds(self, tier):
+        """
+        Expected time to finish a new request on this tier: recent latency times the requests ahead of it.
+        """
+        latency = self._latency[tier]
+        return 0.0 if latency is None else latency * (self._in_flight[tier] + 1)
+
+    def route(self, workflow, prompt_tokens=0):
+        """
+        Pick the tier for a request, falling back to smaller tiers while the queue is too deep or the SLO is at risk.
+        The request is counted as in flight on the chosen tier right away (under the same lock), so concurrent
+        requests see each other's load; run it with track() or track_stream(), or give the slot back with release().
+        """
+        requested = self.base_tier(workflow, prompt_tokens)
+        slo = self.slo_seconds.get(workflow)
+        with self._lock:
+            candidates = self._candidates(requested)
+            chosen = candidates[-1]
+            for tier in candidates:
+                # An idle tier is always eligible, so one slow call cannot demote it for good
+                idle = self._in_flight[tier] == 0
+                if idle or (self._in_flight[tier] < self.max_queue_depth and (slo is None or self.estimated_seconds(tier) <= slo)):
+                    chosen = tier
+                    break
+            if chosen != candidates[0]:
+                self._fallbacks += 1
+                logger.info(f"Routing {workflow} from {candidates[0]} to {chosen} (queue depth or latency SLO)")
+            self._in_flight[chosen] += 1
+        return chosen
+
+    def release(self, tier):
+        """
+        Give back the slot route() reserved for a request that will not be sent.
+        """
+        with self._lock:
+            self._in_flight[tier] -= 1
+
+    @contextmanager
+    def track(self, tier):
+        """
+        Run a request in the slot route() reserved on a tier; frees the slot and records the latency when it finishes.
+        """
+        started = time.perf_counter()
+        try:
+            yield self.backends[tier]
+        finally:
+            seconds = time.perf_counter() - started
+            metrics.observe(f"llm_model:{self.model_name(tier)}", seconds)
+            with self._lock:
+                self._in_flight[tier] -= 1
+                self._calls[tier] += 1
+                previous = self._latency[tier]
+                self._latency[tier] = seconds if previous is None else \
+                    self.ewma_alpha * seconds + (1 - self.ewma_alpha) * previous
+
+    def track_stream(self, tier, chunks):
+        """
+        Wrap a response stream so the request stays in flight until the stream is exhausted, closed, or discarded.
+        """
+        def stream():
+            with self.track(tier):
+                yield
+                yield from chunks
+
+        tracked = stream()
+        # Start the generator, so its slot is freed even if the stream is discarded before it is read
+        next(tracked)
+        return tracked
+
+    def stats(self):
+        """
+        Per-tier model, queue depth, call count, and recent latency, plus the number of fallbacks.
+        """
+        with self._lock:
+            return {
+                "tiers": {
+                    tier: {
+                        "model": self.model_name(tier),
+                        "in_flight": self._in_flight[tier],
+                        "calls": self._calls[tier],
+                        "ewma_seconds": self._latency[tier],
+                    }
+                    for tier in self.backends
+                },
+                "fallbacks": self._fallbacks,
+            }
+
+
+
+def available_models(url=OLLAMA_TAGS_URL, timeout=2.0):
+    """
+    Names of the models pulled into the local Ollama server, or None if it cannot be reached.
+    """
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return {model["name"] for model in json.load(response).get("models", [])}
+    except Exception:
+        return None
+
+
+
+def build_router(model_tiers=DEFAULT_MODEL_TIERS, temperature=DEFAULT_LLM_TEMPERATURE, llm_factory=None):
+    """
+    Create a router with one Ollama backend per configured tier.
+    Tiers whose model has not been pulled are skipped (requests for them go to the next larger tier);
+    if none of the tier models are available, the default model serves every tier.
+    """
+    if llm_factory is None:
+        from models import load_llm
+        llm_factory = load_llm
+    pulled = available_models()
+    tiers = {
+        tier: model for tier, model in model_tiers.items()
+        if pulled is None or model in pulled or f"{model}:latest" in pulled
+    }
+    if not tiers:
+        logger.warning(f"None of the tier models ({', '.join(model_tiers.values())}) are pulled; using {DEFAULT_LLM_MODEL} for all workflows")
+        tiers = {"large": DEFAULT_LLM_MODEL}
+    return ModelRouter({tier: llm_factory(model, temperature) for tier, model in tiers.items()})
@@ -0,0 +1,291 @@
+"""
+Sharded document index with scatter-gather search across local worker processes.
+The index is partitioned into one shard per course (or per source file), each published as its own snapshot
+under <index path>/shards/. A ShardedIndex coordinator starts worker processes that each load a share of the
+shards (one shard per worker, up to one worker per CPU core), embeds each query once, sends the vector to every
+worker in parallel, and merges the per-worker top-k by L2 distance. Workers never load the embedding model and
+no process holds the whole index, so searches use every core and the corpus is not limited to one process's memory.
+"""
+import hashlib
+import heapq
+import json
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import weakref
+import numpy as np
+import faiss
+from langchain_community.vectorstores import FAISS
+from index_store import publish_snapshot, open_snapshot, current_version, clear_snapshots
+from quantization import quantize_vectorstore
+from defaults import DEFAULT_SHARD_KEY, DEFAULT_SHARD_WORKERS, DEFAULT_VECTOR_STORAGE
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+
+SHARDS_DIR = "shards"
+SHARD_INFO_FILE = "shard.json"
+
+
+
+def shard_value(metadata, key=DEFAULT_SHARD_KEY):
+    """
+    The shard a chunk belongs to: its course (falling back to its source file when it has none) or its source.
+    """
+    if key == "course" and metadata.get("course"):
+        return metadata["course"]
+    return metadata.get("source", "unknown")
+
+
+
+def shard_dir_name(value):
+    """
+    Filesystem-safe, collision-free directory name for a shard.
+    """
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", value).strip("._")[:40] or "shard"
+    return f"{slug}-{hashlib.sha1(value.encode('utf-8')).hexdigest()[:8]}"
+
+
+
+def list_shards(faiss_path):
+    """
+    Directories of the published shards of the index at faiss_path.
+    """
+    shards_root = os.path.join(faiss_path, SHARDS_DIR)
+    if not os.path.isdir(shards_root):
+        return []
+    return sorted(os.path.join(shards_root, name) for name in os.listdir(shards_root)
+                  if current_version(os.path.join(shards_root, name)) is not None)
+
+
+
+def stored_vectors(vectorstore):
+    """
+    Float32 vectors of every row of the index (exact for quantized stores that keep re-scoring vectors).
+    """
+    full_vectors = getattr(vectorstore, "full_vectors", None)
+    if full_vectors is not None:
+        return np.asarray(full_vectors)
+    return vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)
+
+
+
+def build_shards(vectorstore, faiss_path, key=DEFAULT_SHARD_KEY, storage=DEFAULT_VECTOR_STORAGE):
+    """
+    Partition an index into one shard per course or source and publish each as a snapshot under faiss_path/shards/.
+    Shards whose course or source is no longer in the index are cleared. Returns {shard value: chunk count}.
+    """
+    vectors = stored_vectors(vectorstore)
+    groups = {}
+    for row, doc_id in sorted(vectorstore.index_to_docstore_id.items()):
+        doc = vectorstore.docstore.search(doc_id)
+        groups.setdefault(shard_value(doc.metadata, key), []).append((row, doc_id, doc))
+    published = set()
+    for value, rows in groups.items():
+        shard = FAISS.from_embeddings(
+            [(doc.page_content, vectors[row].tolist()) for row, _, doc in rows], vectorstore.embedding_function,
+            metadatas=[doc.metadata for _, _, doc in rows], ids=[doc_id for _, doc_id, _ in rows],
+        )
+        if storage != "float32":
+            shard = quantize_vectorstore(shard, storage)
+        path = os.path.join(faiss_path, SHARDS_DIR, shard_dir_name(value))
+        publish_snapshot(shard, path, extra_files={SHARD_INFO_FILE: json.dumps({"key": key, "value": value})})
+        published.add(path)
+    for path in list_shards(faiss_path):
+        if path not in published:
+            clear_snapshots(path)
+    return {value: len(rows) for value, rows in groups.items()}
+
+
+
+def peak_rss_bytes():
+    """
+    Peak resident memory of the current process, or None where the resource module is unavailable.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+
+def _document_sources(doc):
+    sources = [doc.metadata.get("source")] + [d.get("source") for d in doc.metadata.get("duplicate_sources", [])]
+    return {source for source in sources if source}
+
+
+
+def _search_stores(stores, vector, k):
+    hits = []
+    for store in stores.values():
+        hits.extend(store.similarity_search_with_score_by_vector(vector, k=k))
+    return heapq.nsmallest(k, hits, key=lambda hit: hit[1])
+
+
+
+def _serve_shards(conn, shard_paths):
+    """
+    Worker process: load the given shards and answer the coordinator's requests until it closes the pipe.
+    """
+    stores = {}
+
+    def load():
+        stores.clear()
+        for path in shard_paths:
+            # Queries arrive as vectors, so shards are opened without an embedding model
+            store = open_snapshot(path, None)
+            if store is not None:
+                stores[path] = store
+
+    load()
+    while True:
+        try:
+            command, payload = conn.recv()
+        except (EOFError, OSError):
+            break
+        try:
+            if command == "search":
+                vectors, ks = payload
+                result = [_search_stores(stores, vector, k) for vector, k in zip(vectors, ks)]
+            elif command == "documents":
+                result = [doc for store in stores.values() for doc in store.docstore._dict.values()
+                          if payload is None or payload in _document_sources(doc)]
+            elif command == "sources":
+                result = {source for store in stores.values() for doc in store.docstore._dict.values()
+                          for source in _document_sources(doc)}
+            elif command == "reload":
+                load()
+                result = None
+            elif command == "stats":
+                result = {
+                    "shards": {path: {"version": store.snapshot_version, "chunks": store.index.ntotal}
+                               for path, store in stores.items()},
+                    "index_bytes": sum(int(faiss.serialize_index(store.index).size) for store in stores.values()),
+                    "max_rss_bytes": peak_rss_bytes(),
+                }
+            elif command == "ping":
+                result = None
+            elif command == "close":
+                conn.send(("ok", None))
+                break
+            else:
+                raise ValueError(f"Unknown command: {command}")
+            conn.send(("ok", result))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+    conn.close()
+
+
+
+def _stop_workers(workers):
+    for process, conn in workers:
+        try:
+            conn.send(("close", None))
+        except (BrokenPipeError, OSError):
+            pass
+    for process, conn in workers:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+        conn.close()
+
+
+
+class ShardedIndex:
+    """
+    Coordinator for a sharded index, usable wherever the workflows take a vectorstore.
+    Each query is embedded once here, then scattered to all workers; each worker searches its shards and
+    returns its own top-k, and the coordinator keeps the overall top-k by distance.
+    Workers are stopped by close() or when the coordinator is garbage collected.
+    """
+    def __init__(self, shard_paths, embeddings, workers=DEFAULT_SHARD_WORKERS):
+        if not shard_paths:
+            raise ValueError("ShardedIndex needs at least one shard")
+        self.embedding_function = embeddings
+        self.shard_paths = list(shard_paths)
+        count = max(1, min(workers or os.cpu_count() or 1, len(self.shard_paths)))
+        # Spawned (not forked) workers, so they do not inherit the parent's model threads and locks
+        context = multiprocessing.get_context("spawn")
+        self._workers = []
+        for i in range(count):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_serve_shards, args=(child_conn, self.shard_paths[i::count]),
+                                      name=f"shard-worker-{i}", daemon=True)
+            process.start()
+            child_conn.close()
+            self._workers.append((process, parent_conn))
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, _stop_workers, self._workers)
+        self._call("ping")  # Wait until every worker has loaded its shards
+
+    @classmethod
+    def open(cls, faiss_path, embeddings, workers=DEFAULT_SHARD_WORKERS):
+        """
+        Start a coordinator over the published shards of the index at faiss_path, or return None if it has none.
+        """
+        shard_paths = list_shards(faiss_path)
+        return cls(shard_paths, embeddings, workers) if shard_paths else None
+
+    def _call(self, command, payload=None):
+        """
+        Send one request to every worker, then collect every reply (workers run in parallel meanwhile).
+        """
+        with self._lock:
+            for _, conn in self._workers:
+                conn.send((command, payload))
+            replies = [conn.recv() for _, conn in self._workers]
+        errors = [result for status, result in replies if status == "error"]
+        if errors:
+            raise RuntimeError(f"Shard worker failed: {errors[0]}")
+        return [result for _, result in replies]
+
+    def search_with_scores(self, vectors, ks):
+        """
+        Top-k (document, distance) lists for several query vectors, in one scatter-gather round.
+        """
+        vectors = [np.asarray(vector, dtype=np.float32).tolist() for vector in vectors]
+        replies = self._call("search", (vectors, list(ks)))
+        return [heapq.nsmallest(k, (hit for reply in replies for hit in reply[i]), key=lambda hit: hit[1])
+                for i, k in enumerate(ks)]
+
+    def similarity_search_batch(self, vectors, ks):
+        return [[doc for doc, _ in hits] for hits in self.search_with_scores(vectors, ks)]
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        return self.search_with_scores([embedding], [k])[0]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k)
+
+    def documents(self, source=None):
+        """
+        All indexed chunks, or only those of one source.
+        """
+        return [doc for reply in self._call("documents", source) for doc in reply]
+
+    def sources(self):
+        return set().union(*self._call("sources"))
+
+    def reload(self):
+        """
+        Switch every worker to the latest published version of its shards (shards added since start are not picked up).
+        """
+        self._call("reload")
+
+    def stats(self):
+        """
+        Per-worker shards, chunk counts, in-memory index size, and peak memory.
+        """
+        return [dict(reply, pid=process.pid) for (process, _), reply in zip(self._workers, self._call("stats"))]
+
+    def close(self):
+        self._finalizer()
@@ -0,0 +1,132 @@
+"""
+Import-time profile of the Streamlit app's cold start.
+Runs `python -X importtime` in fresh interpreters to measure what app.py imports before the UI shell
+renders, then the incremental cost of each dependency that is deferred until a feature first needs it.
+
+Usage:
+    python startup_profile.py
+    python startup_profile.py --top 25 --output startup_profile.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+
+# Modules app.py imports at the top of the script (what a cold start pays before the first render)
+STARTUP_MODULES = ["streamlit", "defaults", "models", "session_state", "ui_components"]
+# Modules deferred until a feature first needs them
+DEFERRED_MODULES = {
+    "workflows": "first question, summary, or quiz",
+    "document_loader": "first upload",
+    "langchain_ollama": "first LLM call",
+    "langchain_huggingface": "embeddings model (background thread)",
+}
+
+
+
+def parse_importtime(stderr):
+    """
+    Parse `-X importtime` output into (module, self_us, cumulative_us, depth) rows.
+    Depth 0 rows are the modules imported directly by the profiled statement.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+
+def profile_imports(modules, preload=()):
+    """
+    Import modules in a fresh interpreter with -X importtime, after silently importing preload.
+    Returns the parsed rows (for modules only, not the preload) and the wall-clock seconds of the import.
+    """
+    code = "".join(f"import {m}\n" for m in preload)
+    code += "import sys, time\nsys.stderr.write('--- profile ---\\n')\nstarted = time.perf_counter()\n"
+    code += "".join(f"import {m}\n" for m in modules)
+    code += "print(time.perf_counter() - started)\n"
+    env = dict(os.environ, PYTHONWARNINGS="ignore")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed")
+    stderr = result.stderr.split("--- profile ---\n", 1)[-1]
+    return parse_importtime(stderr), float(result.stdout.strip().splitlines()[-1])
+
+
+
+def summarize(rows, top):
+    """
+    Top-level modules by cumulative time and the slowest individual modules by self time (milliseconds).
+    """
+    top_level = sorted((r for r in rows if r[3] == 0), key=lambda r: r[2], reverse=True)
+    by_self = sorted(rows, key=lambda r: r[1], reverse=True)[:top]
+    return {
+        "modules_imported": len(rows),
+        "top_level_ms": {name: cumulative / 1000 for name, _, cumulative, _ in top_level},
+        "slowest_self_ms": {name: self_us / 1000 for name, self_us, _, _ in by_self},
+    }
+
+
+
+def run_profile(top=15):
+    """
+    Profile the startup imports, then each deferred module on top of them.
+    """
+    started = time.perf_counter()
+    rows, seconds = profile_imports(STARTUP_MODULES)
+    report = {"startup": dict(summarize(rows, top), wall_ms=seconds * 1000), "deferred": {}}
+    for module, trigger in DEFERRED_MODULES.items():
+        try:
+            rows, seconds = profile_imports([module], preload=STARTUP_MODULES)
+        except RuntimeError as e:
+            report["deferred"][module] = {"trigger": trigger, "error": str(e)}
+            continue
+        report["deferred"][module] = dict(summarize(rows, top), trigger=trigger, wall_ms=seconds * 1000)
+    report["profile_seconds"] = time.perf_counter() - started
+    return report
+
+
+
+def format_report(report):
+    startup = report["startup"]
+    lines = [f"Startup imports: {startup['wall_ms']:.0f} ms ({startup['modules_imported']} modules)"]
+    for name, ms in startup["top_level_ms"].items():
+        lines.append(f"  {name:<40} {ms:>9.1f} ms")
+    lines.append("  slowest modules (self time):")
+    for name, ms in startup["slowest_self_ms"].items():
+        lines.append(f"    {name:<38} {ms:>9.1f} ms")
+    lines.append("Deferred imports (incremental cost, paid on first use):")
+    for module, entry in report["deferred"].items():
+        if "error" in entry:
+            lines.append(f"  {module:<40} unavailable: {entry['error']}")
+        else:
+            lines.append(f"  {module:<40} {entry['wall_ms']:>9.1f} ms  ({entry['trigger']})")
+    return "\n".join(lines)
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile the import time of the app's cold start.")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest modules to list")
+    parser.add_argument("--output", help="Optional path to write the JSON report")
+    args = parser.parse_args(argv)
+    report = run_profile(args.top)
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""
+Deterministic local stand-in for the Ollama LLM, used by benchmarks and tests.
+"""
+import json
+import re
+import time
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+
+
+class StubLLM(LLM):
+    """
+    Deterministic local stand-in for the Ollama LLM, used by benchmarks and tests.
+    Produces well-formed answers (and quizzes in the expected text or JSON format) derived only from the prompt,
+    optionally sleeping to simulate prefill and generation speed.
+    """
+    model: str = "stub"
+    prefill_tokens_per_second: float = 0.0  # 0 disables the simulated prefill delay
+    tokens_per_second: float = 0.0  # 0 disables the simulated generation delay
+
+    @property
+    def _llm_type(self):
+        return "stub"
+
+    def _response_for(self, prompt):
+        quiz_match = re.search(r"Generate (\d+) multiple choice questions", prompt)
+        if quiz_match and "as JSON" in prompt:
+            return json.dumps({"questions": [
+                {
+                    "question": f"Which statement about concept {i} is correct?",
+                    "options": {letter: f"Option {letter}{i}" for letter in "ABCD"},
+                    "answer": "ABCD"[i % 4],
+                }
+                for i in range(1, int(quiz_match.group(1)) + 1)
+            ]})
+        if quiz_match:
+            parts = []
+            for i in range(1, int(quiz_match.group(1)) + 1):
+                parts.append(
+                    f"Question {i}: Which statement about concept {i} is correct?\n"
+                    f"A) Option A{i}\nB) Option B{i}\nC) Option C{i}\nD) Option D{i}\n"
+                    f"ANSWER: {'ABCD'[i % 4]}"
+                )
+            return "\n".join(parts)
+        num_sources = max(prompt.count("[From "), 1)
+        items = "".join(
+            f"<li><strong>Point {i}:</strong> Stub explanation grounded in the context<sup>[{i}]</sup></li>"
+            for i in range(1, num_sources + 1)
+        )
+        references = "".join(f"{i}. Stub source {i}<br>" for i in range(1, num_sources + 1))
+        return f"<h2>Answer</h2><ul>{items}</ul><h2>References</h2>{references}"
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        if self.prefill_tokens_per_second:
+            time.sleep(len(prompt.split()) / self.prefill_tokens_per_second)
+        for token in re.findall(r"\S+\s*", self._response_for(prompt)):
+            if self.tokens_per_second:
+                time.sleep(1.0 / self.tokens_per_second)
+            if run_manager:
+                run_manager.on_llm_new_token(token)
+            yield GenerationChunk(text=token)
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
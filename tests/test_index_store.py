@@ -0,0 +1,86 @@
+import gc
+import os
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("langchain_community")
+
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+from index_store import VERSIONS_DIR, clear_snapshots, commit_snapshot, current_version, is_leased, list_versions, \
+    open_snapshot, publish_snapshot
+
+
+@pytest.fixture
+def embeddings():
+    return DeterministicFakeEmbedding(size=8)
+
+
+def build(embeddings, texts):
+    return FAISS.from_texts(texts, embeddings, metadatas=[{"source": f"{text}.pdf"} for text in texts])
+
+
+def texts(store):
+    return sorted(doc.page_content for doc in store.docstore._dict.values())
+
+
+def test_publish_numbers_versions_and_moves_current(tmp_path, embeddings):
+    root = str(tmp_path)
+    assert current_version(root) is None and open_snapshot(root, embeddings) is None
+    assert publish_snapshot(build(embeddings, ["a"]), root, extra_files={"manifest.json": "{}"}) == "v000001"
+    assert publish_snapshot(build(embeddings, ["a", "b"]), root) == "v000002"
+    assert current_version(root) == "v000002"
+    assert os.path.exists(os.path.join(root, VERSIONS_DIR, "v000001", "manifest.json"))
+    store = open_snapshot(root, embeddings)
+    assert store.snapshot_version == "v000002" and texts(store) == ["a", "b"]
+
+
+def test_garbage_collection_keeps_newest_and_leased_versions(tmp_path, embeddings):
+    root = str(tmp_path)
+    publish_snapshot(build(embeddings, ["a"]), root, keep=1)
+    reader = open_snapshot(root, embeddings)
+    assert is_leased(os.path.join(root, VERSIONS_DIR, "v000001"))
+    for _ in range(3):
+        publish_snapshot(build(embeddings, ["b"]), root, keep=1)
+    # The reader keeps serving (and holding) the version it opened
+    assert list_versions(root) == ["v000001", "v000004"]
+    assert texts(reader) == ["a"]
+    del reader
+    gc.collect()
+    publish_snapshot(build(embeddings, ["c"]), root, keep=1)
+    assert list_versions(root) == ["v000005"]
+
+
+def test_clear_snapshots_waits_for_readers(tmp_path, embeddings):
+    root = str(tmp_path)
+    publish_snapshot(build(embeddings, ["a"]), root)
+    reader = open_snapshot(root, embeddings)
+    assert clear_snapshots(root) is False
+    assert current_version(root) is None and list_versions(root) == ["v000001"]
+    del reader
+    gc.collect()
+    assert clear_snapshots(root) is True and list_versions(root) == []
+
+
+def test_concurrent_writers_are_merged(tmp_path, embeddings):
+    root = str(tmp_path)
+    publish_snapshot(build(embeddings, ["a", "b"]), root, extra_files={"notes.txt": "base"})
+    first, second = open_snapshot(root, embeddings), open_snapshot(root, embeddings)
+    first.add_texts(["c"], metadatas=[{"source": "c.pdf"}])
+    first = commit_snapshot(first, root)
+    removed = [doc_id for doc_id, doc in second.docstore._dict.items() if doc.page_content == "a"]
+    second.delete(removed)
+    second.add_texts(["d"], metadatas=[{"source": "d.pdf"}])
+    second = commit_snapshot(second, root, merge_files={"notes.txt": lambda base, current, mine: current + mine},
+                             extra_files={"notes.txt": "+mine"})
+    assert second.snapshot_version == current_version(root) == "v000003"
+    assert texts(second) == texts(open_snapshot(root, embeddings)) == ["b", "c", "d"]
+    with open(os.path.join(root, VERSIONS_DIR, "v000003", "notes.txt"), encoding="utf-8") as f:
+        assert f.read() == "base+mine"
+
+
+def test_replace_overwrites_the_published_version(tmp_path, embeddings):
+    root = str(tmp_path)
+    publish_snapshot(build(embeddings, ["a"]), root)
+    store = commit_snapshot(build(embeddings, ["z"]), root, replace=True)
+    assert texts(store) == texts(open_snapshot(root, embeddings)) == ["z"]
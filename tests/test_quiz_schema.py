@@ -0,0 +1,66 @@
+import json
+from quiz_schema import QuestionStreamParser, validate_question, format_question, normalize_text
+
+
+def question(text="What is 2 + 2?", answer="B", **options):
+    return {"question": text, "options": options or {"A": "3", "B": "4", "C": "5", "D": "22"}, "answer": answer}
+
+
+def test_valid_question_is_normalized():
+    result, problem = validate_question(question(text="  What is 2 + 2? ", answer="b) 4"))
+    assert problem is None
+    assert result == {"question": "What is 2 + 2?", "options": {"A": "3", "B": "4", "C": "5", "D": "22"}, "answer": "B"}
+
+
+def test_options_may_be_a_list_of_four():
+    item = {"question": "Pick one", "options": ["w", "x", "y", "z"], "answer": "D"}
+    result, problem = validate_question(item)
+    assert problem is None and result["options"]["D"] == "z"
+
+
+def test_invalid_questions_report_a_reason():
+    cases = [
+        ("not an object", "oops"),
+        ("missing question text", question(text=" ")),
+        ("options must be exactly A, B, C, and D", question(A="1", B="2", C="3")),
+        ("empty option", question(A="1", B="2", C="3", D=" ")),
+        ("duplicate options", question(A="Four", B="four!", C="3", D="5")),
+        ("answer must be one of A, B, C, or D", question(answer="E")),
+    ]
+    for reason, item in cases:
+        assert validate_question(item) == (None, reason)
+
+
+def test_repeated_questions_are_rejected():
+    seen = {normalize_text("what is 2+2")}
+    assert validate_question(question(text="What is 2 + 2?"), seen) == (None, "repeated question")
+
+
+def test_format_question_matches_the_text_quiz_format():
+    result, _ = validate_question(question())
+    assert format_question(3, result) == "Question 3: What is 2 + 2?\nA) 3\nB) 4\nC) 5\nD) 22"
+
+
+def test_parser_yields_each_question_as_soon_as_it_is_complete():
+    text = json.dumps({"questions": [question(text="First {tricky} \"quoted\""), question(text="Second")]})
+    parser = QuestionStreamParser()
+    completed = []
+    for i in range(0, len(text), 7):
+        completed.extend(parser.feed(text[i:i + 7]))
+    assert [item["question"] for item in completed] == ["First {tricky} \"quoted\"", "Second"]
+
+
+def test_parser_yields_nothing_until_an_object_closes():
+    parser = QuestionStreamParser()
+    assert parser.feed('{"questions": [{"question": "Q", "options": {"A": "1"') == []
+    assert parser.feed(', "B": "2"}, "answer": "A"}') == [{"question": "Q", "options": {"A": "1", "B": "2"}, "answer": "A"}]
+
+
+def test_parser_accepts_a_bare_array():
+    parser = QuestionStreamParser()
+    assert parser.feed(json.dumps([question()])) == [question()]
+
+
+def test_parser_yields_none_for_malformed_elements():
+    parser = QuestionStreamParser()
+    assert parser.feed('{"questions": [{"question": "Q", "answer": A}, {"question": "R"}]}') == [None, {"question": "R"}]
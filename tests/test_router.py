@@ -0,0 +1,98 @@
+import gc
+from types import SimpleNamespace
+import pytest
+from router import ModelRouter
+
+
+TIERS = {"qa": [(100, "small"), (None, "large")], "grade": [(None, "small")], "summarize": [(None, "medium")]}
+
+
+def make_router(tiers=("small", "medium", "large"), **kwargs):
+    backends = {tier: SimpleNamespace(model=f"stub-{tier}") for tier in tiers}
+    kwargs.setdefault("workflow_tiers", TIERS)
+    kwargs.setdefault("slo_seconds", {})
+    return ModelRouter(backends, **kwargs)
+
+
+def in_flight(router):
+    return {tier: entry["in_flight"] for tier, entry in router.stats()["tiers"].items()}
+
+
+def test_routes_by_workflow_and_prompt_size():
+    router = make_router()
+    assert router.route("qa", prompt_tokens=50) == "small"
+    assert router.route("qa", prompt_tokens=500) == "large"
+    assert router.route("unknown") == "large"
+    assert router.stats()["fallbacks"] == 0
+
+
+def test_route_reserves_a_slot_so_concurrent_requests_fall_back():
+    router = make_router(max_queue_depth=1)
+    first = router.route("qa", prompt_tokens=500)
+    second = router.route("qa", prompt_tokens=500)
+    assert (first, second) == ("large", "medium")
+    assert in_flight(router) == {"small": 0, "medium": 1, "large": 1}
+    assert router.stats()["fallbacks"] == 1
+
+
+def test_slow_tier_misses_slo_and_falls_back():
+    router = make_router(slo_seconds={"qa": 5}, max_queue_depth=10)
+    router._latency["large"] = 4.0
+    assert router.route("qa", prompt_tokens=500) == "large"  # Idle tiers are always eligible
+    assert router.route("qa", prompt_tokens=500) == "medium"  # 4s x 2 requests would miss the 5s SLO
+
+
+def test_track_releases_the_slot_and_records_latency():
+    router = make_router()
+    tier = router.route("grade")
+    with router.track(tier) as backend:
+        assert backend is router.backends["small"]
+    stats = router.stats()["tiers"]["small"]
+    assert stats["in_flight"] == 0 and stats["calls"] == 1 and stats["ewma_seconds"] is not None
+
+
+def test_track_releases_the_slot_when_the_call_fails():
+    router = make_router()
+    tier = router.route("grade")
+    with pytest.raises(RuntimeError):
+        with router.track(tier):
+            raise RuntimeError("backend down")
+    assert in_flight(router)["small"] == 0
+
+
+def test_release_returns_an_unused_reservation():
+    router = make_router()
+    router.release(router.route("grade"))
+    assert in_flight(router)["small"] == 0
+
+
+def test_track_stream_holds_the_slot_until_the_stream_ends():
+    router = make_router()
+    stream = router.track_stream(router.route("grade"), iter(["a", "b"]))
+    assert in_flight(router)["small"] == 1
+    assert list(stream) == ["a", "b"]
+    assert in_flight(router)["small"] == 0
+
+
+def test_discarded_stream_releases_its_slot():
+    router = make_router()
+    stream = router.track_stream(router.route("grade"), iter(["a"]))
+    del stream
+    gc.collect()
+    assert in_flight(router)["small"] == 0
+
+
+def test_missing_tier_goes_to_the_next_larger_tier():
+    router = make_router(tiers=("small", "large"))
+    assert router.route("summarize") == "large"
+    assert router.stats()["fallbacks"] == 0
+
+
+def test_missing_larger_tiers_use_the_largest_configured_tier():
+    router = make_router(tiers=("small", "medium"))
+    assert router.route("qa", prompt_tokens=500) == "medium"
+
+
+def test_unknown_tier_names_are_rejected():
+    with pytest.raises(ValueError):
+        ModelRouter({"huge": SimpleNamespace(model="x")})
@@ -6,13 +6,15 @@ import streamlit as st
 import html
 import re
 import os
-from document_loader import load_document_and_index
+from instrumentation import span
 
 
 
-def render_file_upload_section(embeddings, faiss_path, text_store_path):
+def render_file_upload_section(embeddings_loader, faiss_path, text_store_path):
     """
     Render the file upload section with upload functionality.
+    Uploads are indexed by background jobs, so the app stays usable (and can answer from the files indexed
+    so far) while large uploads are processed. embeddings_loader must be safe to call from a worker thread.
     """
     st.header("📚 Upload Study Materials")
     # Area to upload files
@@ -21,14 +23,74 @@ def render_file_upload_section(embeddings, faiss_path, text_store_path):
         type=["pdf", "pptx", "ppt"],
         accept_multiple_files=True
     )
-    # Process uploaded files
+    # Queue newly uploaded files (the uploader returns every file again on each rerun)
     if uploaded_files:
-        with st.spinner("Processing documents..."):
-            for file in uploaded_files:
-                vectorstore = load_document_and_index(file, embeddings, faiss_path)
-                if vectorstore:
-                    st.session_state.vectorstore = vectorstore
-            st.success("Documents uploaded successfully!")
+        manager = get_ingestion_manager(embeddings_loader, faiss_path)
+        for file in uploaded_files:
+            manager.submit(file)
+    if 'ingestion_manager' in st.session_state:
+        render_ingestion_progress(st.session_state.ingestion_manager)
+
+
+
+def get_ingestion_manager(embeddings_loader, faiss_path):
+    """
+    Get this session's background ingestion manager, creating it on first upload.
+    Stored in session state so jobs and their progress survive reruns.
+    """
+    if 'ingestion_manager' not in st.session_state:
+        # Deferred: the PDF/PPTX parsers and FAISS are only needed once something is uploaded
+        from jobs import IngestionManager
+        st.session_state.ingestion_manager = IngestionManager(embeddings_loader, faiss_path, st.session_state.vectorstore)
+    return st.session_state.ingestion_manager
+
+
+
+def render_ingestion_progress(manager):
+    """
+    Show per-file ingestion progress with cancel buttons, and keep the session's index in sync with the jobs.
+    While jobs are running the section refreshes itself every second (on Streamlit versions with fragments).
+    """
+    def progress_section():
+        # Answer from whatever has been indexed so far
+        if manager.vectorstore is not None:
+            st.session_state.vectorstore = manager.vectorstore
+        active = manager.has_active_jobs()
+        for job in manager.jobs():
+            label = f"**{job.source}**"
+            if job.status == "running":
+                pages = f"{job.pages_parsed}/{job.total_pages}" if job.total_pages else f"{job.pages_parsed}"
+                st.progress(job.progress, text=f"{job.source}: {pages} pages parsed, {job.chunks_embedded} chunks embedded")
+            elif job.status == "queued":
+                st.write(f"{label}: queued")
+            elif job.status == "done":
+                duplicates = f", {job.duplicates} duplicates merged" if job.duplicates else ""
+                st.write(f"✅ {label}: {job.chunks_embedded} chunks indexed{duplicates}")
+            elif job.status == "cancelled":
+                st.write(f"⏹️ {label}: cancelled")
+            else:
+                st.write(f"❌ {label}: {job.error}")
+            if job.active:
+                st.button("Cancel", key=f"cancel_job_{job.id}", on_click=manager.cancel, args=(job.id,))
+        if active:
+            st.caption("You can already ask questions about the documents indexed so far.")
+        elif manager.jobs():
+            st.button("Clear finished", key="clear_finished_jobs", on_click=manager.clear_finished)
+        # Once the last job finishes, rerun the whole app so everything sees the final index
+        if st.session_state.get('ingestion_was_active') and not active:
+            st.session_state.ingestion_was_active = False
+            if auto_refresh:
+                st.rerun()
+        st.session_state.ingestion_was_active = active
+
+    fragment = getattr(st, "fragment", None)
+    auto_refresh = fragment is not None and manager.has_active_jobs()
+    if auto_refresh:
+        fragment(run_every=1.0)(progress_section)()
+    else:
+        progress_section()
+        if manager.has_active_jobs():
+            st.button("🔄 Refresh progress", key="refresh_ingestion")
 
 
 
@@ -73,13 +135,14 @@ def stream_response(response, message_placeholder):
     Stream a response with HTML support.
     """
     full_response = ""
-    # Split by HTML tags to preserve formatting during streaming
-    chunks = re.split(r'(<[^>]*>)', response)
-    for chunk in chunks:
-        if chunk:
-            full_response += chunk
-            message_placeholder.markdown(full_response + "▌", unsafe_allow_html=True)
-    message_placeholder.markdown(full_response, unsafe_allow_html=True)
+    with span("render"):
+        # Split by HTML tags to preserve formatting during streaming
+        chunks = re.split(r'(<[^>]*>)', response)
+        for chunk in chunks:
+            if chunk:
+                full_response += chunk
+                message_placeholder.markdown(full_response + "▌", unsafe_allow_html=True)
+        message_placeholder.markdown(full_response, unsafe_allow_html=True)
     return full_response
 
 
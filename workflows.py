@@ -3,22 +3,89 @@ Implements core chatbot workflows: Q&A (default), summarization, quiz generation
 Handles prompt construction, context retrieval, and workflow logic.
 """
 import re
-from prompts import qa_prompt, summarize_prompt, quiz_prompt, grade_prompt
-from rich.console import Console
-from rich.panel import Panel
-from rich.text import Text
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.callbacks import BaseCallbackHandler
+from prompts import qa_prompt, summarize_prompt, partial_summary_prompt, reduce_summary_prompt, quiz_prompt, structured_quiz_prompt, \
+    grade_prompt
+from quiz_schema import QuestionStreamParser, validate_question, normalize_text, format_question
+from instrumentation import span, metrics, prompt_logger, record_llm_timing, estimate_tokens
+from router import ModelRouter
+from generation import generation_options
+from batching import query_batcher
+from defaults import DEFAULT_SUMMARY_GROUP_SIZE, DEFAULT_SUMMARY_MAX_CONCURRENCY, DEFAULT_SUMMARY_RETRIEVE_K, \
+    DEFAULT_SUMMARY_CACHE_SIZE, DEFAULT_STRUCTURED_QUIZ, DEFAULT_QUIZ_MAX_RETRIES, \
+    DEFAULT_QUIZ_TOKENS_PER_QUESTION, DEFAULT_GENERATION_PROFILES
 
 
 
-# Initialize rich console
-console = Console()
+logger = logging.getLogger(__name__)
+
+
+
+class LLMTimingCallback(BaseCallbackHandler):
+    """
+    LangChain callback that records prefill/generation time and token counts for each LLM call.
+    With a generation profile, also logs the prompt tokens against the allocated context window (num_ctx).
+    """
+    def __init__(self, prompt_text="", workflow=None, options=None):
+        self.prompt_text = prompt_text
+        self.workflow = workflow
+        self.options = options or {}
+        self.started = None
+        self.first_token = None
+        self.completion = []
+
+    def log_context_use(self, generation_info=None):
+        num_ctx = self.options.get("num_ctx")
+        if not num_ctx:
+            return
+        info = generation_info or {}
+        # Ollama reports the actual count on the final response; estimate it for streams closed early
+        prompt_tokens = info.get("prompt_eval_count") or estimate_tokens(self.prompt_text)
+        metrics.add_tokens("context_allocated", num_ctx)
+        logger.info(f"{self.workflow}: {prompt_tokens} prompt tokens in num_ctx {num_ctx} ({prompt_tokens / num_ctx:.0%}), "
+                    f"num_predict {self.options.get('num_predict')}")
+        if prompt_tokens >= num_ctx:
+            logger.warning(f"{self.workflow}: prompt filled the {num_ctx}-token context window and was likely truncated")
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.started = time.perf_counter()
+        if prompts:
+            self.prompt_text = prompts[0]
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.completion.append(token)
+
+    def on_llm_error(self, error, **kwargs):
+        # Streams closed early (e.g. once enough quiz questions arrived) still count the tokens generated so far
+        if self.started is not None:
+            record_llm_timing(self.started, self.first_token, time.perf_counter(), None, self.prompt_text, "".join(self.completion))
+            self.log_context_use()
+
+    def on_llm_end(self, response, **kwargs):
+        ended = time.perf_counter()
+        generation = response.generations[0][0] if response.generations and response.generations[0] else None
+        record_llm_timing(self.started, self.first_token, ended,
+                          generation.generation_info if generation else None,
+                          self.prompt_text, generation.text if generation else "")
+        self.log_context_use(generation.generation_info if generation else None)
 
 
 
 def log_final_prompt(chain, **kwargs):
     """
     Log the actual final prompt that will be sent to the model chain (for debugging purposes).
+    Only a sampled fraction of prompts is printed (see SOLOMIND_PROMPT_LOG_SAMPLE_RATE).
     """
+    if not prompt_logger.should_log():
+        return
     try:
         if hasattr(chain, 'steps'):
             prompt_template = chain.steps[0]
@@ -30,13 +97,9 @@ def log_final_prompt(chain, **kwargs):
                 final_prompt = str(prompt_template)
         else:
             final_prompt = chain.prompt.format(**kwargs)
-        text = Text()
-        text.append("🤖 Final Prompt to Model\n", style="bold green")
-        text.append(final_prompt, style="yellow")
-        console.print(Panel(text, border_style="red"))
+        prompt_logger.log(final_prompt)
     except Exception as e:
-        console.print(f"[yellow]Unable to display full prompt: {str(e)}[/yellow]")
-        console.print(f"[yellow]Chain type: {type(chain)}[/yellow]")
+        logger.warning(f"Unable to display full prompt: {str(e)} (chain type: {type(chain)})")
 
 
 
@@ -48,21 +111,32 @@ def format_source_reference(doc):
         metadata = doc.metadata
         if not metadata:
             return "(Source information unavailable)"
-        source = metadata.get('source', 'Unknown Source')
-        # Check if the document is a PowerPoint slide
-        if metadata.get("type") == "slide":
-            slide_num = metadata.get('slide_number', '?')
-            slide_title = metadata.get('slide_title', 'Untitled')
-            return f"[From Slide {slide_num} in {source}: \"{slide_title}\"]" if slide_title != "Untitled" else f"[From Slide {slide_num} in {source}]"
-        # Else, the document is a PDF page
-        else:
-            page_num = metadata.get('page_number', '?')
-            return f"[From Page {page_num} in {source}]"
+        locations = [format_location(metadata)]
+        # Near-duplicate copies collapsed at ingestion time are cited too
+        locations.extend(format_location(location) for location in metadata.get('duplicate_sources', []))
+        return f"[From {'; also '.join(locations)}]"
     except AttributeError:
         return "(Source information unavailable)"
 
 
 
+def format_location(metadata):
+    """
+    Describe one chunk location, e.g. 'Slide 3 in deck.pptx: "Title"' or 'Page 5 in notes.pdf'.
+    """
+    source = metadata.get('source', 'Unknown Source')
+    # Check if the document is a PowerPoint slide
+    if metadata.get("type") == "slide":
+        slide_num = metadata.get('slide_number', '?')
+        slide_title = metadata.get('slide_title', 'Untitled')
+        return f"Slide {slide_num} in {source}: \"{slide_title}\"" if slide_title != "Untitled" else f"Slide {slide_num} in {source}"
+    # Else, the document is a PDF page
+    else:
+        page_num = metadata.get('page_number', '?')
+        return f"Page {page_num} in {source}"
+
+
+
 def get_context_from_docs(docs, topic=None):
     """
     Get formatted context from documents with source references.
@@ -76,12 +150,53 @@ def get_context_from_docs(docs, topic=None):
 
 
 
-def execute_chain(chain, llm, **kwargs):
+def supported_options(llm, options):
+    """
+    The generation options (e.g. Ollama's format or num_ctx) that this LLM has fields for.
+    """
+    fields = getattr(type(llm), "model_fields", {})
+    return {key: value for key, value in (options or {}).items() if key in fields}
+
+
+
+def with_options(llm, options):
     """
-    Execute a chain with prompt logging.
+    Copy of an LLM with generation options applied; options it does not have are ignored.
     """
-    log_final_prompt(chain, **kwargs)
-    return chain.invoke(kwargs)
+    supported = supported_options(llm, options)
+    return llm.model_copy(update=supported) if supported else llm
+
+
+
+def execute_chain(prompt, llm, workflow=None, stream=False, llm_options=None, **kwargs):
+    """
+    Build and execute the prompt | llm chain with prompt logging.
+    If llm is a ModelRouter, the backend model is chosen from the workflow and the prompt size.
+    The workflow's generation profile (context window sized to the prompt, output cap, stop sequences) and any
+    llm_options are set on the (chosen) model for this call only.
+    If stream is True, returns an iterator over response chunks instead of the full response.
+    """
+    prompt_tokens = estimate_tokens(prompt.format(**kwargs))
+    router = llm if isinstance(llm, ModelRouter) else None
+    if router is not None:
+        # Reserves a slot on the chosen tier, freed by track()/track_stream() below
+        tier = router.route(workflow, prompt_tokens)
+        llm = router.backends[tier]
+    try:
+        options = supported_options(llm, generation_options(workflow, prompt_tokens, llm_options))
+        chain = prompt | with_options(llm, options)
+        log_final_prompt(chain, **kwargs)
+        config = {"callbacks": [LLMTimingCallback(workflow=workflow, options=options)]}
+    except BaseException:
+        if router is not None:
+            router.release(tier)
+        raise
+    if router is None:
+        return chain.stream(kwargs, config=config) if stream else chain.invoke(kwargs, config=config)
+    if stream:
+        return router.track_stream(tier, chain.stream(kwargs, config=config))
+    with router.track(tier):
+        return chain.invoke(kwargs, config=config)
 
 
 
@@ -99,61 +214,326 @@ def get_workflow(question):
 
 
 
-def qa_workflow(question, vectorstore, llm):
+def qa_workflow(question, vectorstore, llm, stream=False):
     """
     Generate a response to the question using the qa prompt.
     """
     # Get relevant documents using key terms
     key_terms = re.findall(r'\b\w+\b', question.lower())
-    docs = vectorstore.similarity_search(" ".join(key_terms), k=10)
-    context = get_context_from_docs(docs)
+    with span("retrieve"):
+        docs = query_batcher.similarity_search(vectorstore, " ".join(key_terms), k=10)
+    with span("context_build"):
+        context = get_context_from_docs(docs)
     # Generate response
-    chain = qa_prompt | llm
-    return execute_chain(chain, llm, 
+    return execute_chain(qa_prompt, llm, workflow="qa", stream=stream,
         context=context, 
         question=question
     ) 
 
 
 
-def summarize_workflow(topic, vectorstore, llm, session_state):
+def summarize_workflow(topic, vectorstore, llm, session_state, stream=False):
     """
     Summarize the topic using the summarize prompt.
     """
     # Get relevant documents and context
-    docs = vectorstore.similarity_search(topic, k=10)
-    context = get_context_from_docs(docs)
+    with span("retrieve"):
+        docs = query_batcher.similarity_search(vectorstore, topic, k=10)
+    with span("context_build"):
+        context = get_context_from_docs(docs)
     # Generate summary
-    chain = summarize_prompt | llm
-    return execute_chain(chain, llm, 
+    return execute_chain(summarize_prompt, llm, workflow="summarize", stream=stream,
         context=context, 
         topic=topic
     )
 
 
 
-def quiz_workflow(topic, vectorstore, llm, session_state, num_questions=5):
+class PartialSummaryCache:
+    """
+    Thread-safe LRU cache of summaries, keyed by model and summarized content (chunk groups for the map step,
+    topic and partial summaries for the reduce step).
+    """
+    def __init__(self, max_size=DEFAULT_SUMMARY_CACHE_SIZE, name="partial_summary"):
+        self.max_size = max_size
+        self.name = name
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(llm, context):
+        model = getattr(llm, "model", type(llm).__name__)
+        return hashlib.sha256(f"{model}\0{context}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            summary = self._entries.get(key)
+            if summary is not None:
+                self._entries.move_to_end(key)
+        metrics.record_cache(self.name, summary is not None)
+        return summary
+
+    def put(self, key, summary):
+        with self._lock:
+            self._entries[key] = summary
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+
+partial_summary_cache = PartialSummaryCache()
+merged_summary_cache = PartialSummaryCache(name="merged_summary")
+
+
+
+def location_sort_key(doc):
+    """
+    Order chunks by source, then page/slide, so groups cover consecutive material.
+    """
+    metadata = doc.metadata or {}
+    number = metadata.get('slide_number', metadata.get('page_number', 0))
+    return (metadata.get('source', ''), number if isinstance(number, int) else 0)
+
+
+
+def doc_sources(doc):
+    """
+    Source files a chunk appears in, including near-duplicate copies collapsed at ingestion time.
+    """
+    sources = [doc.metadata.get('source')] + [d.get('source') for d in doc.metadata.get('duplicate_sources', [])]
+    return {source for source in sources if source}
+
+
+
+def stored_documents(vectorstore, source=None):
+    """
+    All indexed chunks, or only those of one source, from a single vectorstore or a sharded index.
+    """
+    if hasattr(vectorstore, "documents"):
+        return vectorstore.documents(source)
+    return [doc for doc in vectorstore.docstore._dict.values() if source is None or source in doc_sources(doc)]
+
+
+
+def list_sources(vectorstore):
+    """
+    Names of all indexed source files.
+    """
+    if hasattr(vectorstore, "sources"):
+        return sorted(vectorstore.sources())
+    return sorted(set().union(*(doc_sources(doc) for doc in stored_documents(vectorstore))))
+
+
+
+def find_source_in_topic(vectorstore, topic):
+    """
+    Return the indexed source a topic names (e.g. "pos-tagging.pptx" or "pos-tagging"), if any.
+    The file name or its stem must appear as whole words, so "introduction to naive bayes" does not name intro.pptx.
+    """
+    topic_lower = topic.lower()
+    # Longest names first, so "intro-advanced.pptx" wins over "intro.pptx"
+    for source in sorted(list_sources(vectorstore), key=len, reverse=True):
+        for name in (source, source.rsplit('.', 1)[0]):
+            if re.search(rf"(?<![\w.-]){re.escape(name.lower())}(?![\w-]|\.\w)", topic_lower):
+                return source
+    return None
+
+
+
+def select_scope_docs(vectorstore, topic, source=None, k=DEFAULT_SUMMARY_RETRIEVE_K):
+    """
+    Select the chunks to summarize: every chunk of one source when given, otherwise the top k for the topic.
+    """
+    with span("retrieve"):
+        if source is not None:
+            docs = stored_documents(vectorstore, source)
+        else:
+            docs = query_batcher.similarity_search(vectorstore, topic, k=k)
+    return sorted(docs, key=location_sort_key)
+
+
+
+def group_docs(docs, group_size=DEFAULT_SUMMARY_GROUP_SIZE):
+    """
+    Split location-ordered chunks into groups of at most group_size that never span two sources.
+    """
+    groups = []
+    for doc in docs:
+        if groups and len(groups[-1]) < group_size and groups[-1][-1].metadata.get('source') == doc.metadata.get('source'):
+            groups[-1].append(doc)
+        else:
+            groups.append([doc])
+    return groups
+
+
+
+def summarize_group(docs, llm, cache=partial_summary_cache):
+    """
+    Summarize one chunk group into cited notes (the map step), reusing a cached summary when available.
+    """
+    with span("context_build"):
+        context = get_context_from_docs(docs)
+    key = cache.key(llm, context)
+    summary = cache.get(key)
+    if summary is None:
+        summary = execute_chain(partial_summary_prompt, llm, workflow="summarize_map", context=context)
+        cache.put(key, summary)
+    return summary
+
+
+
+def map_reduce_summarize_workflow(topic, vectorstore, llm, session_state, source=None, group_size=DEFAULT_SUMMARY_GROUP_SIZE,
+                                  max_concurrency=DEFAULT_SUMMARY_MAX_CONCURRENCY, stream=False):
+    """
+    Summarize a broad topic (or an entire source) hierarchically.
+    Chunk groups are summarized in parallel with at most max_concurrency LLM requests in flight, and the
+    partial summaries (which keep their source references) are then merged by the reduce prompt.
+    A scope that fits in a single group is summarized directly with the regular summarize prompt.
+    """
+    docs = select_scope_docs(vectorstore, topic, source)
+    groups = group_docs(docs, group_size)
+    if len(groups) <= 1:
+        with span("context_build"):
+            context = get_context_from_docs(docs)
+        return execute_chain(summarize_prompt, llm, workflow="summarize", stream=stream, context=context, topic=topic)
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="summarize-map") as executor:
+        partial_summaries = list(executor.map(lambda group: summarize_group(group, llm), groups))
+    # Reduce (cached too, so repeating a summary of unchanged material skips every LLM call)
+    summaries = "\n\n---\n\n".join(partial_summaries)
+    key = merged_summary_cache.key(llm, f"{topic}\0{summaries}")
+    summary = merged_summary_cache.get(key)
+    if summary is not None:
+        return iter([summary]) if stream else summary
+    response = execute_chain(reduce_summary_prompt, llm, workflow="summarize", stream=stream,
+        summaries=summaries,
+        topic=topic
+    )
+    if not stream:
+        merged_summary_cache.put(key, response)
+        return response
+    return cache_stream(response, merged_summary_cache, key)
+
+
+
+def cache_stream(chunks, cache, key):
+    """
+    Pass a response stream through, caching the full response once the stream has been read to the end.
+    """
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    cache.put(key, "".join(parts))
+
+
+
+def quiz_output_tokens(num_questions):
+    """
+    Output token cap for a quiz of num_questions, so long quizzes are not cut off by the quiz profile's fixed cap.
+    """
+    return max(DEFAULT_GENERATION_PROFILES["quiz"]["num_predict"], num_questions * DEFAULT_QUIZ_TOKENS_PER_QUESTION)
+
+
+
+def generate_valid_questions(llm, count, seen, **kwargs):
+    """
+    Stream one JSON quiz generation and validate each question as soon as it is complete.
+    The generation is stopped as soon as `count` valid questions have arrived.
+    Returns the valid questions and the reasons the others were rejected.
+    """
+    parser = QuestionStreamParser()
+    questions, problems = [], []
+    stream = execute_chain(structured_quiz_prompt, llm, workflow="quiz", stream=True, llm_options={"format": "json", "num_predict": quiz_output_tokens(count)},
+                           num_questions=count, **kwargs)
+    try:
+        for chunk in stream:
+            for item in parser.feed(chunk):
+                question, problem = validate_question(item, seen)
+                if question is None:
+                    problems.append(problem)
+                    continue
+                questions.append(question)
+                seen.add(normalize_text(question["question"]))
+                if len(questions) >= count:
+                    return questions, problems
+    finally:
+        stream.close()
+    return questions, problems
+
+
+
+def structured_quiz(context, topic, num_questions, previous_questions, llm, max_retries=DEFAULT_QUIZ_MAX_RETRIES):
+    """
+    Generate a quiz as schema-validated JSON questions.
+    When some questions are invalid (or the output ends early), only the missing number of questions is
+    requested again, telling the model what was wrong and which questions it already has.
+    """
+    seen = {normalize_text(q) for q in previous_questions.splitlines() if q.strip()}
+    accepted = []
+    retry_note = ""
+    for attempt in range(max_retries + 1):
+        missing = num_questions - len(accepted)
+        questions, problems = generate_valid_questions(
+            llm, missing, seen, context=context, topic=topic, retry_note=retry_note,
+            previous_questions="\n".join([previous_questions] + [q["question"] for q in accepted]).strip(),
+        )
+        accepted.extend(questions)
+        if len(accepted) >= num_questions:
+            break
+        logger.info(f"Quiz attempt {attempt + 1}: {len(questions)} valid, {len(problems)} invalid "
+                    f"({', '.join(sorted(set(problems))) or 'output ended early'}); requesting {num_questions - len(accepted)} more")
+        if problems:
+            retry_note = "# Problems with some of your previous questions (avoid these):\n" + "\n".join(f"- {p}" for p in sorted(set(problems)))
+    with span("parse"):
+        questions = [format_question(i, q) for i, q in enumerate(accepted, 1)]
+        return {
+            'questions': questions,
+            'answers': [q["answer"] for q in accepted],
+            'formatted_quiz': "\n\n".join(questions),
+        }
+
+
+
+def quiz_workflow(topic, vectorstore, llm, session_state, num_questions=5, structured=DEFAULT_STRUCTURED_QUIZ,
+                  previous_questions=None):
     """
-    Generate a quiz based on the topic using the quiz prompt.
+    Generate a quiz based on the topic.
+    previous_questions lists questions the quiz should not repeat; by default they come from the session's quiz history.
+    With structured, questions are generated as validated JSON (see structured_quiz), falling back to the
+    free-text quiz prompt if no valid question comes back; otherwise the free-text quiz prompt is used.
     """
     # Get relevant documents and context
-    docs = vectorstore.similarity_search(topic, k=10)
-    context = get_context_from_docs(docs)
+    with span("retrieve"):
+        docs = query_batcher.similarity_search(vectorstore, topic, k=10)
+    with span("context_build"):
+        context = get_context_from_docs(docs)
     # Get previous questions to avoid repetition
-    previous_questions = "\n".join([
-        q for q, data in session_state.learning_progress.get('quiz_scores', {}).items()
-        if topic.lower() in q.lower()
-    ])
-    # Generate quiz
-    chain = quiz_prompt | llm
-    quiz_response = execute_chain(chain, llm,
+    if previous_questions is None:
+        previous_questions = [
+            q for q, data in session_state.learning_progress.get('quiz_scores', {}).items()
+            if topic.lower() in q.lower()
+        ]
+    previous_questions = "\n".join(previous_questions)
+    if structured:
+        quiz = structured_quiz(context, topic, num_questions, previous_questions, llm)
+        if quiz['questions']:
+            return quiz
+        logger.warning("Structured quiz generation returned no valid questions; falling back to the free-text quiz format")
+    # Generate quiz (stopping once the model starts a question beyond the requested number)
+    quiz_response = execute_chain(quiz_prompt, llm, workflow="quiz", llm_options={"stop": [f"Question {num_questions + 1}:"], "num_predict": quiz_output_tokens(num_questions)},
         context=context,
         topic=topic,
         num_questions=num_questions,
         previous_questions=previous_questions
     )
-    print("DEBUG: quiz_response:", quiz_response)
-    return parse_quiz_response(quiz_response)
+    logger.debug(f"quiz_response: {quiz_response}")
+    with span("parse"):
+        return parse_quiz_response(quiz_response)
 
 
 
@@ -191,15 +571,16 @@ def parse_quiz_response(quiz_response):
 
 
 
-def grade_workflow(questions, user_answers, correct_answers, topic, llm, session_state):
+def grade_workflow(questions, user_answers, correct_answers, topic, llm, session_state, stream=False):
     """
     Grade the quiz using the grade prompt.
     """
     # Prepare results
-    results = [
-        f"Q{i}: {'✓' if ua == ca else '✗'} - You answered {ua}, Correct: {ca}"
-        for i, (ua, ca) in enumerate(zip(user_answers, correct_answers), 1)
-    ]
+    with span("context_build"):
+        results = [
+            f"Q{i}: {'✓' if ua == ca else '✗'} - You answered {ua}, Correct: {ca}"
+            for i, (ua, ca) in enumerate(zip(user_answers, correct_answers), 1)
+        ]
     # Get student progress
     student_progress = {
         "topics": list(session_state.learning_progress['topics_covered']),
@@ -217,8 +598,7 @@ def grade_workflow(questions, user_answers, correct_answers, topic, llm, session
     else:
         formatted_quiz = ""
     # Generate feedback
-    chain = grade_prompt | llm
-    return execute_chain(chain, llm,
+    return execute_chain(grade_prompt, llm, workflow="grade", stream=stream,
         results="\n".join(results),
         topic=topic,
         student_progress=student_progress,